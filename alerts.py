@@ -0,0 +1,119 @@
+"""
+Low-stock alerts: every (ean, store) whose quantity is at or below its reorder point.
+
+The reorder point of a pair is its own reorder_point row, else its brand's
+brand_reorder_point, else DEFAULT_REORDER_POINT (unset: no alert). Upload engines
+re-check only the pairs they changed, in the same transaction as their inventory
+writes, so stock_alert always matches inventory and reading it costs O(alerts).
+"""
+import os
+
+from response_cache import bump_version
+
+_default = os.environ.get("DEFAULT_REORDER_POINT")
+DEFAULT_REORDER_POINT = int(_default) if _default else None
+ALERT_BATCH = 400  # (ean, store) pairs per lookup; two parameters each
+
+THRESHOLD_QUERY = """
+    SELECT i.product_ean, i.store_id, i.quantity, COALESCE(r.threshold, b.threshold, ?) AS threshold
+    FROM {source}
+    JOIN inventory i ON i.product_ean = c.product_ean AND i.store_id = c.store_id
+    JOIN product p ON p.ean = i.product_ean
+    LEFT JOIN reorder_point r ON r.product_ean = i.product_ean AND r.store_id = i.store_id
+    LEFT JOIN brand_reorder_point b ON b.brand = p.brand
+"""
+
+
+def _apply(cursor, rows, pairs):
+    """Make stock_alert hold exactly the alerting rows among `pairs`."""
+    alerting = [(ean, store_id, quantity, threshold) for ean, store_id, quantity, threshold in rows
+                if threshold is not None and quantity <= threshold]
+    raised = {(ean, store_id) for ean, store_id, _, _ in alerting}
+    cursor.executemany("""
+        INSERT INTO stock_alert (product_ean, store_id, quantity, threshold)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(product_ean, store_id) DO UPDATE
+        SET quantity = excluded.quantity, threshold = excluded.threshold
+    """, alerting)
+    cursor.executemany("DELETE FROM stock_alert WHERE product_ean = ? AND store_id = ?",
+                       [pair for pair in pairs if pair not in raised])
+
+
+def refresh_alerts(cursor, pairs):
+    """Re-check the alert state of the given (ean, store_id) pairs only."""
+    pairs = sorted(pairs)
+    for i in range(0, len(pairs), ALERT_BATCH):
+        batch = pairs[i:i + ALERT_BATCH]
+        source = ("(SELECT column1 AS product_ean, column2 AS store_id FROM (VALUES "
+                  + ", ".join(["(?, ?)"] * len(batch)) + ")) c")
+        cursor.execute(THRESHOLD_QUERY.format(source=source),
+                       [DEFAULT_REORDER_POINT] + [value for pair in batch for value in pair])
+        _apply(cursor, cursor.fetchall(), batch)
+
+
+def rebuild_alerts(conn):
+    """Recompute stock_alert from the whole inventory table. Returns the alert count."""
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM stock_alert")
+    cursor.execute(THRESHOLD_QUERY.format(source="inventory c"), [DEFAULT_REORDER_POINT])
+    rows = cursor.fetchall()
+    _apply(cursor, rows, [])
+    bump_version(cursor)
+    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM stock_alert")
+    return cursor.fetchone()[0]
+
+
+def set_reorder_points(cursor, points):
+    """
+    Store reorder points and re-check the pairs they cover. Each point is a dict with
+    threshold (None removes it) and either ean and store_id, or brand.
+    Returns the number of pairs re-checked.
+    """
+    pairs = set()
+    for point in points:
+        if point.get("brand") is not None:
+            if point["threshold"] is None:
+                cursor.execute("DELETE FROM brand_reorder_point WHERE brand = ?", (point["brand"],))
+            else:
+                cursor.execute("""
+                    INSERT INTO brand_reorder_point (brand, threshold) VALUES (?, ?)
+                    ON CONFLICT(brand) DO UPDATE SET threshold = excluded.threshold
+                """, (point["brand"], point["threshold"]))
+            cursor.execute("""
+                SELECT i.product_ean, i.store_id FROM inventory i
+                JOIN product p ON p.ean = i.product_ean
+                WHERE p.brand = ?
+            """, (point["brand"],))
+            pairs.update(map(tuple, cursor.fetchall()))
+        else:
+            key = (point["ean"], point["store_id"])
+            if point["threshold"] is None:
+                cursor.execute("DELETE FROM reorder_point WHERE product_ean = ? AND store_id = ?", key)
+            else:
+                cursor.execute("""
+                    INSERT INTO reorder_point (product_ean, store_id, threshold) VALUES (?, ?, ?)
+                    ON CONFLICT(product_ean, store_id) DO UPDATE SET threshold = excluded.threshold
+                """, key + (point["threshold"],))
+            pairs.add(key)
+    refresh_alerts(cursor, pairs)
+    bump_version(cursor)
+    return len(pairs)
+
+
+def list_alerts(cursor, store_id=None):
+    """Return the current alerts, lowest stock relative to threshold first."""
+    query = """
+        SELECT a.product_ean, p.style_name, p.brand, a.store_id, a.quantity, a.threshold, a.raised_at
+        FROM stock_alert a
+        JOIN product p ON p.ean = a.product_ean
+    """
+    params = []
+    if store_id is not None:
+        query += " WHERE a.store_id = ?"
+        params.append(store_id)
+    query += " ORDER BY a.quantity - a.threshold, a.product_ean, a.store_id"
+    cursor.execute(query, params)
+    return [{"ean": ean, "style_name": style_name, "brand": brand, "store_id": store, "quantity": quantity,
+             "threshold": threshold, "raised_at": raised_at}
+            for ean, style_name, brand, store, quantity, threshold, raised_at in cursor.fetchall()]
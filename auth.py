@@ -1,23 +1,153 @@
 from fastapi import Depends, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthCredentials
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 from datetime import datetime, timedelta
+import base64
 import hashlib
-from database import get_db
+import hmac
+import os
+import re
+import threading
+from cache import TTLCache
+from database import get_db, run_blocking, StorageExecutor
 
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 hours
 
+# Verified tokens, keyed by SHA-256 of the token; entries never outlive the token's exp
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "4096"))  # 0 disables
+TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", "300"))
+# Stored password hashes by username; call invalidate_user after changing one
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1024"))  # 0 disables
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "60"))
+
+_token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+_user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# New hashes use PASSWORD_HASHER; older rows are upgraded on their next successful login
+PASSWORD_HASHER = os.environ.get("PASSWORD_HASHER", "pbkdf2_sha256")
+PBKDF2_ITERATIONS = int(os.environ.get("PBKDF2_ITERATIONS", "600000"))
+SCRYPT_N = int(os.environ.get("SCRYPT_N", str(2 ** 14)))
+# KDF work runs on its own bounded pool, so a login burst never queues storage work
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_MAX_PENDING = int(os.environ.get("PASSWORD_MAX_PENDING", "64"))
+
 security = HTTPBearer()
 
+# ============ PASSWORD HASHING ============
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode().rstrip("=")
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+class PBKDF2Hasher:
+    """PBKDF2-HMAC-SHA256, stored as pbkdf2_sha256$<iterations>$<salt>$<hash>."""
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, iterations):
+        self.iterations = iterations
+
+    def encode(self, password, salt=None, iterations=None):
+        salt = salt or os.urandom(16)
+        iterations = iterations or self.iterations
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+        return f"{self.algorithm}${iterations}${_b64(salt)}${_b64(digest)}"
+
+    def verify(self, password, encoded):
+        _, iterations, salt, _ = encoded.split("$")
+        return hmac.compare_digest(self.encode(password, _unb64(salt), int(iterations)), encoded)
+
+    def needs_rehash(self, encoded):
+        return int(encoded.split("$")[1]) != self.iterations
+
+class ScryptHasher:
+    """scrypt, stored as scrypt$<n>$<r>$<p>$<salt>$<hash>."""
+    algorithm = "scrypt"
+
+    def __init__(self, n, r=8, p=1):
+        self.n, self.r, self.p = n, r, p
+
+    def encode(self, password, salt=None, params=None):
+        salt = salt or os.urandom(16)
+        n, r, p = params or (self.n, self.r, self.p)
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                                maxmem=256 * n * r, dklen=32)
+        return f"{self.algorithm}${n}${r}${p}${_b64(salt)}${_b64(digest)}"
+
+    def verify(self, password, encoded):
+        _, n, r, p, salt, _ = encoded.split("$")
+        params = (int(n), int(r), int(p))
+        return hmac.compare_digest(self.encode(password, _unb64(salt), params), encoded)
+
+    def needs_rehash(self, encoded):
+        return tuple(map(int, encoded.split("$")[1:4])) != (self.n, self.r, self.p)
+
+class LegacySHA256Hasher:
+    """Unsalted SHA-256 hex digests from before KDF hashing; verify-only."""
+    algorithm = "sha256"
+    pattern = re.compile(r"^[0-9a-f]{64}$")
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+
+    def needs_rehash(self, encoded):
+        return True
+
+HASHERS = {
+    "pbkdf2_sha256": PBKDF2Hasher(PBKDF2_ITERATIONS),
+    "scrypt": ScryptHasher(SCRYPT_N),
+}
+_legacy_hasher = LegacySHA256Hasher()
+
+def _hasher_for(encoded: str):
+    if _legacy_hasher.pattern.match(encoded):
+        return _legacy_hasher
+    return HASHERS[encoded.split("$", 1)[0]]
+
 def hash_password(password: str) -> str:
-    """Hash password using SHA256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password with the configured PASSWORD_HASHER and a fresh salt."""
+    return HASHERS[PASSWORD_HASHER].encode(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password against hash."""
-    return hash_password(plain_password) == hashed_password
+    """Verify password against a hash from any known hasher."""
+    try:
+        return _hasher_for(hashed_password).verify(plain_password, hashed_password)
+    except (KeyError, ValueError):
+        return False
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True when a stored hash is not PASSWORD_HASHER at its current cost."""
+    hasher = _hasher_for(hashed_password)
+    return hasher is not HASHERS[PASSWORD_HASHER] or hasher.needs_rehash(hashed_password)
+
+_password_executor = None
+_password_executor_lock = threading.Lock()
+_dummy_hash = None
+
+def _get_password_executor():
+    global _password_executor
+    if _password_executor is None:
+        with _password_executor_lock:
+            if _password_executor is None:
+                _password_executor = StorageExecutor(PASSWORD_WORKERS, PASSWORD_MAX_PENDING, name="password")
+    return _password_executor
+
+def password_executor_stats():
+    """Queue-depth counters of the password hashing pool."""
+    if _password_executor is None:
+        return {"workers": PASSWORD_WORKERS, "queued": 0, "running": 0, "completed": 0}
+    return _password_executor.stats()
+
+def shutdown_password_executor():
+    """Wait for in-flight hashing and stop the password pool."""
+    global _password_executor
+    with _password_executor_lock:
+        if _password_executor is not None:
+            _password_executor.shutdown()
+        _password_executor = None
 
 def create_access_token(username: str) -> str:
     """Create JWT access token."""
@@ -27,25 +157,77 @@ def create_access_token(username: str) -> str:
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_token(credentials: HTTPAuthCredentials = Depends(security)) -> str:
-    """Verify JWT token and return username."""
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """Verify JWT token and return username. Tokens verified before skip the HMAC check."""
+    key = hashlib.sha256(credentials.credentials.encode()).digest()
+    username = _token_cache.get(key)
+    if username is not None:
+        return username
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+        _token_cache.set(key, username, expires_at=payload.get("exp"))
         return username
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-def authenticate_user(username: str, password: str) -> bool:
-    """Authenticate user against database."""
+def get_password_hash(username: str):
+    """Return the stored password hash for username, or None; cached per process."""
+    password_hash = _user_cache.get(username)
+    if password_hash is None:
+        with get_db() as conn:
+            row = conn.execute("SELECT password_hash FROM user WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+        password_hash = row[0]
+        _user_cache.set(username, password_hash)
+    return password_hash
+
+def invalidate_user(username: str):
+    """Drop a user's cached credentials, e.g. after their password hash changes."""
+    _user_cache.invalidate(username)
+
+def auth_cache_stats():
+    """Hit/miss counters of the token and user caches."""
+    return {"tokens": _token_cache.stats(), "users": _user_cache.stats()}
+
+def set_password_hash(username: str, password_hash: str):
+    """Store a new password hash for username and drop its cached credentials."""
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT password_hash FROM user WHERE username = ?", (username,))
-        row = cursor.fetchone()
-        if row and verify_password(password, row[0]):
-            return True
-    return False
+        conn.execute("UPDATE user SET password_hash = ? WHERE username = ?", (password_hash, username))
+        conn.commit()
+    invalidate_user(username)
+
+def authenticate_user(username: str, password: str) -> bool:
+    """Authenticate user against database, upgrading an outdated password hash on success."""
+    password_hash = get_password_hash(username)
+    if password_hash is None or not verify_password(password, password_hash):
+        return False
+    if needs_rehash(password_hash):
+        set_password_hash(username, hash_password(password))
+    return True
+
+async def authenticate_user_async(username: str, password: str) -> bool:
+    """
+    authenticate_user for async handlers: the user lookup runs on the storage
+    executor and the KDF on the password pool, so neither blocks the event loop.
+    Unknown users are checked against a dummy hash to take as long as known ones.
+    """
+    global _dummy_hash
+    password_hash = await run_blocking(get_password_hash, username)
+    if password_hash is None:
+        if _dummy_hash is None:
+            # Hashed on the pool too: the KDF would otherwise stall the loop on the first miss
+            _dummy_hash = await _get_password_executor().run(hash_password, os.urandom(16).hex())
+        await _get_password_executor().run(verify_password, password, _dummy_hash)
+        return False
+    if not await _get_password_executor().run(verify_password, password, password_hash):
+        return False
+    if needs_rehash(password_hash):
+        new_hash = await _get_password_executor().run(hash_password, password)
+        await run_blocking(set_password_hash, username, new_hash)
+    return True
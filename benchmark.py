@@ -0,0 +1,1088 @@
+"""
+In-process benchmarks for the inventory hot paths.
+Run: python benchmark.py import --rows 200000
+
+`suite` times every endpoint on seeded datagen data at each of --sizes and can
+write the results as JSON and compare them with an earlier run:
+    python benchmark.py suite --sizes 1000,10000,100000 --json before.json
+    python benchmark.py suite --sizes 1000,10000,100000 --json after.json --baseline before.json
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fastapi import Response
+
+import database
+import datagen
+import ingest
+import metrics
+import profiling
+import response_cache
+from ingest import import_rows, sales_rows, transfer_rows
+
+from datagen import BRANDS
+
+
+def fresh_db():
+    """Point the app at an empty temporary database and create the schema."""
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="bench_")
+    os.close(fd)
+    os.remove(path)
+    database.DATABASE_PATH = path
+    database.init_db()
+    with database.get_db() as conn:
+        conn.executemany("INSERT INTO store (store_name) VALUES (?)",
+                         [(f"Store {i}",) for i in range(1, 5)] + [("ECommerce",)])
+        conn.commit()
+    return path
+
+
+def catalogue_eans(products):
+    """The EANs datagen.seed_stock loads for `products` products, for writing upload files first."""
+    return [item[0] for item in datagen.catalogue(products)]
+
+
+def legacy_import(cursor, reader):
+    """The original row-by-row import loop, kept as the benchmark baseline."""
+    errors = []
+    success_count = 0
+    for row_num, row in enumerate(reader, start=2):
+        ean = row['ean'].strip()
+        store_id = int(row['store_id'])
+        quantity = int(row['quantity'])
+        cursor.execute("SELECT store_id FROM store WHERE store_id = ?", (store_id,))
+        if not cursor.fetchone():
+            errors.append({"row": row_num, "error": f"Store {store_id} does not exist"})
+            continue
+        cursor.execute("SELECT ean FROM product WHERE ean = ?", (ean,))
+        if not cursor.fetchone():
+            cursor.execute("""
+                INSERT INTO product (ean, style_name, size, brand, style_design_code, model_no)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (ean, row['style_name'], row['size'], row['brand'],
+                  row['style_design_code'] or None, row['model_no'] or None))
+        cursor.execute("""
+            INSERT INTO inventory (product_ean, store_id, quantity)
+            VALUES (?, ?, ?)
+            ON CONFLICT(product_ean, store_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        """, (ean, store_id, quantity))
+        cursor.execute("""
+            INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type)
+            VALUES (?, ?, ?, 'Import')
+        """, (ean, store_id, quantity))
+        success_count += 1
+    return success_count, errors
+
+
+def timed_import(engine, csv_path):
+    """Run one import engine against a fresh database and return rows/second."""
+    path = fresh_db()
+    try:
+        start = time.perf_counter()
+        with database.get_db() as conn, open(csv_path, newline="") as f:
+            cursor = conn.cursor()
+            success_count, errors = engine(cursor, csv.DictReader(f))
+            conn.commit()
+        elapsed = time.perf_counter() - start
+    finally:
+        os.remove(path)
+    return success_count / elapsed, elapsed
+
+
+def bench_import(args):
+    fd, csv_path = tempfile.mkstemp(suffix=".csv", prefix="bench_import_")
+    os.close(fd)
+    datagen.write_import_csv(csv_path, args.rows, max(1, args.rows // 5))
+    print(f"Import of {args.rows} rows")
+    try:
+        for name, engine in [("row-by-row", legacy_import), ("bulk", import_rows)]:
+            rate, elapsed = timed_import(engine, csv_path)
+            print(f"  {name:<12} {elapsed:8.2f}s  {rate:12,.0f} rows/s")
+    finally:
+        os.remove(csv_path)
+
+
+def legacy_sales(cursor, reader):
+    """The original row-by-row sales loop, kept as the benchmark baseline."""
+    errors = []
+    success_count = 0
+    timestamp = ingest.upload_timestamp(cursor)
+    for row_num, row in enumerate(reader, start=2):
+        ean = row['ean'].strip()
+        store_id = int(row['store_id'])
+        quantity_sold = int(row['quantity_sold'])
+        cursor.execute("SELECT store_id FROM store WHERE store_id = ?", (store_id,))
+        if not cursor.fetchone():
+            errors.append({"row": row_num, "error": f"Store {store_id} does not exist"})
+            continue
+        cursor.execute("SELECT ean FROM product WHERE ean = ?", (ean,))
+        if not cursor.fetchone():
+            errors.append({"row": row_num, "error": f"Product {ean} does not exist"})
+            continue
+        cursor.execute("SELECT quantity FROM inventory WHERE product_ean = ? AND store_id = ?",
+                       (ean, store_id))
+        inv_row = cursor.fetchone()
+        current_qty = inv_row[0] if inv_row else 0
+        if current_qty < quantity_sold:
+            errors.append({"row": row_num,
+                           "error": f"Insufficient stock. Available: {current_qty}, Sold: {quantity_sold}"})
+            continue
+        cursor.execute("UPDATE inventory SET quantity = quantity - ? WHERE product_ean = ? AND store_id = ?",
+                       (quantity_sold, ean, store_id))
+        cursor.execute("""
+            INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type, timestamp)
+            VALUES (?, ?, ?, 'Sale', ?)
+        """, (ean, store_id, -quantity_sold, timestamp))
+        success_count += 1
+    return success_count, errors
+
+
+def bench_sales(args):
+    products = args.products if args.products > 20 else 2000
+    fd, csv_path = tempfile.mkstemp(suffix=".csv", prefix="bench_sales_")
+    os.close(fd)
+    datagen.write_sales_csv(csv_path, args.rows, catalogue_eans(products))
+    print(f"Sales upload of {args.rows} rows over 5 stores and {products} products, {os.cpu_count()} CPU(s)")
+    engines = [("row-by-row", legacy_sales, 1), ("partitioned", sales_rows, 1),
+               ("partitioned x5", sales_rows, 5)]
+    baseline = None
+    try:
+        for name, engine, workers in engines:
+            ingest.SALES_WORKERS = workers
+            path = fresh_db()
+            with database.get_db() as conn:
+                datagen.seed_stock(conn, products)
+            try:
+                start = time.perf_counter()
+                with database.get_db() as conn, open(csv_path, newline="") as f:
+                    cursor = conn.cursor()
+                    result = engine(cursor, csv.DictReader(f))
+                    conn.commit()
+                elapsed = time.perf_counter() - start
+            finally:
+                ingest.shutdown_sales_pool()
+                database.close_pool()
+                os.remove(path)
+            baseline = baseline or result
+            same = "same result" if result == baseline else "RESULT DIFFERS"
+            print(f"  {name:<15} {elapsed:8.2f}s  {args.rows / elapsed:12,.0f} rows/s  "
+                  f"{result[0]:,} sold, {len(result[1]):,} errors ({same})")
+    finally:
+        os.remove(csv_path)
+
+
+def legacy_transfer(cursor, reader):
+    """The original row-by-row transfer loop, kept as the benchmark baseline."""
+    errors = []
+    success_count = 0
+    timestamp = ingest.upload_timestamp(cursor)
+    for row_num, row in enumerate(reader, start=2):
+        ean = row['ean'].strip()
+        source, destination = int(row['source_store_id']), int(row['destination_store_id'])
+        quantity = int(row['quantity'])
+        cursor.execute("SELECT store_id FROM store WHERE store_id IN (?, ?)", (source, destination))
+        if len(cursor.fetchall()) != 2:
+            errors.append({"row": row_num, "error": "Invalid source or destination store"})
+            continue
+        cursor.execute("SELECT ean FROM product WHERE ean = ?", (ean,))
+        if not cursor.fetchone():
+            errors.append({"row": row_num, "error": f"Product {ean} does not exist"})
+            continue
+        cursor.execute("SELECT quantity FROM inventory WHERE product_ean = ? AND store_id = ?",
+                       (ean, source))
+        inv_row = cursor.fetchone()
+        current_qty = inv_row[0] if inv_row else 0
+        if current_qty < quantity:
+            errors.append({"row": row_num,
+                           "error": f"Insufficient stock. Available: {current_qty}, Requested: {quantity}"})
+            continue
+        cursor.execute("UPDATE inventory SET quantity = quantity - ? WHERE product_ean = ? AND store_id = ?",
+                       (quantity, ean, source))
+        cursor.execute("""
+            INSERT INTO inventory (product_ean, store_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT(product_ean, store_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        """, (ean, destination, quantity))
+        cursor.executemany("""
+            INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type, timestamp)
+            VALUES (?, ?, ?, 'Transfer', ?)
+        """, [(ean, source, -quantity, timestamp), (ean, destination, quantity, timestamp)])
+        success_count += 1
+    return success_count, errors
+
+
+def timed_upload(engine, csv_path, products):
+    """Run one upload engine over `csv_path` against a freshly seeded catalogue."""
+    path = fresh_db()
+    with database.get_db() as conn:
+        datagen.seed_stock(conn, products)
+    try:
+        start = time.perf_counter()
+        with database.get_db() as conn, open(csv_path, newline="") as f:
+            cursor = conn.cursor()
+            result = engine(cursor, csv.DictReader(f))
+            conn.commit()
+            stock = conn.execute("SELECT * FROM inventory ORDER BY product_ean, store_id").fetchall()
+        return time.perf_counter() - start, result, [tuple(r) for r in stock]
+    finally:
+        database.close_pool()
+        os.remove(path)
+
+
+def bench_transfer(args):
+    products = args.products if args.products > 20 else 2000
+    fd, csv_path = tempfile.mkstemp(suffix=".csv", prefix="bench_transfer_")
+    os.close(fd)
+    datagen.write_transfer_csv(csv_path, args.rows, catalogue_eans(products))
+    print(f"Transfer upload of {args.rows} rows over 5 stores and {products} products")
+    baseline = None
+    try:
+        for name, engine in [("row-by-row", legacy_transfer), ("in-memory", transfer_rows)]:
+            elapsed, result, stock = timed_upload(engine, csv_path, products)
+            baseline = baseline or (result, stock)
+            same = "same result" if (result, stock) == baseline else "RESULT DIFFERS"
+            print(f"  {name:<12} {elapsed:8.2f}s  {args.rows / elapsed:12,.0f} rows/s  "
+                  f"{result[0]:,} moved, {len(result[1]):,} errors ({same})")
+    finally:
+        os.remove(csv_path)
+
+
+def bench_auth(args):
+    import auth
+    from fastapi.security import HTTPAuthorizationCredentials
+
+    path = fresh_db()
+    database.seed_initial_data()
+    tokens = [HTTPAuthorizationCredentials(scheme="Bearer", credentials=auth.create_access_token(f"tablet{i}"))
+              for i in range(50)]
+    print(f"Auth hot path: {args.requests} calls over {len(tokens)} tokens / 1 user")
+    try:
+        for name, size in [("uncached", 0), ("cached", auth.TOKEN_CACHE_SIZE)]:
+            auth._token_cache = auth.TTLCache(size, auth.TOKEN_CACHE_TTL)
+            auth._user_cache = auth.TTLCache(size, auth.USER_CACHE_TTL)
+            start = time.perf_counter()
+            for i in range(args.requests):
+                auth.verify_token(tokens[i % len(tokens)])
+            verify_rate = args.requests / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                auth.authenticate_user("admin", "admin123")
+            login_rate = args.requests / (time.perf_counter() - start)
+            print(f"  {name:<10} verify_token {verify_rate:10,.0f}/s   authenticate_user {login_rate:10,.0f}/s")
+        print(f"  cache stats: {auth.auth_cache_stats()}")
+    finally:
+        database.close_pool()
+        os.remove(path)
+
+
+def bench_login(args):
+    import auth
+    import main
+    from models import UserLogin
+
+    path = fresh_db()
+    database.seed_initial_data()
+    with database.get_db() as conn:
+        datagen.seed_stock(conn, args.products)
+    credentials = UserLogin(username="admin", password="admin123")
+    logins = max(1, args.requests // 100)
+
+    async def inline_login(credentials):
+        # The pre-pool handler: the KDF runs on the event loop
+        if not auth.authenticate_user(credentials.username, credentials.password):
+            raise RuntimeError("login failed")
+
+    async def run(login, concurrency=16):
+        pending = iter(range(logins))
+        read_latencies = []
+        done = asyncio.Event()
+
+        async def client():
+            for _ in pending:
+                await login(credentials)
+
+        async def reader():
+            while not done.is_set():
+                start = time.perf_counter()
+                await main.get_stock_status(Response(), limit=10, username="bench")
+                read_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.005)
+
+        read_task = asyncio.create_task(reader())
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await read_task
+        read_latencies.sort()
+        return logins / elapsed, read_latencies[int(len(read_latencies) * 0.99)]
+
+    hasher = auth.HASHERS[auth.PASSWORD_HASHER]
+    print(f"Login burst: {logins} logins from 16 clients, {auth.PASSWORD_HASHER} "
+          f"({getattr(hasher, 'iterations', getattr(hasher, 'n', ''))}), {os.cpu_count()} CPU(s), "
+          f"page-of-10 stock reads alongside")
+    try:
+        for name, login in [("on event loop", inline_login), ("password pool", main.login)]:
+            throughput, read_p99 = asyncio.run(run(login))
+            print(f"  {name:<14} {throughput:8.1f} logins/s   stock read p99 {read_p99 * 1000:8.1f} ms")
+    finally:
+        auth.shutdown_password_executor()
+        database.shutdown_executor()
+        database.close_pool()
+        os.remove(path)
+
+
+def bench_cache(args):
+    import main
+
+    products = args.products if args.products > 20 else 2000
+    path = fresh_db()
+    cache_dir = tempfile.mkdtemp(prefix="bench_cache_")
+    with database.get_db() as conn:
+        datagen.seed_ledger(conn, args.rows, products)
+    upload_every = 200  # A committed upload between polls invalidates every entry
+
+    async def poll(conditional):
+        etags = {}
+        latencies = []
+        for i in range(args.requests):
+            if i and i % upload_every == 0:
+                with database.get_db() as conn:
+                    response_cache.bump_version(conn.cursor())
+                    conn.commit()
+            view = i % 2
+            response = Response()
+            start = time.perf_counter()
+            if view:
+                result = await main.get_analytics(response, k=10, if_none_match=etags.get(view),
+                                                  username="bench")
+            else:
+                result = await main.get_stock_status(response, limit=100, if_none_match=etags.get(view),
+                                                     username="bench")
+            latencies.append(time.perf_counter() - start)
+            if conditional:
+                etags[view] = (result if isinstance(result, Response) else response).headers["etag"]
+        latencies.sort()
+        return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+    print(f"Polling {args.requests} reads (stock-status page of 100 / analytics k=10, alternating) "
+          f"over {products} products, an upload every {upload_every} reads")
+    modes = [("off", "off", False), ("memory", "memory", False),
+             ("sqlite", f"sqlite:{os.path.join(cache_dir, 'cache.db')}", False),
+             ("memory + 304", "memory", True)]
+    try:
+        for name, setting, conditional in modes:
+            response_cache.RESPONSE_CACHE = setting
+            response_cache.reset_response_cache()
+            p50, p99 = asyncio.run(poll(conditional))
+            stats = response_cache.get_response_cache().stats()
+            print(f"  {name:<13} p50 {p50 * 1000:7.2f} ms  p99 {p99 * 1000:7.2f} ms  "
+                  f"hit rate {stats['hit_rate']:6.1%}  ({stats['hits']} hits, "
+                  f"{stats['not_modified']} 304s, {stats['misses']} misses)")
+    finally:
+        database.shutdown_executor()
+        database.close_pool()
+        os.remove(path)
+        for name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, name))
+        os.rmdir(cache_dir)
+
+
+def bench_export(args):
+    import export
+    from pydantic import TypeAdapter
+    from models import StockStatusResponse
+    from queries import iter_stock_status
+
+    products = args.products if args.products > 20 else 100_000
+    path = fresh_db()
+    with database.get_db() as conn:
+        datagen.seed_stock(conn, products)
+    stock_list = TypeAdapter(list[StockStatusResponse])
+
+    def current_json():
+        # What /inventory/stock-status does: build dicts, validate the response model, dump JSON
+        with database.get_db() as conn:
+            items = list(iter_stock_status(conn.cursor()))
+        yield stock_list.dump_json(stock_list.validate_python(items))
+
+    print(f"Full stock snapshot of {products:,} products x 5 stores")
+    try:
+        for name, stream in [("JSON (current)", current_json), ("csv.gz", export.stream_csv_gz),
+                             ("columnar", export.stream_columnar)]:
+            start = time.perf_counter()
+            size = sum(len(chunk) for chunk in stream())
+            elapsed = time.perf_counter() - start
+            print(f"  {name:<15} {elapsed:8.3f}s  {products / elapsed:12,.0f} products/s  "
+                  f"{size / 1024 / 1024:8.2f} MiB")
+    finally:
+        database.close_pool()
+        os.remove(path)
+
+
+def bench_as_of(args):
+    from snapshots import nearest_base, stock_as_of_query, replay_query
+
+    products = args.products if args.products > 20 else 2000
+    snapshot_every = 30  # days
+    print(f"As-of stock over {products} products, a snapshot every {snapshot_every} days")
+    for rows in args.sizes:
+        path = fresh_db()
+        try:
+            with database.get_db() as conn:
+                datagen.seed_ledger(conn, rows, products, years=1)
+                # Snapshots at day ends, built from the ledger as if taken at the time
+                for day in range(snapshot_every, 365, snapshot_every):
+                    ts = conn.execute("SELECT DATETIME('2023-01-01', ?, '-1 second')",
+                                      (f"+{day + 1} days",)).fetchone()[0]
+                    conn.execute("""
+                        INSERT INTO inventory_snapshot_meta (snapshot_ts, last_transaction_id)
+                        SELECT ?, COALESCE(MAX(transaction_id), 0) FROM [transaction] WHERE timestamp <= ?
+                    """, (ts, ts))
+                    conn.execute("""
+                        INSERT INTO inventory_snapshot (snapshot_ts, product_ean, store_id, quantity)
+                        SELECT ?, product_ean, store_id, quantity FROM ({})
+                    """.format(replay_query(ts)[0]), (ts, ts))
+                conn.commit()
+
+                print(f"  {rows:,} ledger rows")
+                for days_after in (1, 3, 7, 14):
+                    as_of = conn.execute("SELECT DATETIME('2023-01-01', ?, '-1 second')",
+                                         (f"+{180 + days_after + 1} days",)).fetchone()[0]
+                    base = nearest_base(conn.cursor(), as_of)
+                    delta = conn.execute("SELECT COUNT(*) FROM [transaction] WHERE timestamp > ? AND timestamp <= ?",
+                                         sorted([base[0], as_of])).fetchone()[0]
+                    start = time.perf_counter()
+                    fast = conn.execute(*stock_as_of_query(base, as_of)).fetchall()
+                    snapshot_s = time.perf_counter() - start
+                    start = time.perf_counter()
+                    full = conn.execute(*replay_query(as_of)).fetchall()
+                    replay_s = time.perf_counter() - start
+                    same = "same" if sorted(map(tuple, fast)) == sorted(map(tuple, full)) else "DIFFERENT"
+                    print(f"    as of day {180 + days_after:>3} ({delta:>7,} delta rows)  "
+                          f"snapshot+delta {snapshot_s * 1000:8.1f} ms   full replay {replay_s * 1000:8.1f} ms  ({same})")
+        finally:
+            database.close_pool()
+            os.remove(path)
+
+
+def bench_metrics(args):
+    import main
+    products = args.products if args.products > 20 else 2000
+    ingest.SALES_WORKERS = 1
+    print(f"Metrics overhead: /inventory/stock-status x{args.requests} (best of 3, alternating), "
+          f"then a sales upload of {args.rows} rows")
+
+    async def reads():
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            await main.get_stock_status(Response(), limit=50, store_id=3, in_stock=True, username="bench")
+        return args.requests / (time.perf_counter() - start)
+
+    path = fresh_db()
+    with database.get_db() as conn:
+        datagen.seed_stock(conn, products)
+    rates = {False: 0, True: 0}
+    try:
+        for _ in range(3):
+            for enabled in rates:
+                metrics.METRICS_ENABLED = enabled
+                database.close_pool()  # Reconnect with the matching connection factory
+                rates[enabled] = max(rates[enabled], asyncio.run(reads()))
+    finally:
+        database.close_pool()
+        os.remove(path)
+
+    fd, csv_path = tempfile.mkstemp(suffix=".csv", prefix="bench_metrics_")
+    os.close(fd)
+    datagen.write_sales_csv(csv_path, args.rows, catalogue_eans(products))
+    try:
+        for enabled in rates:
+            metrics.METRICS_ENABLED = enabled
+            metrics.reset()
+            path = fresh_db()
+            with database.get_db() as conn:
+                datagen.seed_stock(conn, products)
+            try:
+                start = time.perf_counter()
+                with open(csv_path, "rb") as f:
+                    summary = ingest.run_upload(sales_rows, ingest.read_csv(f))
+                elapsed = time.perf_counter() - start
+            finally:
+                database.close_pool()
+                os.remove(path)
+            print(f"  metrics {'on ' if enabled else 'off'}  reads {rates[enabled]:8,.0f} req/s   "
+                  f"upload {elapsed:6.2f}s ({summary.success_count:,} sold)")
+
+        series = metrics.UPLOAD_STAGE_SECONDS._series
+        print("  upload stages:  " + "  ".join(
+            f"{stage} {value[1]:.2f}s" for (_, stage), value in sorted(series.items(), key=lambda kv: -kv[1][1])))
+    finally:
+        os.remove(csv_path)
+
+
+def bench_profile(args):
+    import main
+    products = args.products if args.products > 20 else 2000
+    eans = [item[0] for item in datagen.catalogue(products)]
+    fd, csv_path = tempfile.mkstemp(suffix=".csv", prefix="bench_profile_")
+    os.close(fd)
+    datagen.write_sales_csv(csv_path, args.rows, eans)
+    print(f"Query profiling overhead: sales upload of {args.rows} rows, then "
+          f"/inventory/stock-status x{args.requests} (limit 50)")
+
+    async def reads():
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            await main.get_stock_status(Response(), limit=50, in_stock=True, username="bench")
+        return args.requests / (time.perf_counter() - start)
+
+    try:
+        for enabled in (False, True):
+            profiling.QUERY_PROFILE = enabled
+            profiling.stats.reset()
+            path = fresh_db()  # New connections pick up the factory
+            try:
+                with database.get_db() as conn:
+                    datagen.seed_stock(conn, products, quantity=args.rows)
+                start = time.perf_counter()
+                _call_upload(main.record_sales, csv_path)
+                elapsed = time.perf_counter() - start
+                rate = asyncio.run(reads())
+            finally:
+                ingest.shutdown_sales_pool()
+                database.close_pool()
+                os.remove(path)
+            print(f"  profiling {'on ' if enabled else 'off'}  upload {elapsed:6.2f}s   reads {rate:8,.0f} req/s")
+
+        print("  top statements by total time:")
+        for entry in profiling.stats.top(5)["top"]:
+            print(f"    {entry['total_ms']:9.1f} ms  {entry['calls']:6,} calls  {entry['rows']:9,} rows  "
+                  f"{entry['statement'][:90]}")
+    finally:
+        profiling.QUERY_PROFILE = False
+        os.remove(csv_path)
+
+
+def bench_alerts(args):
+    from alerts import refresh_alerts, rebuild_alerts
+    batches = (100, 1000, 10_000)
+    print("Low-stock alert evaluation: incremental re-check of a batch vs a full inventory scan")
+    for products in (2_000, 20_000, 200_000):
+        path = fresh_db()
+        try:
+            with database.get_db() as conn:
+                eans = datagen.seed_stock(conn, products, quantity=10)
+                # Thresholds around the stock level, so about half the pairs alert
+                conn.executemany("INSERT INTO brand_reorder_point (brand, threshold) VALUES (?, ?)",
+                                 [(brand, 5 + 5 * (i % 2)) for i, brand in enumerate(BRANDS)])
+                conn.commit()
+                start = time.perf_counter()
+                alerts = rebuild_alerts(conn)
+                full = time.perf_counter() - start
+
+                rng = random.Random(42)
+                pairs = [(ean, store_id) for ean in eans for store_id in range(1, 6)]
+                timings = []
+                for batch in batches:
+                    changed = rng.sample(pairs, min(batch, len(pairs)))
+                    start = time.perf_counter()
+                    refresh_alerts(conn.cursor(), changed)
+                    timings.append(time.perf_counter() - start)
+                    conn.rollback()
+            print(f"  {len(pairs):>9,} pairs, {alerts:>7,} alerts   full scan {full * 1000:8.1f} ms   " + "   ".join(
+                f"batch {batch:>6,}: {seconds * 1000:7.1f} ms" for batch, seconds in zip(batches, timings)))
+        finally:
+            database.close_pool()
+            os.remove(path)
+
+
+def legacy_velocity(cursor, today, window, alpha, history):
+    """Per-row Python accumulation of the same velocities, kept as the benchmark baseline."""
+    cursor.row_factory = None
+    end = datetime.date.fromisoformat(today)
+    cursor.execute("SELECT product_ean, store_id, day, sold FROM daily_movement WHERE day > ? AND day <= ?",
+                   (str(end - datetime.timedelta(days=history)), today))
+    moving_average, smoothed = {}, {}
+    for ean, store_id, day, sold in cursor:
+        age = (end - datetime.date.fromisoformat(day)).days
+        if age < window:
+            moving_average[ean, store_id] = moving_average.get((ean, store_id), 0) + sold / window
+        smoothed[ean, store_id] = smoothed.get((ean, store_id), 0) + sold * alpha * (1 - alpha) ** age
+    return moving_average, smoothed
+
+
+def bench_forecast(args):
+    import forecast
+    products, stores, days, end = 100_000, 5, 730, "2024-12-31"
+    print(f"Sales-velocity forecast: {products:,} EANs x {stores} stores x {days} days of sales")
+    for rows in args.sizes:
+        path = fresh_db()
+        try:
+            with database.get_db() as conn:
+                eans = datagen.seed_stock(conn, products, stores, quantity=20)
+                sales_rows = datagen.seed_daily_sales(conn, rows, eans, stores, days, end)
+
+                start = time.perf_counter()
+                legacy_velocity(conn.cursor(), end, forecast.FORECAST_WINDOW_DAYS, forecast.FORECAST_ALPHA, days)
+                legacy_s = time.perf_counter() - start
+                start = time.perf_counter()
+                forecast.compute_velocity(conn.cursor(), end, history=days)
+                velocity_s = time.perf_counter() - start
+
+                # Cold reads the sales; after another kind of upload the velocities are
+                # reused and only cover and transfers are recomputed; then fully cached
+                forecast.reset_forecast()
+                timings = []
+                for bump in (False, True, False):
+                    if bump:
+                        response_cache.bump_version(conn.cursor())
+                        conn.commit()
+                    start = time.perf_counter()
+                    result = forecast.forecast(conn, today=end)
+                    forecast.forecast_rows(result, order="suggested_transfer", limit=1000)
+                    timings.append(time.perf_counter() - start)
+            moved = int(result["suggested_transfer"].clip(min=0).sum())
+            print(f"  {sales_rows:>10,} sales rows  velocity: python {legacy_s:6.2f} s  numpy {velocity_s:6.2f} s   "
+                  f"forecast cold {timings[0]:5.2f} s  after upload {timings[1]:5.2f} s  "
+                  f"cached {timings[2] * 1000:5.1f} ms  ({moved:,} units to move)")
+        finally:
+            database.close_pool()
+            os.remove(path)
+
+
+def bench_pool(args):
+    import main
+    requests = args.requests
+    path = fresh_db()
+    with database.get_db() as conn:
+        datagen.seed_stock(conn, args.products)
+
+    async def run():
+        start = time.perf_counter()
+        for _ in range(requests):
+            await main.get_stock_status(Response(), limit=50, store_id=3, in_stock=True, username="bench")
+        return requests / (time.perf_counter() - start)
+
+    print(f"/inventory/stock-status x{requests} ({args.products} products)")
+    try:
+        for name, size in [("no pool", 0), ("pooled", 8)]:
+            database.POOL_SIZE = size
+            database.close_pool()
+            print(f"  {name:<12} {asyncio.run(run()):10,.0f} req/s")
+    finally:
+        database.close_pool()
+        os.remove(path)
+
+
+def legacy_stock_status(cursor):
+    """The original one-query-per-EAN stock-status loop, kept as the benchmark baseline."""
+    from models import StockStatusResponse
+    cursor.execute("SELECT DISTINCT p.ean, p.style_name, p.brand FROM product p ORDER BY p.ean")
+    result = []
+    for ean, style_name, brand in cursor.fetchall():
+        cursor.execute("SELECT store_id, quantity FROM inventory WHERE product_ean = ? ORDER BY store_id", (ean,))
+        stores = {}
+        total = 0
+        for store_id, qty in cursor.fetchall():
+            stores[str(store_id)] = qty
+            total += qty
+        result.append(StockStatusResponse(ean=ean, style_name=style_name, brand=brand,
+                                          stores=stores, total_quantity=total))
+    return result
+
+
+def bench_stock_status(args):
+    import main
+
+    async def consume(response):
+        first = None
+        start = time.perf_counter()
+        async for _ in response.body_iterator:
+            if first is None:
+                first = time.perf_counter() - start
+        return first
+
+    for rows in args.sizes:
+        path = fresh_db()
+        with database.get_db() as conn:
+            datagen.seed_stock(conn, rows // 5)
+        print(f"/inventory/stock-status with {rows:,} inventory rows")
+        try:
+            with database.get_db() as conn:
+                start = time.perf_counter()
+                legacy_stock_status(conn.cursor())
+                print(f"  {'N+1 queries':<14} {time.perf_counter() - start:8.3f}s")
+
+            start = time.perf_counter()
+            asyncio.run(main.get_stock_status(Response(), username="bench"))
+            print(f"  {'joined query':<14} {time.perf_counter() - start:8.3f}s")
+
+            start = time.perf_counter()
+            response = asyncio.run(main.get_stock_status(Response(), format="ndjson", username="bench"))
+            first = asyncio.run(consume(response))
+            print(f"  {'ndjson stream':<14} {time.perf_counter() - start:8.3f}s"
+                  f"  (first chunk after {first * 1000:.1f} ms)")
+        finally:
+            database.close_pool()
+            os.remove(path)
+
+
+def bench_stock_page(args):
+    import main
+
+    for rows in args.sizes:
+        path = fresh_db()
+        with database.get_db() as conn:
+            eans = datagen.seed_stock(conn, rows // 5)
+        try:
+            for label, filters in [("first page", {}), ("deep page", {"cursor": eans[len(eans) // 2]}),
+                                   ("brand", {"brand": "Vogue"}), ("store in stock", {"store_id": 3, "in_stock": True})]:
+                start = time.perf_counter()
+                for _ in range(100):
+                    asyncio.run(main.get_stock_status(Response(), limit=50, username="bench", **filters))
+                elapsed = (time.perf_counter() - start) / 100
+                print(f"  {rows:>10,} rows  {label:<16} {elapsed * 1000:7.2f} ms/page")
+        finally:
+            database.close_pool()
+            os.remove(path)
+
+
+def bench_rollup(args):
+    from queries import movement_query, ledger_movement_query
+    from rollup import rebuild_daily_movement
+
+    path = fresh_db()
+    try:
+        start = time.perf_counter()
+        with database.get_db() as conn:
+            datagen.seed_ledger(conn, args.rows, 2000, years=1)
+        print(f"Ledger of {args.rows:,} rows seeded in {time.perf_counter() - start:.1f}s")
+        with database.get_db() as conn:
+            start = time.perf_counter()
+            rollup_rows = rebuild_daily_movement(conn)
+            print(f"  backfill      {time.perf_counter() - start:8.2f}s  ({rollup_rows:,} rollup rows)")
+            for label, filters in [("all time", {}), ("one store", {"store_id": 2}),
+                                   ("one month", {"start_date": "2023-06-01", "end_date": "2023-06-30"})]:
+                timings = {}
+                for name, builder in [("ledger", ledger_movement_query), ("rollup", movement_query)]:
+                    start = time.perf_counter()
+                    conn.execute(*builder(**filters)).fetchall()
+                    timings[name] = time.perf_counter() - start
+                print(f"  {label:<12}  ledger {timings['ledger']:8.3f}s  rollup {timings['rollup']:8.3f}s")
+    finally:
+        database.close_pool()
+        os.remove(path)
+
+
+def legacy_analytics(cursor, query, params):
+    """The original fetch-everything analytics loop, kept as the benchmark baseline."""
+    cursor.execute(query, params)
+    movements = cursor.fetchall()
+    most_moving, least_moving = [], []
+    for i, (ean, movement) in enumerate(movements):
+        cursor.execute("SELECT style_name, brand FROM product WHERE ean = ?", (ean,))
+        product = cursor.fetchone()
+        if product:
+            item = {"ean": ean, "style_name": product[0], "brand": product[1], "movement": movement}
+            if i < 5:
+                most_moving.append(item)
+            if i >= len(movements) - 5:
+                least_moving.append(item)
+    least_moving.reverse()
+    return most_moving, least_moving
+
+
+def bench_top_k(args):
+    import main
+    from queries import movement_query
+
+    path = fresh_db()
+    try:
+        with database.get_db() as conn:
+            datagen.seed_ledger(conn, args.rows, args.products, years=1)
+            start = time.perf_counter()
+            legacy_analytics(conn.cursor(), *movement_query())
+            legacy = time.perf_counter() - start
+        start = time.perf_counter()
+        asyncio.run(main.get_analytics(username="bench"))
+        top_k = time.perf_counter() - start
+        print(f"/inventory/analytics over {args.products:,} moving EANs")
+        print(f"  {'full list':<12} {legacy:8.3f}s")
+        print(f"  {'top-k SQL':<12} {top_k:8.3f}s")
+    finally:
+        database.close_pool()
+        os.remove(path)
+
+
+def bench_timeseries(args):
+    import main
+
+    for months in (12, 36):
+        path = fresh_db()
+        try:
+            rows = args.rows * months // 12
+            with database.get_db() as conn:
+                datagen.seed_ledger(conn, rows, 2000, years=months / 12)
+            print(f"Time series over {months} months ({rows:,} ledger rows)")
+            for bucket, group_by in [("day", ""), ("week", "store_id"), ("month", "brand"),
+                                     ("week", "ean"), ("month", "store_id,style_design_code")]:
+                start = time.perf_counter()
+                result = asyncio.run(main.get_analytics_timeseries(
+                    bucket=bucket, group_by=group_by, username="bench"))
+                elapsed = time.perf_counter() - start
+                points = len(result.columns["movement"])
+                print(f"  {bucket:<6} by {group_by or '-':<28} {elapsed:8.3f}s  {points:>9,} points")
+        finally:
+            database.close_pool()
+            os.remove(path)
+
+
+def bench_mixed(args):
+    import main
+    from models import UserLogin
+
+    path = fresh_db()
+    database.seed_initial_data()
+    with database.get_db() as conn:
+        datagen.seed_stock(conn, args.products)
+    credentials = UserLogin(username="admin", password="admin123")
+
+    async def run(concurrency=32):
+        pending = iter(range(args.requests))
+
+        async def client():
+            for i in pending:
+                if i % 5:
+                    await main.login(credentials)
+                else:
+                    await main.get_stock_status(Response(), username="bench")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return args.requests / (time.perf_counter() - start)
+
+    print(f"Mixed load: {args.requests} requests (80% /auth/login, 20% full /inventory/stock-status "
+          f"of {args.products} products), 32 concurrent clients, {os.cpu_count()} CPU(s)")
+    try:
+        for name, workers in [("inline", 0), ("executor x2", 2), ("executor x4", 4)]:
+            database.DB_WORKERS = workers
+            database.close_pool()
+            print(f"  {name:<12} {asyncio.run(run()):8,.0f} req/s")
+    finally:
+        database.shutdown_executor()
+        database.close_pool()
+        os.remove(path)
+
+
+# ============ SUITE ============
+
+FULL_JSON_MAX_ROWS = 1_000_000  # Larger stock tables are only read through the NDJSON stream
+MIN_REGRESSION_SECONDS = 0.005  # Smaller slowdowns are timer noise, whatever the ratio
+
+
+def _call_upload(handler, path):
+    from starlette.datastructures import UploadFile
+    with open(path, "rb") as f:
+        return asyncio.run(handler(file=UploadFile(file=f, filename=os.path.basename(path)), username="bench"))
+
+
+def _timed(func, repeat):
+    """Run func `repeat` times; returns (per-run seconds, last result)."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def _suite_uploads(rows, repeat, tmp):
+    """Upload benchmarks at `rows` CSV lines; each run starts from a freshly seeded database."""
+    import main
+    products = min(max(rows // 10, 100), 200_000)
+    eans = [item[0] for item in datagen.catalogue(products)]
+    files = {
+        "import": (main.import_inventory, datagen.write_import_csv, products),
+        "transfer": (main.transfer_inventory, datagen.write_transfer_csv, eans),
+        "sales": (main.record_sales, datagen.write_sales_csv, eans),
+    }
+    for name, (handler, write, source) in files.items():
+        path = os.path.join(tmp, f"{name}.csv")
+        write(path, rows, source)
+        times = []
+        for _ in range(repeat):
+            db_path = fresh_db()
+            try:
+                if name != "import":
+                    # Enough stock that every row is accepted and written
+                    with database.get_db() as conn:
+                        datagen.seed_stock(conn, products, quantity=3 * rows)
+                (elapsed,), summary = _timed(lambda: _call_upload(handler, path), 1)
+                times.append(elapsed)
+            finally:
+                ingest.shutdown_sales_pool()
+                database.close_pool()
+                os.remove(db_path)
+        yield name, times, {"products": products, "accepted": summary.success_count}
+        os.remove(path)
+
+
+def _suite_reads(rows, repeat):
+    """Stock-status over `rows` inventory rows and analytics over a `rows`-row ledger."""
+    import main
+
+    async def drain(response):
+        return sum([len(chunk) async for chunk in response.body_iterator])
+
+    products = max(rows // 5, 1)
+    db_path = fresh_db()
+    try:
+        with database.get_db() as conn:
+            datagen.seed_stock(conn, products)
+        yield "stock-status page", *_timed(lambda: asyncio.run(
+            main.get_stock_status(Response(), limit=100, in_stock=True, username="bench")), repeat)[:1], \
+            {"products": products}
+        yield "stock-status ndjson", *_timed(lambda: asyncio.run(drain(asyncio.run(
+            main.get_stock_status(Response(), format="ndjson", username="bench")))), repeat)[:1], \
+            {"products": products}
+        if rows <= FULL_JSON_MAX_ROWS:
+            yield "stock-status json", *_timed(lambda: asyncio.run(
+                main.get_stock_status(Response(), username="bench")), repeat)[:1], {"products": products}
+    finally:
+        database.close_pool()
+        os.remove(db_path)
+
+    products = min(max(rows // 50, 100), 100_000)
+    db_path = fresh_db()
+    try:
+        with database.get_db() as conn:
+            datagen.seed_ledger(conn, rows, products)
+        views = {
+            "analytics": lambda: main.get_analytics(Response(), username="bench"),
+            "analytics store+90d": lambda: main.get_analytics(
+                Response(), store_id=2, start_date="2025-10-01", end_date="2025-12-31", username="bench"),
+            "timeseries weekly": lambda: main.get_analytics_timeseries(
+                Response(), bucket="week", group_by="brand", username="bench"),
+        }
+        for name, view in views.items():
+            yield name, *_timed(lambda: asyncio.run(view()), repeat)[:1], {"products": products}
+    finally:
+        database.close_pool()
+        os.remove(db_path)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(sizes, repeat=3):
+    """Run every suite benchmark at each size; returns the JSON-ready report."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_suite_") as tmp:
+        for rows in sizes:
+            for name, times, extra in (*_suite_uploads(rows, repeat, tmp), *_suite_reads(rows, repeat)):
+                median = statistics.median(times)
+                result = {"benchmark": name, "rows": rows, "seconds": round(median, 6),
+                          "min_seconds": round(min(times), 6), "runs": len(times),
+                          "rows_per_second": round(rows / median, 1), **extra}
+                results.append(result)
+                print(f"  {name:<22} {rows:>11,} rows  {median:9.3f}s  {rows / median:14,.0f} rows/s")
+    return {
+        "meta": {"commit": _git_commit(), "python": platform.python_version(),
+                 "sqlite": sqlite3.sqlite_version, "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "seed": datagen.SEED, "repeat": repeat,
+                 "created": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Print each benchmark's time against the baseline report; returns the regressions."""
+    before = {(r["benchmark"], r["rows"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    print(f"Against {baseline['meta'].get('commit')} (tolerance {tolerance:.0%}):")
+    for result in report["results"]:
+        key = (result["benchmark"], result["rows"])
+        if key not in before:
+            continue
+        ratio = result["seconds"] / before[key] if before[key] else float("inf")
+        slower = result["seconds"] - before[key] > MIN_REGRESSION_SECONDS
+        flag = "REGRESSION" if ratio > 1 + tolerance and slower else ""
+        if flag:
+            regressions.append({**result, "baseline_seconds": before[key]})
+        print(f"  {key[0]:<22} {key[1]:>11,} rows  {before[key]:9.3f}s -> {result['seconds']:9.3f}s "
+              f"({ratio:5.2f}x) {flag}")
+    return regressions
+
+
+def bench_suite(args):
+    print(f"Benchmark suite at {', '.join(f'{n:,}' for n in args.sizes)} rows, median of {args.repeat} runs")
+    report = run_suite(args.sizes, args.repeat)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+SCENARIOS = {
+    "import": bench_import,
+    "pool": bench_pool,
+    "stock-status": bench_stock_status,
+    "stock-page": bench_stock_page,
+    "rollup": bench_rollup,
+    "top-k": bench_top_k,
+    "timeseries": bench_timeseries,
+    "mixed": bench_mixed,
+    "sales": bench_sales,
+    "auth": bench_auth,
+    "login": bench_login,
+    "cache": bench_cache,
+    "export": bench_export,
+    "as-of": bench_as_of,
+    "metrics": bench_metrics,
+    "suite": bench_suite,
+    "profile": bench_profile,
+    "alerts": bench_alerts,
+    "forecast": bench_forecast,
+    "transfer": bench_transfer,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")],
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3, help="suite: runs per benchmark (median reported)")
+    parser.add_argument("--json", help="suite: write the results to this file")
+    parser.add_argument("--baseline", help="suite: compare with an earlier --json file; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="suite: allowed slowdown vs baseline")
+    args = parser.parse_args()
+    if args.scenario != "cache":
+        # Measure the query paths themselves, not the response cache
+        response_cache.RESPONSE_CACHE = "off"
+    SCENARIOS[args.scenario](args)
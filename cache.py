@@ -0,0 +1,80 @@
+"""
+Small in-process caches for hot lookups.
+Each worker process has its own; entries expire on their own deadline, so a
+change made through another process is seen at most one TTL later.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire at a per-entry wall-clock deadline.
+    maxsize <= 0 disables caching (every get is a miss). With maxbytes, entries set
+    with a size are also evicted oldest-first to keep their total within it.
+    """
+
+    def __init__(self, maxsize, ttl, maxbytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        self.bytes -= self._entries.pop(key)[2]
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires_at=None, size=0):
+        """
+        Cache value until expires_at (epoch seconds), capped at ttl from now.
+        size counts against maxbytes; a value larger than maxbytes is not cached.
+        """
+        if self.maxsize <= 0 or self.maxbytes is not None and size > self.maxbytes:
+            return
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, deadline, size)
+            self.bytes += size
+            while len(self._entries) > self.maxsize or self.maxbytes is not None and self.bytes > self.maxbytes:
+                self._pop(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Size and hit/miss counters since start."""
+        with self._lock:
+            stats = {"size": len(self._entries), "maxsize": self.maxsize,
+                     "hits": self.hits, "misses": self.misses}
+            if self.maxbytes is not None:
+                stats.update(bytes=self.bytes, maxbytes=self.maxbytes)
+            return stats
@@ -1,14 +1,62 @@
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime
+import asyncio
+import contextvars
 import os
+import queue
+import threading
+import time
+
+import metrics
+import profiling
+from migrations import apply_migrations
 
 DATABASE_PATH = "inventory.db"
 
+# Connection pool settings (DB_POOL_SIZE=0 disables pooling)
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+HEALTH_CHECK_INTERVAL = float(os.environ.get("DB_HEALTH_CHECK_INTERVAL", "60"))
+
+# Blocking storage work from async routes runs on a bounded executor
+# (DB_WORKERS=0 runs it inline on the event loop). Beyond DB_MAX_PENDING
+# queued calls, new work is rejected with ExecutorBusy.
+DB_WORKERS = int(os.environ.get("DB_WORKERS", "4"))
+DB_MAX_PENDING = int(os.environ.get("DB_MAX_PENDING", "256"))
+
+# Storage settings. WAL lets dashboard reads proceed while an upload holds the write lock.
+JOURNAL_MODE = "wal"
+SYNCHRONOUS = "NORMAL"  # Durable across app crashes; only an OS crash can lose the last commits
+MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", "-16000"))  # Negative = KiB, so 16 MB per connection
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Checkpoint policy: SQLite checkpoints passively once the WAL reaches WAL_AUTOCHECKPOINT
+# pages, the file is truncated back to JOURNAL_SIZE_LIMIT afterwards, and shutdown
+# runs a TRUNCATE checkpoint so the WAL does not outlive the process.
+WAL_AUTOCHECKPOINT = int(os.environ.get("DB_WAL_AUTOCHECKPOINT", "1000"))
+JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+# PRAGMAs applied to every new connection
+CONNECTION_PRAGMAS = [
+    ("synchronous", SYNCHRONOUS),
+    ("mmap_size", MMAP_SIZE),
+    ("cache_size", CACHE_SIZE),
+    ("busy_timeout", BUSY_TIMEOUT_MS),
+    ("wal_autocheckpoint", WAL_AUTOCHECKPOINT),
+    ("journal_size_limit", JOURNAL_SIZE_LIMIT),
+    ("temp_store", "MEMORY"),
+]
+
 def init_db():
     """Initialize SQLite database with schema."""
     conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
+
+    # Journal mode is persistent, so setting it once per database file is enough
+    cursor.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
     
     # PRODUCT table
     cursor.execute("""
@@ -67,17 +115,267 @@ def init_db():
     """)
     
     conn.commit()
+
+    # Indexes and later schema changes
+    apply_migrations(conn)
     conn.close()
 
+def verify_storage_settings():
+    """Check that the storage PRAGMAs took effect on a pooled connection."""
+    expected = {
+        "journal_mode": JOURNAL_MODE,
+        "synchronous": 1,  # NORMAL
+        "cache_size": CACHE_SIZE,
+        "busy_timeout": BUSY_TIMEOUT_MS,
+        "wal_autocheckpoint": WAL_AUTOCHECKPOINT,
+    }
+    with get_db() as conn:
+        actual = {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in expected}
+        # mmap_size is capped by SQLITE_MAX_MMAP_SIZE, so only require it to be enabled
+        mmap_size = conn.execute("PRAGMA mmap_size").fetchone()
+        mmap_size = mmap_size[0] if mmap_size else 0
+
+    mismatches = [
+        f"{name}={actual[name]!r} (expected {value!r})"
+        for name, value in expected.items()
+        if str(actual[name]).lower() != str(value).lower()
+    ]
+    if MMAP_SIZE and not mmap_size:
+        mismatches.append("mmap_size=0 (memory-mapped I/O unavailable)")
+    if mismatches:
+        raise RuntimeError("SQLite storage settings not applied: " + ", ".join(mismatches))
+    return actual
+
+def checkpoint(mode="PASSIVE"):
+    """Run a WAL checkpoint; returns (busy, wal_pages, checkpointed_pages)."""
+    with get_db() as conn:
+        return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+def connect(path=None):
+    """Open a configured connection to the database."""
+    conn = sqlite3.connect(path or DATABASE_PATH, check_same_thread=False,
+                           factory=profiling.connection_factory())
+    conn.row_factory = sqlite3.Row
+    for name, value in CONNECTION_PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections reused across requests in one process."""
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Borrow a connection, opening a new one while under the size limit."""
+        try:
+            conn, released_at = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._created < self.size
+                if can_open:
+                    self._created += 1
+            if can_open:
+                return self._open()
+            try:
+                conn, released_at = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise RuntimeError("Timed out waiting for a database connection")
+
+        if time.monotonic() - released_at > HEALTH_CHECK_INTERVAL and not self._is_healthy(conn):
+            self._discard(conn)
+            with self._lock:
+                self._created += 1
+            return self._open()
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any uncommitted work."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def _open(self):
+        try:
+            return connect(self.path)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return this process's pool, rebuilding it after a fork or a DATABASE_PATH change."""
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid() or pool.path != DATABASE_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid() or _pool.path != DATABASE_PATH:
+                if _pool is not None and _pool.pid == os.getpid():
+                    _pool.close()
+                _pool = ConnectionPool(DATABASE_PATH, POOL_SIZE, POOL_TIMEOUT)
+            pool = _pool
+    return pool
+
+def close_pool():
+    """Close the pooled connections of this process."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close()
+        _pool = None
+
 @contextmanager
 def get_db():
-    """Context manager for database connections."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    """Context manager for database connections, borrowed from the connection pool."""
+    if POOL_SIZE <= 0:
+        conn = connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    pool = get_pool()
+    if metrics.METRICS_ENABLED:
+        started = time.perf_counter()
+        conn = pool.acquire()
+        metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+    else:
+        conn = pool.acquire()
     try:
         yield conn
     finally:
-        conn.close()
+        pool.release(conn)
+
+class ExecutorBusy(Exception):
+    """Raised when the storage executor queue is full."""
+
+class StorageExecutor:
+    """Bounded thread pool for blocking storage work, with queue-depth counters."""
+
+    def __init__(self, workers, max_pending, name="db"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+
+    async def run(self, func, *args, **kwargs):
+        with self._lock:
+            if self.queued >= self.max_pending:
+                self.rejected += 1
+                raise ExecutorBusy(f"{self.queued} calls already queued")
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        submitted = time.perf_counter()
+        context = contextvars.copy_context()
+
+        def call():
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait += time.perf_counter() - submitted
+            try:
+                return context.run(func, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "max_queue_depth": self.max_queue_depth,
+                "avg_wait_ms": round(self.total_wait / self.completed * 1000, 3) if self.completed else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Return this process's storage executor, creating it on first use."""
+    global _executor
+    if _executor is None or _executor.workers != DB_WORKERS:
+        with _executor_lock:
+            if _executor is None or _executor.workers != DB_WORKERS:
+                if _executor is not None:
+                    _executor._executor.shutdown(wait=False)
+                _executor = StorageExecutor(DB_WORKERS, DB_MAX_PENDING)
+    return _executor
+
+async def run_blocking(func, *args, **kwargs):
+    """Run blocking storage work (queries, password checks) off the event loop."""
+    if DB_WORKERS <= 0:
+        return func(*args, **kwargs)
+    return await get_executor().run(func, *args, **kwargs)
+
+def executor_stats():
+    """Queue-depth and throughput counters of the storage executor."""
+    if DB_WORKERS <= 0 or _executor is None:
+        return {"workers": DB_WORKERS, "queued": 0, "running": 0, "completed": 0}
+    return _executor.stats()
+
+def shutdown_executor():
+    """Wait for in-flight storage work and stop the executor."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = None
 
 def seed_initial_data():
     """Seed initial stores and test data."""
@@ -0,0 +1,172 @@
+"""
+Seeded synthetic data for benchmarks and load tests.
+
+A catalogue is styles x sizes with valid EAN-13 codes; stock is every EAN in every
+store. Demand is skewed (a few styles sell most), as in real EOD files. The same
+seed always produces the same catalogue, files and ledger.
+"""
+import csv
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import numpy as np
+
+from rollup import rebuild_daily_movement
+
+SEED = 42
+BRANDS = ["Rapheal", "Vogue", "Atelier", "Maison"]
+SIZES = ["XS", "S", "M", "L", "XL"]
+LEDGER_START = datetime(2023, 1, 1)
+RESTOCK_QUANTITY = 200  # Import quantity when a generated sale or transfer would overdraw stock
+
+
+def ean13(style, size):
+    """Return a valid EAN-13 in the GS1 in-store range (prefix 20) for one style and size."""
+    digits = f"20{style:08d}{size:02d}"
+    check = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return digits + str(check)
+
+
+def catalogue(products):
+    """
+    Return `products` rows of (ean, style_name, size, brand, style_design_code, model_no),
+    every style in each of SIZES before the next style starts.
+    """
+    rows = []
+    for p in range(products):
+        style, size = divmod(p, len(SIZES))
+        rows.append((ean13(style, size), f"Style {style}", SIZES[size], BRANDS[style % len(BRANDS)],
+                     f"SD{style:06d}", f"M{style:06d}"))
+    return rows
+
+
+def demand(products, skew=1.1):
+    """Cumulative Zipf-like weights over product positions, for rng.choices(cum_weights=...)."""
+    return list(accumulate(1 / (p + 1) ** skew for p in range(products)))
+
+
+def seed_stock(conn, products, stores=5, quantity=100):
+    """Insert the catalogue and `quantity` of every EAN in stores 1..stores; returns the EANs."""
+    items = catalogue(products)
+    conn.executemany("""
+        INSERT INTO product (ean, style_name, size, brand, style_design_code, model_no)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, items)
+    conn.executemany("INSERT INTO inventory (product_ean, store_id, quantity) VALUES (?, ?, ?)",
+                     ((item[0], s, quantity) for item in items for s in range(1, stores + 1)))
+    conn.commit()
+    return [item[0] for item in items]
+
+
+def write_import_csv(path, rows, products, stores=5, seed=SEED):
+    """Write an import file of `rows` lines cycling through the catalogue and stores."""
+    rng = random.Random(seed)
+    items = catalogue(products)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ean", "style_name", "size", "brand", "style_design_code",
+                         "model_no", "store_id", "quantity"])
+        for i in range(rows):
+            writer.writerow(items[i % products] + (i // products % stores + 1, rng.randint(10, 100)))
+
+
+def write_sales_csv(path, rows, eans, stores=5, seed=SEED):
+    """Write an EOD sales file of `rows` lines with skewed demand over `eans`."""
+    rng = random.Random(seed)
+    weights = demand(len(eans))
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ean", "store_id", "quantity_sold"])
+        for ean in rng.choices(eans, cum_weights=weights, k=rows):
+            writer.writerow([ean, rng.randint(1, stores), rng.choice((1, 1, 1, 2, 3))])
+
+
+def write_transfer_csv(path, rows, eans, stores=5, seed=SEED):
+    """Write a transfer file of `rows` lines between random store pairs, skewed like sales."""
+    rng = random.Random(seed)
+    weights = demand(len(eans))
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ean", "source_store_id", "destination_store_id", "quantity"])
+        for ean in rng.choices(eans, cum_weights=weights, k=rows):
+            source, destination = rng.sample(range(1, stores + 1), 2)
+            writer.writerow([ean, source, destination, rng.randint(1, 10)])
+
+
+def ledger(rows, eans, stores=5, years=3, seed=SEED):
+    """
+    Yield `rows` ledger tuples (ean, store_id, quantity_change, type, timestamp) spread
+    evenly over `years` from LEDGER_START. Mostly sales, some transfers (two rows each);
+    a restock import is inserted whenever stock would go negative, so every
+    (ean, store) balance stays >= 0 throughout.
+    """
+    rng = random.Random(seed)
+    weights = demand(len(eans))
+    step = timedelta(days=365 * years) / max(rows, 1)
+    balances = {}
+    n = 0
+
+    def emit(ean, store_id, change, kind):
+        nonlocal n
+        balances[ean, store_id] = balances.get((ean, store_id), 0) + change
+        n += 1
+        return ean, store_id, change, kind, (LEDGER_START + step * n).strftime("%Y-%m-%d %H:%M:%S")
+
+    while n < rows:
+        ean = rng.choices(eans, cum_weights=weights)[0]
+        store_id = rng.randint(1, stores)
+        quantity = rng.randint(1, 3)
+        if balances.get((ean, store_id), 0) < quantity:
+            yield emit(ean, store_id, RESTOCK_QUANTITY, "Import")
+        elif rng.random() < 0.15 and rows - n >= 2:
+            destination = rng.choice([s for s in range(1, stores + 1) if s != store_id])
+            yield emit(ean, store_id, -quantity, "Transfer")
+            yield emit(ean, destination, quantity, "Transfer")
+        else:
+            yield emit(ean, store_id, -quantity, "Sale")
+
+
+def seed_ledger(conn, rows, products, stores=5, years=3, seed=SEED):
+    """
+    Load a catalogue, a `rows`-row multi-year ledger and the inventory it implies,
+    then rebuild the daily_movement rollup. Returns the EANs.
+    """
+    items = catalogue(products)
+    eans = [item[0] for item in items]
+    conn.executemany("""
+        INSERT INTO product (ean, style_name, size, brand, style_design_code, model_no)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, items)
+    conn.executemany("""
+        INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    """, ledger(rows, eans, stores, years, seed))
+    conn.execute("""
+        INSERT INTO inventory (product_ean, store_id, quantity)
+        SELECT product_ean, store_id, SUM(quantity_change) FROM [transaction]
+        GROUP BY product_ean, store_id
+    """)
+    conn.commit()
+    rebuild_daily_movement(conn)
+    return eans
+
+
+def seed_daily_sales(conn, rows, eans, stores=5, days=730, end="2024-12-31", seed=SEED):
+    """
+    Fill daily_movement with about `rows` distinct (ean, store, day) sales rows over
+    the `days` days up to `end`, demand skewed over `eans` as in demand().
+    Drawn with NumPy: ledger() is far too slow at this scale.
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.diff(demand(len(eans)), prepend=0.0)
+    products = rng.choice(len(eans), size=rows, p=weights / weights.sum())
+    keys = np.unique((products * stores + rng.integers(0, stores, rows)) * days + rng.integers(0, days, rows))
+    pairs, ages = np.divmod(keys, days)
+    sold = rng.choice([1, 1, 1, 2, 3], size=len(keys))
+    day_names = (np.datetime64(end, "D") - np.arange(days)).astype(str)
+    conn.executemany("INSERT INTO daily_movement (product_ean, store_id, day, movement, sold) VALUES (?, ?, ?, ?, ?)",
+                     ((eans[p // stores], int(p % stores) + 1, day_names[a], int(q), int(q))
+                      for p, a, q in zip(pairs.tolist(), ages.tolist(), sold.tolist())))
+    conn.commit()
+    return len(keys)
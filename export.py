@@ -0,0 +1,117 @@
+"""
+Full stock snapshot export: the EAN x store quantity matrix in compact formats.
+
+csv.gz    ean,<store_id>,... rows, gzip-compressed as they are produced.
+columnar  little-endian binary, one column per store:
+            b"INVCOL01"
+            uint32 product count (n), uint32 store count (s)
+            int32[s]    store ids, ascending
+            int32[n+1]  EAN end offsets into the EAN blob (first entry 0)
+            bytes       EAN blob: UTF-8 EANs back to back, ascending
+            int32[n]    quantities, once per store in store id order
+"""
+import csv
+import io
+import struct
+import sys
+import zlib
+from array import array
+from itertools import groupby
+from operator import itemgetter
+
+from database import get_db
+
+COLUMNAR_MAGIC = b"INVCOL01"
+EXPORT_CHUNK_ROWS = 5000
+
+MATRIX_QUERY = """
+    SELECT p.ean, i.store_id, i.quantity
+    FROM product p
+    LEFT JOIN inventory i ON i.product_ean = p.ean
+    ORDER BY p.ean
+"""
+
+
+def _store_ids(cursor):
+    return [row[0] for row in cursor.execute("SELECT store_id FROM store ORDER BY store_id")]
+
+
+def iter_matrix(cursor, store_ids):
+    """Yield (ean, [quantity per store in store_ids order]) for every product, by EAN."""
+    position = {store_id: i for i, store_id in enumerate(store_ids)}
+    for ean, rows in groupby(cursor.execute(MATRIX_QUERY), key=itemgetter(0)):
+        quantities = [0] * len(store_ids)
+        for _, store_id, quantity in rows:
+            if store_id is not None:
+                quantities[position[store_id]] = quantity
+        yield ean, quantities
+
+
+def stream_csv_gz():
+    """Yield a gzip-compressed CSV of the matrix, one compressed chunk per EXPORT_CHUNK_ROWS rows."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    with get_db() as conn:
+        cursor = conn.cursor()
+        store_ids = _store_ids(cursor)
+        writer.writerow(["ean"] + store_ids)
+        for n, (ean, quantities) in enumerate(iter_matrix(cursor, store_ids), start=1):
+            writer.writerow([ean] + quantities)
+            if n % EXPORT_CHUNK_ROWS == 0:
+                yield compressor.compress(buffer.getvalue().encode())
+                buffer.seek(0)
+                buffer.truncate()
+    yield compressor.compress(buffer.getvalue().encode()) + compressor.flush()
+
+
+def _le(values):
+    """int32 array as little-endian bytes."""
+    if sys.byteorder != "little":
+        values = array("i", values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def stream_columnar():
+    """
+    Yield the matrix in the columnar layout.
+    Columns are built in int32 arrays (4 bytes per cell) and sent once the scan ends,
+    since every EAN precedes the first quantity column.
+    """
+    eans = io.BytesIO()
+    offsets = array("i", [0])
+    with get_db() as conn:
+        cursor = conn.cursor()
+        store_ids = _store_ids(cursor)
+        columns = [array("i") for _ in store_ids]
+        for ean, quantities in iter_matrix(cursor, store_ids):
+            eans.write(ean.encode())
+            offsets.append(eans.tell())
+            for column, quantity in zip(columns, quantities):
+                column.append(quantity)
+
+    yield COLUMNAR_MAGIC + struct.pack("<II", len(offsets) - 1, len(store_ids))
+    yield _le(array("i", store_ids)) + _le(offsets)
+    yield eans.getvalue()
+    for column in columns:
+        yield _le(column)
+
+
+def read_columnar(data):
+    """Decode a columnar export into (eans, {store_id: [quantity per EAN]})."""
+    if data[:8] != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar stock export")
+    n, s = struct.unpack_from("<II", data, 8)
+    pos = 16
+    store_ids = struct.unpack_from(f"<{s}i", data, pos)
+    pos += 4 * s
+    offsets = struct.unpack_from(f"<{n + 1}i", data, pos)
+    pos += 4 * (n + 1)
+    eans = [data[pos + offsets[i]:pos + offsets[i + 1]].decode() for i in range(n)]
+    pos += offsets[-1]
+    columns = {}
+    for store_id in store_ids:
+        columns[store_id] = list(struct.unpack_from(f"<{n}i", data, pos))
+        pos += 4 * n
+    return eans, columns
@@ -0,0 +1,205 @@
+"""
+Sales-velocity forecast per (ean, store): moving-average and exponentially smoothed
+units sold per day, days of cover at current stock, and suggested transfers that
+bring every store of an EAN up to TARGET_COVER_DAYS from the stores above it.
+
+Daily sales come from the sold column of daily_movement in one read and are reduced
+with NumPy over all pairs at once, with no per-pair Python loop. Velocities depend
+on sales only, so each process keeps the last set until the sales data version
+changes (a sales upload or a rollup rebuild) or the day rolls over; cover and
+transfers are recomputed against live inventory after any upload, and the whole
+result is shared by every filter of the endpoint until then.
+"""
+import os
+import threading
+
+import numpy as np
+
+from response_cache import current_version
+
+FORECAST_WINDOW_DAYS = int(os.environ.get("FORECAST_WINDOW_DAYS", "28"))  # Moving-average window
+FORECAST_ALPHA = float(os.environ.get("FORECAST_ALPHA", "0.1"))  # Smoothing factor per day
+FORECAST_HISTORY_DAYS = int(os.environ.get("FORECAST_HISTORY_DAYS", "730"))  # Sales read per run
+TARGET_COVER_DAYS = float(os.environ.get("TARGET_COVER_DAYS", "28"))
+FETCH_ROWS = 100_000  # Rollup rows converted to arrays at a time
+
+FORECAST_ORDERS = ("days_of_cover", "suggested_transfer")
+
+_velocity = None  # (sales version, today, Velocity)
+_velocity_lock = threading.Lock()
+_forecast = None  # (inventory version, Velocity, target days, result)
+_forecast_lock = threading.Lock()
+
+
+class Velocity:
+    """Units sold per day on a dense EAN x store grid; rows and columns are sorted."""
+
+    def __init__(self, eans, stores, moving_average, smoothed):
+        self.eans = eans
+        self.stores = stores
+        self.moving_average = moving_average
+        self.smoothed = smoothed
+
+    def lookup(self, eans, stores):
+        """(moving average, smoothed) for parallel arrays of pairs; 0 where nothing was sold."""
+        if not len(self.eans) or not len(self.stores):
+            return np.zeros(len(eans)), np.zeros(len(eans))
+        rows = np.searchsorted(self.eans, eans).clip(max=len(self.eans) - 1)
+        cols = np.searchsorted(self.stores, stores).clip(max=len(self.stores) - 1)
+        known = (self.eans[rows] == eans) & (self.stores[cols] == stores)
+        return (np.where(known, self.moving_average[rows, cols], 0.0),
+                np.where(known, self.smoothed[rows, cols], 0.0))
+
+
+def compute_velocity(cursor, today, window=FORECAST_WINDOW_DAYS, alpha=FORECAST_ALPHA,
+                     history=FORECAST_HISTORY_DAYS):
+    """
+    Read `history` days of sales up to `today` (YYYY-MM-DD) and return their Velocity.
+    The moving average is sold units over the last `window` days (today included)
+    divided by `window`. The smoothed velocity is the exponentially weighted average
+    s = alpha * x[today] + (1 - alpha) * s[yesterday] over every day of the history,
+    days without sales counting as 0, from s = 0 before the first day; summed in
+    closed form as alpha * (1 - alpha) ** age * x.
+    """
+    eans = np.array([row[0] for row in cursor.execute("SELECT ean FROM product ORDER BY ean")], dtype=str)
+    stores = np.array([row[0] for row in cursor.execute("SELECT store_id FROM store ORDER BY store_id")],
+                      dtype=np.int64)
+    moving_average = np.zeros(len(eans) * len(stores))
+    smoothed = np.zeros(len(eans) * len(stores))
+    # Plain tuples convert straight to a structured array (sqlite3.Row does not), and
+    # ages come back as small ints, which Python does not allocate per row
+    cursor.row_factory = None
+    row_type = np.dtype([("ean", eans.dtype), ("store_id", np.int64), ("age", np.int64), ("sold", np.float64)])
+
+    cursor.execute("""
+        SELECT product_ean, store_id, CAST(JULIANDAY(?) - JULIANDAY(day) AS INTEGER), sold
+        FROM daily_movement
+        WHERE day > DATE(?, ?) AND day <= ? AND sold > 0
+    """, (today, today, f"-{history} days", today))
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        rows = np.array(rows, dtype=row_type)
+        # Every rollup row has a product and store, so the lookups always hit
+        pairs = np.searchsorted(eans, rows["ean"]) * len(stores) + np.searchsorted(stores, rows["store_id"])
+        ages, sold = rows["age"], rows["sold"]
+
+        recent = ages < window
+        moving_average += np.bincount(pairs[recent], sold[recent], minlength=len(moving_average))
+        smoothed += np.bincount(pairs, sold * alpha * (1 - alpha) ** ages, minlength=len(smoothed))
+
+    shape = (len(eans), len(stores))
+    return Velocity(eans, stores, (moving_average / window).reshape(shape), smoothed.reshape(shape))
+
+
+def get_velocity(conn, today=None):
+    """This process's Velocity for today, recomputed only after a sales upload or at midnight."""
+    global _velocity
+    key = (current_version(conn, "sales"), today or conn.execute("SELECT DATE('now')").fetchone()[0])
+    with _velocity_lock:
+        if _velocity is None or _velocity[:2] != key:
+            _velocity = key + (compute_velocity(conn.cursor(), key[1]),)
+        return _velocity[2]
+
+
+def reset_forecast():
+    """Drop the cached velocities and forecast (tests and benchmarks)."""
+    global _velocity, _forecast
+    with _velocity_lock, _forecast_lock:
+        _velocity = _forecast = None
+
+
+def suggest_transfers(quantity, velocity, target_days=TARGET_COVER_DAYS):
+    """
+    Net transfer per cell of EAN x store grids of stock and smoothed velocity:
+    positive receives, negative sends; each row sums to 0.
+    A store needs ceil(velocity * target_days) - quantity units and can spare whatever
+    it holds above that target. Per EAN, min(total need, total surplus) units move,
+    filling the stores with the least cover first from those with the most.
+    """
+    target = np.ceil(velocity * target_days).astype(np.int64)
+    need = np.maximum(target - quantity, 0)
+    surplus = np.maximum(quantity - target, 0)
+    moved = np.minimum(need.sum(axis=1), surplus.sum(axis=1))[:, None]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cover = np.where(velocity > 0, quantity / velocity, np.inf)
+    order = np.argsort(cover, axis=1, kind="stable")
+
+    def allocate(amounts, order):
+        ordered = np.take_along_axis(amounts, order, axis=1)
+        before = np.cumsum(ordered, axis=1) - ordered
+        taken = np.zeros_like(amounts)
+        np.put_along_axis(taken, order, np.clip(moved - before, 0, ordered), axis=1)
+        return taken
+
+    return allocate(need, order) - allocate(surplus, order[:, ::-1])
+
+
+def forecast(conn, target_days=TARGET_COVER_DAYS, today=None):
+    """
+    Velocity, days of cover and suggested transfer for every inventory row, as a
+    dict of parallel arrays in EAN, store order. Days of cover is quantity over the
+    smoothed velocity (inf when nothing sells). today defaults to the current date.
+    """
+    global _forecast
+    velocity = get_velocity(conn, today)
+    key = (current_version(conn), velocity, target_days)
+    with _forecast_lock:
+        if _forecast is None or _forecast[:3] != key:
+            _forecast = key + (_compute_forecast(conn, velocity, target_days),)
+        return _forecast[3]
+
+
+def _compute_forecast(conn, velocity, target_days):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute("SELECT product_ean, store_id, quantity FROM inventory").fetchall()
+    # Sized from these rows, not the cached Velocity: products imported since are wider
+    width = max((len(row[0]) for row in rows), default=1)
+    rows = np.array(rows, dtype=[("ean", f"U{width}"), ("store_id", np.int64), ("quantity", np.int64)])
+    rows.sort(order=["ean", "store_id"])
+    eans, stores, quantity = rows["ean"], rows["store_id"], rows["quantity"]
+    moving_average, smoothed = velocity.lookup(eans, stores)
+
+    # Lay the rows out on a dense EAN x store grid; pairs without inventory stay 0
+    grid_eans, rows_at = np.unique(eans, return_inverse=True)
+    grid_stores, cols_at = np.unique(stores, return_inverse=True)
+    shape = (len(grid_eans), len(grid_stores))
+    grid_quantity = np.zeros(shape, dtype=np.int64)
+    grid_velocity = np.zeros(shape)
+    grid_quantity[rows_at, cols_at] = quantity
+    grid_velocity[rows_at, cols_at] = smoothed
+    transfer = suggest_transfers(grid_quantity, grid_velocity, target_days)[rows_at, cols_at]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cover = np.where(smoothed > 0, quantity / smoothed, np.inf)
+    return {"ean": eans, "store_id": stores, "quantity": quantity, "velocity_ma": moving_average,
+            "velocity_ewma": smoothed, "days_of_cover": cover, "suggested_transfer": transfer}
+
+
+def forecast_rows(result, store_id=None, ean=None, transfers_only=False, order="days_of_cover", limit=100):
+    """
+    Select rows of a forecast() result: the `limit` lowest days of cover, or with
+    order="suggested_transfer" the largest transfers in either direction.
+    """
+    keep = np.ones(len(result["ean"]), dtype=bool)
+    if store_id is not None:
+        keep &= result["store_id"] == store_id
+    if ean is not None:
+        keep &= result["ean"] == ean
+    if transfers_only:
+        keep &= result["suggested_transfer"] != 0
+    selected = np.flatnonzero(keep)
+    key = (result["days_of_cover"] if order == "days_of_cover" else -np.abs(result["suggested_transfer"]))
+    selected = selected[np.argsort(key[selected], kind="stable")[:limit]]
+
+    return [{"ean": str(result["ean"][i]), "store_id": int(result["store_id"][i]),
+             "quantity": int(result["quantity"][i]),
+             "velocity_ma": round(float(result["velocity_ma"][i]), 3),
+             "velocity_ewma": round(float(result["velocity_ewma"][i]), 3),
+             "days_of_cover": (round(float(result["days_of_cover"][i]), 1)
+                               if np.isfinite(result["days_of_cover"][i]) else None),
+             "suggested_transfer": int(result["suggested_transfer"][i])}
+            for i in selected]
@@ -0,0 +1,601 @@
+"""Bulk CSV ingestion engines used by the upload endpoints."""
+import codecs
+import csv
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import metrics
+from alerts import refresh_alerts
+from database import get_db
+from models import UploadSummary
+from response_cache import bump_version
+from rollup import add_movement, flush_daily_movement
+
+IMPORT_BATCH_SIZE = 5000
+SALES_CHUNK_ROWS = 50000  # Sales rows validated and written per chunk
+TRANSFER_CHUNK_ROWS = 50000  # Transfer rows replayed and written per chunk
+SALES_WORKERS = int(os.environ.get("SALES_WORKERS", "1"))  # 1 validates inline
+STOCK_QUERY_BATCH = 500  # EANs per inventory snapshot query
+HASH_BLOCK_SIZE = 1024 * 1024
+# Identical content counts as a replay only this long; the same file on another day is new data
+REPLAY_WINDOW_SECONDS = int(os.environ.get("REPLAY_WINDOW_SECONDS", "3600"))
+
+_sales_pool = None
+
+
+def _decoded_lines(fileobj):
+    """
+    Yield the lines of a UTF-8 file read HASH_BLOCK_SIZE bytes at a time, split like
+    TextIOWrapper(newline='') splits them. Decoding is timed per block ("decode" stage).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    for block in iter(lambda: fileobj.read(HASH_BLOCK_SIZE), b""):
+        with metrics.stage("decode"):
+            lines = io.StringIO(pending + decoder.decode(block), newline="").readlines()
+            # A trailing line may continue in the next block (including a split "\r\n")
+            pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def read_csv(fileobj):
+    """
+    Yield CSV rows decoded incrementally from a binary file object.
+    Only one block of the file is held in memory at a time.
+    """
+    return csv.DictReader(_decoded_lines(fileobj))
+
+
+def read_csv_upload(upload):
+    """Yield CSV rows of an UploadFile's spooled file; Starlette closes it after the request."""
+    return read_csv(upload.file)
+
+
+class IdempotencyConflict(ValueError):
+    """An Idempotency-Key was sent again with a different file."""
+
+
+def hash_upload(fileobj):
+    """Return the SHA-256 of an upload's spooled file, read block by block, and rewind it."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def find_upload(cursor, kind, content_hash, idempotency_key=None, record_key=False):
+    """
+    Return the stored summary of an earlier upload of the same key, or of the same file
+    within REPLAY_WINDOW_SECONDS, or None. A key match wins over a content match; a key
+    reused for other content is a conflict. A key first seen on a content match is
+    stored against that file with record_key=True (inside the write transaction), so
+    retries with it replay after the window too; without it such a match returns None.
+    """
+    cursor.execute("""
+        SELECT content_hash, idempotency_key, summary FROM upload
+        WHERE kind = ? AND (idempotency_key = ? OR content_hash = ? AND created_at >= DATETIME('now', ?))
+        ORDER BY idempotency_key = ? DESC
+        LIMIT 1
+    """, (kind, idempotency_key, content_hash, f"-{REPLAY_WINDOW_SECONDS} seconds", idempotency_key))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if row[0] != content_hash:
+        raise IdempotencyConflict(f"Idempotency-Key {idempotency_key} was used for a different file")
+    if idempotency_key is not None and row[1] != idempotency_key:
+        if not record_key:
+            return None
+        cursor.execute("""
+            INSERT INTO upload (kind, content_hash, idempotency_key, summary)
+            VALUES (?, ?, ?, ?)
+        """, (kind, content_hash, idempotency_key, row[2]))
+    summary = UploadSummary.model_validate_json(row[2])
+    summary.replayed = True
+    return summary
+
+
+def run_upload(engine, reader, errors=None, atomic=False, fingerprint=None):
+    """
+    Run one upload engine in its own transaction and summarize the result.
+    With atomic=True any row error rolls back the whole file (status "rejected").
+    fingerprint is (kind, content_hash, idempotency_key): a file applied before is not
+    processed again, its stored summary is returned instead.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if fingerprint:
+            cached = find_upload(cursor, *fingerprint)
+            if cached:
+                return cached
+
+        with metrics.upload_timer(engine.__name__.removesuffix("_rows")) as timer:
+            # Take the write lock before the engine reads its ledger timestamp, so
+            # timestamps follow commit order (point-in-time queries rely on it)
+            with metrics.stage("lock"):
+                conn.execute("BEGIN IMMEDIATE")
+            if fingerprint:
+                # The same file or key may have finished on another connection while this one waited
+                cached = find_upload(cursor, *fingerprint, record_key=True)
+                if cached:
+                    conn.commit()
+                    return cached
+            success_count, errors = engine(cursor, metrics.timed_rows(reader, timer), errors)
+            rejected = atomic and bool(errors)
+            if rejected:
+                conn.rollback()
+                success_count = 0
+            elif success_count:
+                bump_version(cursor)
+
+            if not errors:
+                status_code = "success"
+            else:
+                status_code = "rejected" if rejected else "partial"
+            summary = UploadSummary(
+                success_count=success_count,
+                error_count=len(errors),
+                errors=errors,
+                status=status_code
+            )
+
+            # A rejected file changed nothing, so it may be sent again once fixed up
+            if fingerprint and not rejected:
+                cursor.execute("""
+                    INSERT INTO upload (kind, content_hash, idempotency_key, summary)
+                    VALUES (?, ?, ?, ?)
+                """, fingerprint + (summary.model_dump_json(),))
+            with metrics.stage("commit"):
+                conn.commit()
+
+    return summary
+
+
+def upload_timestamp(cursor):
+    """Return the single ledger timestamp shared by every row of one upload."""
+    cursor.execute("SELECT CURRENT_TIMESTAMP")
+    return cursor.fetchone()[0]
+
+
+def _load_store_ids(cursor):
+    """Return the set of known store ids."""
+    with metrics.stage("lookup"):
+        cursor.execute("SELECT store_id FROM store")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _load_product_eans(cursor):
+    """Return the set of known product EANs."""
+    with metrics.stage("lookup"):
+        cursor.execute("SELECT ean FROM product")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _flush_import(cursor, new_products, inventory_deltas, transactions):
+    """Write one batch of validated import rows."""
+    if new_products:
+        cursor.executemany("""
+            INSERT INTO product (ean, style_name, size, brand, style_design_code, model_no)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, sorted(new_products))
+
+    cursor.executemany("""
+        INSERT INTO inventory (product_ean, store_id, quantity)
+        VALUES (?, ?, ?)
+        ON CONFLICT(product_ean, store_id) DO UPDATE SET quantity = quantity + excluded.quantity
+    """, [(ean, store_id, qty) for (ean, store_id), qty in sorted(inventory_deltas.items())])
+
+    cursor.executemany("""
+        INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type)
+        VALUES (?, ?, ?, 'Import')
+    """, transactions)
+
+
+def import_rows(cursor, reader, errors=None):
+    """
+    Validate import rows against preloaded store/product sets and apply them in batches.
+    Returns (success_count, errors) with the same per-row errors as the row-by-row path.
+    Errors are appended to `errors` as they are found when a list is passed in.
+    """
+    errors = [] if errors is None else errors
+    success_count = 0
+
+    stores = _load_store_ids(cursor)
+    products = _load_product_eans(cursor)
+
+    new_products = []
+    inventory_deltas = {}
+    transactions = []
+    changed = set()
+
+    for row_num, row in enumerate(reader, start=2):  # Start at 2 (header is row 1)
+        try:
+            # Validate required fields
+            ean = row.get('ean', '').strip()
+            store_id = row.get('store_id', '').strip()
+            quantity = row.get('quantity', '').strip()
+
+            if not ean or not store_id or not quantity:
+                errors.append({"row": row_num, "error": "Missing required fields"})
+                continue
+
+            # Validate data types
+            try:
+                store_id = int(store_id)
+                quantity = int(quantity)
+            except ValueError:
+                errors.append({"row": row_num, "error": "Invalid store_id or quantity format"})
+                continue
+
+            # Validate quantity > 0
+            if quantity <= 0:
+                errors.append({"row": row_num, "error": "Quantity must be greater than 0"})
+                continue
+
+            if store_id not in stores:
+                errors.append({"row": row_num, "error": f"Store {store_id} does not exist"})
+                continue
+
+            # First row for an unknown EAN defines the product
+            if ean not in products:
+                new_products.append((
+                    ean,
+                    row.get('style_name', '').strip(),
+                    row.get('size', '').strip(),
+                    row.get('brand', '').strip(),
+                    row.get('style_design_code', '').strip() or None,
+                    row.get('model_no', '').strip() or None
+                ))
+                products.add(ean)
+
+            key = (ean, store_id)
+            inventory_deltas[key] = inventory_deltas.get(key, 0) + quantity
+            transactions.append((ean, store_id, quantity))
+
+            success_count += 1
+
+        except Exception as e:
+            errors.append({"row": row_num, "error": str(e)})
+            continue
+
+        if len(transactions) >= IMPORT_BATCH_SIZE:
+            with metrics.stage("write"):
+                _flush_import(cursor, new_products, inventory_deltas, transactions)
+            changed.update(inventory_deltas)
+            new_products, inventory_deltas, transactions = [], {}, []
+
+    if transactions:
+        with metrics.stage("write"):
+            _flush_import(cursor, new_products, inventory_deltas, transactions)
+        changed.update(inventory_deltas)
+
+    # Restocking can clear low-stock alerts
+    with metrics.stage("alerts"):
+        refresh_alerts(cursor, changed)
+    return success_count, errors
+
+
+def _load_balances(cursor, balances, keys):
+    """Add the stored quantity of every (ean, store_id) key not yet in `balances`."""
+    missing = {}
+    for ean, store_id in keys:
+        if (ean, store_id) not in balances:
+            missing.setdefault(store_id, set()).add(ean)
+    for store_id, eans in missing.items():
+        stock = _fetch_stock(cursor, store_id, eans)
+        for ean in eans:
+            balances[ean, store_id] = stock.get(ean, 0)
+
+
+def _apply_transfer_chunk(cursor, rows, balances, errors, timestamp, movements):
+    """
+    Replay one chunk of transfers in CSV order against the in-memory balances,
+    then write the net inventory deltas and the ledger rows of the accepted ones.
+    Returns the number of accepted rows.
+    """
+    _load_balances(cursor, balances, {(ean, store_id) for _, ean, source, destination, _ in rows
+                                      for store_id in (source, destination)})
+    day = timestamp[:10]
+    deltas = {}
+    transactions = []
+    for row_num, ean, source, destination, quantity in rows:
+        current_qty = balances[ean, source]
+        if current_qty < quantity:
+            errors.append({
+                "row": row_num,
+                "error": f"Insufficient stock. Available: {current_qty}, Requested: {quantity}"
+            })
+            continue
+
+        balances[ean, source] = current_qty - quantity
+        balances[ean, destination] += quantity
+        deltas[ean, source] = deltas.get((ean, source), 0) - quantity
+        deltas[ean, destination] = deltas.get((ean, destination), 0) + quantity
+        transactions.append((ean, source, -quantity, timestamp))
+        transactions.append((ean, destination, quantity, timestamp))
+        add_movement(movements, ean, source, day, -quantity)
+        add_movement(movements, ean, destination, day, quantity)
+
+    with metrics.stage("write"):
+        cursor.executemany("""
+            INSERT INTO inventory (product_ean, store_id, quantity)
+            VALUES (?, ?, ?)
+            ON CONFLICT(product_ean, store_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        """, [(ean, store_id, qty) for (ean, store_id), qty in sorted(deltas.items())])
+
+        cursor.executemany("""
+            INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type, timestamp)
+            VALUES (?, ?, ?, 'Transfer', ?)
+        """, transactions)
+    return len(transactions) // 2
+
+
+def _order_chunk_errors(errors, chunk_start):
+    """
+    Put the errors of one chunk (those from chunk_start on) into row order and return
+    where the next chunk starts. Field errors are appended as rows are read, so a
+    job's progress counts them at once; stock errors follow when the chunk is applied.
+    """
+    errors[chunk_start:] = sorted(errors[chunk_start:], key=itemgetter("row"))
+    return len(errors)
+
+
+def transfer_rows(cursor, reader, errors=None):
+    """
+    Apply transfer rows, checking source stock per row in CSV order.
+    Balances of the (ean, store) pairs a file touches are loaded once and kept in
+    memory, so each row is decided exactly as the row-by-row loop decided it,
+    including transfers that depend on stock moved in by earlier rows.
+    Rows are written in chunks of TRANSFER_CHUNK_ROWS. Returns (success_count, errors).
+    """
+    errors = [] if errors is None else errors
+    success_count = 0
+    timestamp = upload_timestamp(cursor)
+    movements = {}
+
+    stores = _load_store_ids(cursor)
+    products = _load_product_eans(cursor)
+    balances = {}
+
+    chunk_start = 0  # Errors from here on belong to the open chunk, not yet in row order
+    rows = []
+
+    for row_num, row in enumerate(reader, start=2):
+        try:
+            ean = row.get('ean', '').strip()
+            source_store_id = row.get('source_store_id', '').strip()
+            destination_store_id = row.get('destination_store_id', '').strip()
+            quantity = row.get('quantity', '').strip()
+
+            # Validate required fields
+            if not all([ean, source_store_id, destination_store_id, quantity]):
+                errors.append({"row": row_num, "error": "Missing required fields"})
+                continue
+
+            # Validate data types
+            try:
+                source_store_id = int(source_store_id)
+                destination_store_id = int(destination_store_id)
+                quantity = int(quantity)
+            except ValueError:
+                errors.append({"row": row_num, "error": "Invalid store_id or quantity format"})
+                continue
+
+            # Validate quantity > 0
+            if quantity <= 0:
+                errors.append({"row": row_num, "error": "Quantity must be greater than 0"})
+                continue
+
+            # Both stores must exist and differ
+            if (source_store_id == destination_store_id
+                    or source_store_id not in stores or destination_store_id not in stores):
+                errors.append({"row": row_num, "error": "Invalid source or destination store"})
+                continue
+
+            if ean not in products:
+                errors.append({"row": row_num, "error": f"Product {ean} does not exist"})
+                continue
+
+            rows.append((row_num, ean, source_store_id, destination_store_id, quantity))
+
+        except Exception as e:
+            errors.append({"row": row_num, "error": str(e)})
+            continue
+
+        if len(rows) >= TRANSFER_CHUNK_ROWS:
+            success_count += _apply_transfer_chunk(cursor, rows, balances, errors, timestamp, movements)
+            chunk_start = _order_chunk_errors(errors, chunk_start)
+            rows = []
+
+    if rows:
+        success_count += _apply_transfer_chunk(cursor, rows, balances, errors, timestamp, movements)
+    _order_chunk_errors(errors, chunk_start)
+
+    with metrics.stage("alerts"):
+        refresh_alerts(cursor, {(ean, store_id) for ean, store_id, _ in movements})
+    with metrics.stage("rollup"):
+        flush_daily_movement(cursor, movements)
+    return success_count, errors
+
+
+def _fetch_stock(cursor, store_id, eans):
+    """Return {ean: quantity} for the given EANs at one store."""
+    stock = {}
+    eans = list(eans)
+    with metrics.stage("lookup"):
+        for i in range(0, len(eans), STOCK_QUERY_BATCH):
+            batch = eans[i:i + STOCK_QUERY_BATCH]
+            cursor.execute(f"""
+                SELECT product_ean, quantity FROM inventory
+                WHERE store_id = ? AND product_ean IN ({",".join("?" * len(batch))})
+            """, [store_id] + batch)
+            stock.update(cursor.fetchall())
+    return stock
+
+
+def validate_sales_partition(stock, rows):
+    """
+    Replay one store's sales in CSV order against a {ean: quantity} snapshot.
+    Returns (accepted, errors); accepted rows keep their (row_num, ean, quantity_sold) shape.
+    Runs in a worker process, so it must stay a picklable module-level function.
+    """
+    accepted = []
+    errors = []
+    for row_num, ean, quantity_sold in rows:
+        current_qty = stock.get(ean, 0)
+        if current_qty < quantity_sold:
+            errors.append({
+                "row": row_num,
+                "error": f"Insufficient stock. Available: {current_qty}, Sold: {quantity_sold}"
+            })
+            continue
+        stock[ean] = current_qty - quantity_sold
+        accepted.append((row_num, ean, quantity_sold))
+    return accepted, errors
+
+
+def _get_sales_pool():
+    global _sales_pool
+    if _sales_pool is None:
+        # Never fork: uploads run on executor threads, and a forked child can inherit
+        # locks (pool, logging) held by the server's other threads
+        _sales_pool = ProcessPoolExecutor(max_workers=SALES_WORKERS,
+                                          mp_context=multiprocessing.get_context("forkserver"))
+    return _sales_pool
+
+
+def shutdown_sales_pool():
+    """Stop the sales validation worker processes, if any were started."""
+    global _sales_pool
+    if _sales_pool is not None:
+        _sales_pool.shutdown()
+        _sales_pool = None
+
+
+def _apply_sales_chunk(cursor, partitions, errors, timestamp, movements):
+    """
+    Validate one chunk's per-store partitions and write the accepted rows.
+    Stores never share an inventory key, so partitions are validated independently
+    (in worker processes when SALES_WORKERS > 1) and merged back into row order.
+    Returns the number of accepted rows.
+    """
+    store_ids = sorted(partitions)
+    stocks = [_fetch_stock(cursor, store_id, {ean for _, ean, _ in partitions[store_id]})
+              for store_id in store_ids]
+    rows = [partitions[store_id] for store_id in store_ids]
+
+    if SALES_WORKERS > 1 and len(store_ids) > 1:
+        results = list(_get_sales_pool().map(validate_sales_partition, stocks, rows))
+    else:
+        results = [validate_sales_partition(stock, part) for stock, part in zip(stocks, rows)]
+
+    day = timestamp[:10]
+    deltas = {}
+    transactions = []
+    for store_id, (accepted, partition_errors) in zip(store_ids, results):
+        errors.extend(partition_errors)
+        for row_num, ean, quantity_sold in accepted:
+            key = (ean, store_id)
+            deltas[key] = deltas.get(key, 0) + quantity_sold
+            transactions.append((row_num, ean, store_id, -quantity_sold, timestamp))
+            add_movement(movements, ean, store_id, day, -quantity_sold, sale=True)
+
+    with metrics.stage("write"):
+        cursor.executemany("""
+            UPDATE inventory SET quantity = quantity - ?
+            WHERE product_ean = ? AND store_id = ?
+        """, [(qty, ean, store_id) for (ean, store_id), qty in sorted(deltas.items())])
+
+        # Ledger rows go in in CSV order, exactly as the row-by-row path wrote them
+        transactions.sort()
+        cursor.executemany("""
+            INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type, timestamp)
+            VALUES (?, ?, ?, 'Sale', ?)
+        """, [t[1:] for t in transactions])
+    return len(transactions)
+
+
+def sales_rows(cursor, reader, errors=None):
+    """
+    Apply EOD sales rows, checking stock per row in CSV order.
+    Rows are read in chunks of SALES_CHUNK_ROWS and split by store; field, store and
+    product checks run here, stock checks per store partition. Returns
+    (success_count, errors) with the same per-row errors, in the same order, as a
+    row-by-row loop.
+    """
+    errors = [] if errors is None else errors
+    success_count = 0
+    timestamp = upload_timestamp(cursor)
+    movements = {}
+
+    stores = _load_store_ids(cursor)
+    products = _load_product_eans(cursor)
+
+    chunk_start = 0  # Errors from here on belong to the open chunk, not yet in row order
+    partitions = {}
+    chunk_rows = 0
+
+    for row_num, row in enumerate(reader, start=2):
+        try:
+            ean = row.get('ean', '').strip()
+            store_id = row.get('store_id', '').strip()
+            quantity_sold = row.get('quantity_sold', '').strip()
+
+            # Validate required fields
+            if not all([ean, store_id, quantity_sold]):
+                errors.append({"row": row_num, "error": "Missing required fields"})
+                continue
+
+            # Validate data types
+            try:
+                store_id = int(store_id)
+                quantity_sold = int(quantity_sold)
+            except ValueError:
+                errors.append({"row": row_num, "error": "Invalid store_id or quantity format"})
+                continue
+
+            # Validate quantity > 0
+            if quantity_sold <= 0:
+                errors.append({"row": row_num, "error": "Quantity sold must be greater than 0"})
+                continue
+
+            if store_id not in stores:
+                errors.append({"row": row_num, "error": f"Store {store_id} does not exist"})
+                continue
+
+            if ean not in products:
+                errors.append({"row": row_num, "error": f"Product {ean} does not exist"})
+                continue
+
+            partitions.setdefault(store_id, []).append((row_num, ean, quantity_sold))
+            chunk_rows += 1
+
+        except Exception as e:
+            errors.append({"row": row_num, "error": str(e)})
+            continue
+
+        if chunk_rows >= SALES_CHUNK_ROWS:
+            success_count += _apply_sales_chunk(cursor, partitions, errors, timestamp, movements)
+            chunk_start = _order_chunk_errors(errors, chunk_start)
+            partitions, chunk_rows = {}, 0
+
+    if partitions:
+        success_count += _apply_sales_chunk(cursor, partitions, errors, timestamp, movements)
+    _order_chunk_errors(errors, chunk_start)
+
+    with metrics.stage("alerts"):
+        refresh_alerts(cursor, {(ean, store_id) for ean, store_id, _ in movements})
+    with metrics.stage("rollup"):
+        flush_daily_movement(cursor, movements)
+    if success_count:
+        # Invalidates cached sales velocities (forecast.py); the upload bumps "inventory"
+        bump_version(cursor, "sales")
+    return success_count, errors
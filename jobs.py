@@ -0,0 +1,182 @@
+"""
+Background job queue for large CSV uploads.
+Uploads are spooled to JOB_DIR and run on a small thread pool so the event loop
+stays free. Job status lives in one JSON file per job, so any worker process on
+the host can answer a poll for it. Each file also names the process running the
+job, so a worker starting up can fail the jobs of processes that died.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from database import run_blocking
+from ingest import run_upload, read_csv, HASH_BLOCK_SIZE
+from models import JobStatus
+
+JOB_DIR = os.environ.get("JOB_DIR", os.path.join(tempfile.gettempdir(), "inventory-jobs"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", str(24 * 3600)))
+PROGRESS_EVERY = 5000  # Rows between status file updates
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="upload-job")
+    return _executor
+
+
+def _status_path(job_id):
+    return os.path.join(JOB_DIR, f"{job_id}.json")
+
+
+def _write_status(job):
+    """Atomically replace the job's status file, recording this process as its owner."""
+    path = _status_path(job.job_id)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(dict(job.model_dump(mode="json"), pid=os.getpid()), f)
+    os.replace(tmp_path, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def fail_orphaned_jobs():
+    """
+    Mark queued or running jobs whose process is gone as failed; call at startup.
+    A job recorded under this process's own pid belongs to an earlier process too.
+    Returns the number of jobs failed.
+    """
+    if not os.path.isdir(JOB_DIR):
+        return 0
+    failed = 0
+    for name in os.listdir(JOB_DIR):
+        job_id, ext = os.path.splitext(name)
+        if ext != ".json" or not _JOB_ID.match(job_id):
+            continue
+        try:
+            with open(_status_path(job_id)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        pid = state.pop("pid", None)
+        owned = pid is not None and pid != os.getpid() and _alive(pid)
+        if state["status"] not in ("queued", "running") or owned:
+            continue
+        job = JobStatus(**state)
+        job.status = "failed"
+        job.detail = "The process running this job stopped before it finished"
+        _write_status(job)
+        try:
+            os.remove(os.path.join(JOB_DIR, f"{job_id}.csv"))
+        except FileNotFoundError:
+            pass
+        failed += 1
+    return failed
+
+
+def _purge_expired():
+    """Remove status and spool files of jobs older than JOB_RETENTION_SECONDS."""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    for name in os.listdir(JOB_DIR):
+        path = os.path.join(JOB_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _counted(reader, job, errors):
+    """Pass rows through while publishing progress every PROGRESS_EVERY rows."""
+    for row in reader:
+        yield row
+        job.rows_processed += 1
+        if job.rows_processed % PROGRESS_EVERY == 0:
+            job.error_count = len(errors)
+            _write_status(job)
+
+
+def _run(job, engine, spool_path, atomic, fingerprint):
+    errors = []
+    metrics.set_endpoint(f"job:{job.kind}")
+    job.status = "running"
+    _write_status(job)
+    try:
+        with open(spool_path, "rb") as f:
+            summary = run_upload(engine, _counted(read_csv(f), job, errors), errors, atomic, fingerprint)
+        job.status = "done"
+        job.result = summary
+    except Exception as e:
+        job.status = "failed"
+        job.detail = f"File processing error: {str(e)}"
+    finally:
+        job.error_count = len(errors)
+        _write_status(job)
+        os.remove(spool_path)
+
+
+def _spool(source, path):
+    """Copy an upload to `path`, hashing it on the way; returns the SHA-256."""
+    digest = hashlib.sha256()
+    source.seek(0)
+    with open(path, "wb") as f:
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
+
+
+async def submit_job(kind, engine, upload, atomic=False, idempotency_key=None):
+    """
+    Spool an upload to disk and queue it; returns the initial JobStatus.
+    A file seen before finishes with the earlier upload's summary.
+    """
+    os.makedirs(JOB_DIR, exist_ok=True)
+    _purge_expired()
+
+    job = JobStatus(job_id=uuid.uuid4().hex, kind=kind, status="queued")
+    spool_path = os.path.join(JOB_DIR, f"{job.job_id}.csv")
+    content_hash = await run_blocking(_spool, upload.file, spool_path)
+    _write_status(job)
+
+    fingerprint = (kind, content_hash, idempotency_key)
+    _get_executor().submit(_run, job.model_copy(), engine, spool_path, atomic, fingerprint)
+    return job
+
+
+def get_job(job_id):
+    """Return the JobStatus for job_id, or None if it is unknown or expired."""
+    if not _JOB_ID.match(job_id):
+        return None
+    try:
+        with open(_status_path(job_id)) as f:
+            return JobStatus(**json.load(f))
+    except FileNotFoundError:
+        return None
+
+
+def shutdown_jobs(wait=True):
+    """Stop accepting jobs and optionally wait for running ones."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
@@ -1,18 +1,44 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Query, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import csv
-import io
-from datetime import datetime
-from database import init_db, seed_initial_data, get_db
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from typing import Annotated, Optional
+from database import (
+    init_db, seed_initial_data, get_db, close_pool, verify_storage_settings, checkpoint,
+    run_blocking, executor_stats, shutdown_executor, ExecutorBusy
+)
 from models import (
-    UserLogin, TokenResponse, UploadSummary, StockStatusResponse, 
-    AnalyticsResponse, ImportRow, TransferRow, SalesRow
+    UserLogin, TokenResponse, StockStatusResponse,
+    AnalyticsResponse, TimeSeriesResponse, JobStatus, ReorderPoint, StockAlert, ForecastRow
+)
+from auth import (
+    create_access_token, authenticate_user_async, verify_token, auth_cache_stats,
+    password_executor_stats, shutdown_password_executor
+)
+from ingest import (
+    import_rows, transfer_rows, sales_rows, read_csv_upload, run_upload, hash_upload,
+    shutdown_sales_pool, IdempotencyConflict
 )
-from auth import create_access_token, authenticate_user, verify_token
+from jobs import submit_job, get_job, shutdown_jobs, fail_orphaned_jobs
+from queries import iter_stock_status, movers_query, timeseries_query, BUCKETS, DIMENSIONS
+from response_cache import get_response_cache, cache_key, NOT_MODIFIED
+from export import stream_csv_gz, stream_columnar
+from alerts import list_alerts, set_reorder_points
+from forecast import forecast, forecast_rows, FORECAST_ORDERS
+from snapshots import parse_as_of, snapshot_if_due, SNAPSHOT_INTERVAL_SECONDS
+import metrics
+import profiling
 
 app = FastAPI(title="Rapheal Vogue Inventory Tracker")
 
+MAX_PAGE_SIZE = 1000
+MAX_TOP_K = 100
+ADMIN_USERS = set(os.environ.get("ADMIN_USERS", "admin").split(","))
+QUERY_ORDERS = ("total_ms", "max_ms", "calls", "rows")
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -20,20 +46,59 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# Request timing (outermost, so it covers every other middleware)
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+@app.exception_handler(ExecutorBusy)
+async def executor_busy_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, retry shortly"},
+                        headers={"Retry-After": "1"})
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup():
     init_db()
+    verify_storage_settings()
     seed_initial_data()
+    orphaned = fail_orphaned_jobs()
+    if orphaned:
+        print(f"Marked {orphaned} background jobs of stopped processes as failed")
+    if SNAPSHOT_INTERVAL_SECONDS > 0:
+        app.state.snapshot_task = asyncio.create_task(_snapshot_periodically())
+
+async def _snapshot_periodically():
+    """
+    Checkpoint inventory every SNAPSHOT_INTERVAL_SECONDS and prune snapshots older than
+    SNAPSHOT_KEEP_DAYS; a no-op if another worker just did.
+    """
+    while True:
+        try:
+            await run_blocking(snapshot_if_due, SNAPSHOT_INTERVAL_SECONDS)
+        except Exception as e:
+            print(f"Inventory snapshot failed: {e}")
+        await asyncio.sleep(SNAPSHOT_INTERVAL_SECONDS)
+
+@app.on_event("shutdown")
+async def shutdown():
+    if getattr(app.state, "snapshot_task", None):
+        app.state.snapshot_task.cancel()
+    shutdown_jobs()
+    shutdown_sales_pool()
+    shutdown_password_executor()
+    shutdown_executor()
+    checkpoint("TRUNCATE")
+    close_pool()
 
 # ============ AUTH ENDPOINTS ============
 
 @app.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     """Authenticate user and return JWT token."""
-    if not authenticate_user(credentials.username, credentials.password):
+    if not await authenticate_user_async(credentials.username, credentials.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
     token = create_access_token(credentials.username)
@@ -41,402 +106,322 @@ async def login(credentials: UserLogin):
 
 # ============ BULK UPLOAD ENDPOINTS ============
 
-@app.post("/inventory/import")
-async def import_inventory(file: UploadFile = File(...), username: str = Depends(verify_token)):
+async def _process_upload(kind, engine, file, background, idempotency_key, atomic=False):
     """
-    Bulk import initial inventory from CSV.
-    CSV columns: ean, style_name, size, brand, style_design_code, model_no, store_id, quantity
+    Run an upload, or queue it with background=True.
+    An upload of a file (or Idempotency-Key) seen before returns the stored summary
+    without touching inventory again.
     """
-    errors = []
-    success_count = 0
-    
+    if background:
+        job = await submit_job(kind, engine, file, atomic=atomic, idempotency_key=idempotency_key)
+        return JSONResponse(status_code=202, content=job.model_dump())
+
     try:
-        contents = await file.read()
-        stream = io.StringIO(contents.decode('utf-8'))
-        reader = csv.DictReader(stream)
-        
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            for row_num, row in enumerate(reader, start=2):  # Start at 2 (header is row 1)
-                try:
-                    # Validate required fields
-                    ean = row.get('ean', '').strip()
-                    store_id = row.get('store_id', '').strip()
-                    quantity = row.get('quantity', '').strip()
-                    
-                    if not ean or not store_id or not quantity:
-                        errors.append({"row": row_num, "error": "Missing required fields"})
-                        continue
-                    
-                    # Validate data types
-                    try:
-                        store_id = int(store_id)
-                        quantity = int(quantity)
-                    except ValueError:
-                        errors.append({"row": row_num, "error": "Invalid store_id or quantity format"})
-                        continue
-                    
-                    # Validate quantity > 0
-                    if quantity <= 0:
-                        errors.append({"row": row_num, "error": "Quantity must be greater than 0"})
-                        continue
-                    
-                    # Check if store exists
-                    cursor.execute("SELECT store_id FROM store WHERE store_id = ?", (store_id,))
-                    if not cursor.fetchone():
-                        errors.append({"row": row_num, "error": f"Store {store_id} does not exist"})
-                        continue
-                    
-                    # Check if product exists, if not create it
-                    cursor.execute("SELECT ean FROM product WHERE ean = ?", (ean,))
-                    if not cursor.fetchone():
-                        cursor.execute("""
-                            INSERT INTO product (ean, style_name, size, brand, style_design_code, model_no)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        """, (
-                            ean,
-                            row.get('style_name', '').strip(),
-                            row.get('size', '').strip(),
-                            row.get('brand', '').strip(),
-                            row.get('style_design_code', '').strip() or None,
-                            row.get('model_no', '').strip() or None
-                        ))
-                    
-                    # Insert or update inventory
-                    cursor.execute("""
-                        INSERT INTO inventory (product_ean, store_id, quantity)
-                        VALUES (?, ?, ?)
-                        ON CONFLICT(product_ean, store_id) DO UPDATE SET quantity = quantity + excluded.quantity
-                    """, (ean, store_id, quantity))
-                    
-                    # Log transaction
-                    cursor.execute("""
-                        INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type)
-                        VALUES (?, ?, ?, 'Import')
-                    """, (ean, store_id, quantity))
-                    
-                    success_count += 1
-                
-                except Exception as e:
-                    errors.append({"row": row_num, "error": str(e)})
-            
-            conn.commit()
-        
-        status_code = "success" if not errors else "partial"
-        return UploadSummary(
-            success_count=success_count,
-            error_count=len(errors),
-            errors=errors,
-            status=status_code
-        )
-    
+        fingerprint = (kind, await run_blocking(hash_upload, file.file), idempotency_key)
+        return await run_blocking(run_upload, engine, read_csv_upload(file),
+                                  atomic=atomic, fingerprint=fingerprint)
+
+    except ExecutorBusy:
+        raise
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"File processing error: {str(e)}")
 
+@app.post("/inventory/import")
+async def import_inventory(
+    file: UploadFile = File(...),
+    background: bool = False,
+    idempotency_key: Annotated[Optional[str], Header()] = None,
+    username: str = Depends(verify_token)
+):
+    """
+    Bulk import initial inventory from CSV.
+    background=true queues the upload and returns a job to poll at /jobs/{job_id}.
+    CSV columns: ean, style_name, size, brand, style_design_code, model_no, store_id, quantity
+    """
+    return await _process_upload("import", import_rows, file, background, idempotency_key)
+
 @app.post("/inventory/transfer")
-async def transfer_inventory(file: UploadFile = File(...), username: str = Depends(verify_token)):
+async def transfer_inventory(
+    file: UploadFile = File(...),
+    background: bool = False,
+    atomic: bool = False,
+    idempotency_key: Annotated[Optional[str], Header()] = None,
+    username: str = Depends(verify_token)
+):
     """
     Bulk transfer inventory between stores from CSV.
     CSV columns: ean, source_store_id, destination_store_id, quantity
+    With atomic=true nothing is applied unless every row is valid.
     """
-    errors = []
-    success_count = 0
-    
-    try:
-        contents = await file.read()
-        stream = io.StringIO(contents.decode('utf-8'))
-        reader = csv.DictReader(stream)
-        
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            for row_num, row in enumerate(reader, start=2):
-                try:
-                    ean = row.get('ean', '').strip()
-                    source_store_id = row.get('source_store_id', '').strip()
-                    destination_store_id = row.get('destination_store_id', '').strip()
-                    quantity = row.get('quantity', '').strip()
-                    
-                    # Validate required fields
-                    if not all([ean, source_store_id, destination_store_id, quantity]):
-                        errors.append({"row": row_num, "error": "Missing required fields"})
-                        continue
-                    
-                    # Validate data types
-                    try:
-                        source_store_id = int(source_store_id)
-                        destination_store_id = int(destination_store_id)
-                        quantity = int(quantity)
-                    except ValueError:
-                        errors.append({"row": row_num, "error": "Invalid store_id or quantity format"})
-                        continue
-                    
-                    # Validate quantity > 0
-                    if quantity <= 0:
-                        errors.append({"row": row_num, "error": "Quantity must be greater than 0"})
-                        continue
-                    
-                    # Check if stores exist
-                    cursor.execute("SELECT store_id FROM store WHERE store_id IN (?, ?)", 
-                                 (source_store_id, destination_store_id))
-                    if len(cursor.fetchall()) != 2:
-                        errors.append({"row": row_num, "error": "Invalid source or destination store"})
-                        continue
-                    
-                    # Check if product exists
-                    cursor.execute("SELECT ean FROM product WHERE ean = ?", (ean,))
-                    if not cursor.fetchone():
-                        errors.append({"row": row_num, "error": f"Product {ean} does not exist"})
-                        continue
-                    
-                    # Check if source has sufficient quantity
-                    cursor.execute("""
-                        SELECT quantity FROM inventory 
-                        WHERE product_ean = ? AND store_id = ?
-                    """, (ean, source_store_id))
-                    inv_row = cursor.fetchone()
-                    current_qty = inv_row[0] if inv_row else 0
-                    
-                    if current_qty < quantity:
-                        errors.append({
-                            "row": row_num, 
-                            "error": f"Insufficient stock. Available: {current_qty}, Requested: {quantity}"
-                        })
-                        continue
-                    
-                    # Perform transfer (deduct from source, add to destination)
-                    cursor.execute("""
-                        UPDATE inventory SET quantity = quantity - ?
-                        WHERE product_ean = ? AND store_id = ?
-                    """, (quantity, ean, source_store_id))
-                    
-                    cursor.execute("""
-                        INSERT INTO inventory (product_ean, store_id, quantity)
-                        VALUES (?, ?, ?)
-                        ON CONFLICT(product_ean, store_id) DO UPDATE SET quantity = quantity + excluded.quantity
-                    """, (ean, destination_store_id, quantity))
-                    
-                    # Log transactions
-                    cursor.execute("""
-                        INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type)
-                        VALUES (?, ?, ?, 'Transfer')
-                    """, (ean, source_store_id, -quantity))
-                    
-                    cursor.execute("""
-                        INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type)
-                        VALUES (?, ?, ?, 'Transfer')
-                    """, (ean, destination_store_id, quantity))
-                    
-                    success_count += 1
-                
-                except Exception as e:
-                    errors.append({"row": row_num, "error": str(e)})
-            
-            conn.commit()
-        
-        status_code = "success" if not errors else "partial"
-        return UploadSummary(
-            success_count=success_count,
-            error_count=len(errors),
-            errors=errors,
-            status=status_code
-        )
-    
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"File processing error: {str(e)}")
+    return await _process_upload("transfer", transfer_rows, file, background, idempotency_key,
+                                 atomic=atomic)
 
 @app.post("/inventory/sales")
-async def record_sales(file: UploadFile = File(...), username: str = Depends(verify_token)):
+async def record_sales(
+    file: UploadFile = File(...),
+    background: bool = False,
+    idempotency_key: Annotated[Optional[str], Header()] = None,
+    username: str = Depends(verify_token)
+):
     """
     Bulk record EOD sales from CSV.
     CSV columns: ean, store_id, quantity_sold
     """
-    errors = []
-    success_count = 0
-    
-    try:
-        contents = await file.read()
-        stream = io.StringIO(contents.decode('utf-8'))
-        reader = csv.DictReader(stream)
-        
-        with get_db() as conn:
-            cursor = conn.cursor()
-            
-            for row_num, row in enumerate(reader, start=2):
-                try:
-                    ean = row.get('ean', '').strip()
-                    store_id = row.get('store_id', '').strip()
-                    quantity_sold = row.get('quantity_sold', '').strip()
-                    
-                    # Validate required fields
-                    if not all([ean, store_id, quantity_sold]):
-                        errors.append({"row": row_num, "error": "Missing required fields"})
-                        continue
-                    
-                    # Validate data types
-                    try:
-                        store_id = int(store_id)
-                        quantity_sold = int(quantity_sold)
-                    except ValueError:
-                        errors.append({"row": row_num, "error": "Invalid store_id or quantity format"})
-                        continue
-                    
-                    # Validate quantity > 0
-                    if quantity_sold <= 0:
-                        errors.append({"row": row_num, "error": "Quantity sold must be greater than 0"})
-                        continue
-                    
-                    # Check if store exists
-                    cursor.execute("SELECT store_id FROM store WHERE store_id = ?", (store_id,))
-                    if not cursor.fetchone():
-                        errors.append({"row": row_num, "error": f"Store {store_id} does not exist"})
-                        continue
-                    
-                    # Check if product exists
-                    cursor.execute("SELECT ean FROM product WHERE ean = ?", (ean,))
-                    if not cursor.fetchone():
-                        errors.append({"row": row_num, "error": f"Product {ean} does not exist"})
-                        continue
-                    
-                    # Check if final quantity would be >= 0
-                    cursor.execute("""
-                        SELECT quantity FROM inventory 
-                        WHERE product_ean = ? AND store_id = ?
-                    """, (ean, store_id))
-                    inv_row = cursor.fetchone()
-                    current_qty = inv_row[0] if inv_row else 0
-                    
-                    if current_qty < quantity_sold:
-                        errors.append({
-                            "row": row_num, 
-                            "error": f"Insufficient stock. Available: {current_qty}, Sold: {quantity_sold}"
-                        })
-                        continue
-                    
-                    # Deduct from inventory
-                    cursor.execute("""
-                        UPDATE inventory SET quantity = quantity - ?
-                        WHERE product_ean = ? AND store_id = ?
-                    """, (quantity_sold, ean, store_id))
-                    
-                    # Log transaction
-                    cursor.execute("""
-                        INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type)
-                        VALUES (?, ?, ?, 'Sale')
-                    """, (ean, store_id, -quantity_sold))
-                    
-                    success_count += 1
-                
-                except Exception as e:
-                    errors.append({"row": row_num, "error": str(e)})
-            
-            conn.commit()
-        
-        status_code = "success" if not errors else "partial"
-        return UploadSummary(
-            success_count=success_count,
-            error_count=len(errors),
-            errors=errors,
-            status=status_code
-        )
-    
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"File processing error: {str(e)}")
+    return await _process_upload("sales", sales_rows, file, background, idempotency_key)
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job_status(job_id: str, username: str = Depends(verify_token)):
+    """Poll a background upload: progress while running, the UploadSummary once done."""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 # ============ VIEW ENDPOINTS ============
 
+async def _cached_view(response, endpoint, params, if_none_match, compute):
+    """
+    Serve a read endpoint through the response cache; compute(conn) runs only on a miss.
+    Returns the value, or a bare 304 response when the client's ETag is still current.
+    """
+    key = cache_key(endpoint, params)
+    etag, value = await run_blocking(get_response_cache().resolve, key, compute, if_none_match)
+    if value is NOT_MODIFIED:
+        return Response(status_code=304, headers={"ETag": etag})
+    if response is not None:
+        response.headers["ETag"] = etag
+    return value
+
 @app.get("/inventory/stock-status", response_model=list[StockStatusResponse])
-async def get_stock_status(username: str = Depends(verify_token)):
-    """Get current stock levels across all stores."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT DISTINCT p.ean, p.style_name, p.brand
-            FROM product p
-            ORDER BY p.ean
-        """)
-        products = cursor.fetchall()
-        
-        result = []
-        for product in products:
-            ean, style_name, brand = product
-            cursor.execute("""
-                SELECT store_id, quantity FROM inventory
-                WHERE product_ean = ?
-                ORDER BY store_id
-            """, (ean,))
-            
-            stores = {}
-            total = 0
-            for store_id, qty in cursor.fetchall():
-                stores[str(store_id)] = qty
-                total += qty
-            
-            result.append(StockStatusResponse(
-                ean=ean,
-                style_name=style_name,
-                brand=brand,
-                stores=stores,
-                total_quantity=total
-            ))
-        
+async def get_stock_status(
+    response: Response,
+    format: str = "json",
+    limit: Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    cursor: str = None,
+    brand: str = None,
+    store_id: int = None,
+    style_name: str = None,
+    in_stock: bool = False,
+    as_of: str = None,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+    username: str = Depends(verify_token)
+):
+    """
+    Get current stock levels across all stores.
+    Pages are keyed on EAN: pass the X-Next-Cursor header of one page as `cursor` for the next.
+    store_id selects products with a row at that store, in_stock those with stock > 0
+    (at store_id when given); each still lists every store's quantity and the total.
+    format=ndjson streams one JSON object per line as rows are read (uncached).
+    as_of (date or datetime) returns stock at that time; stores with zero stock are omitted.
+    """
+    if as_of:
+        try:
+            as_of = parse_as_of(as_of)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="as_of must be YYYY-MM-DD or an ISO datetime")
+    filters = dict(after=cursor, limit=limit, brand=brand, store_id=store_id,
+                   style_name=style_name, in_stock=in_stock, as_of=as_of)
+
+    if format == "ndjson":
+        return StreamingResponse(_stream_stock_status(filters), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'ndjson'")
+
+    result = await _cached_view(response, "stock-status", filters, if_none_match,
+                                lambda conn: list(iter_stock_status(conn.cursor(), **filters)))
+    if isinstance(result, Response):
         return result
 
+    if limit is not None and len(result) == limit:
+        response.headers["X-Next-Cursor"] = result[-1]["ean"]
+    return result
+
+def _stream_stock_status(filters, chunk_size=500):
+    """Yield NDJSON stock-status lines in chunks, holding a pooled connection until done."""
+    with get_db() as conn:
+        lines = []
+        for item in iter_stock_status(conn.cursor(), **filters):
+            lines.append(json.dumps(item))
+            if len(lines) >= chunk_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+EXPORT_FORMATS = {
+    "csv.gz": (stream_csv_gz, "application/gzip", "stock.csv.gz"),
+    "columnar": (stream_columnar, "application/octet-stream", "stock.invcol"),
+}
+
+@app.get("/inventory/alerts", response_model=list[StockAlert])
+async def get_stock_alerts(
+    response: Response = None,
+    store_id: int = None,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+    username: str = Depends(verify_token)
+):
+    """(ean, store) pairs at or below their reorder point, read from the maintained alert set."""
+    return await _cached_view(response, "alerts", dict(store_id=store_id), if_none_match,
+                              lambda conn: list_alerts(conn.cursor(), store_id))
+
+def _save_reorder_points(points):
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rechecked = set_reorder_points(conn.cursor(), points)
+        conn.commit()
+    return rechecked
+
+@app.put("/inventory/reorder-points")
+async def put_reorder_points(points: list[ReorderPoint], username: str = Depends(verify_token)):
+    """
+    Set reorder points per (ean, store_id) or per brand, then re-check the pairs they cover.
+    A null threshold removes the reorder point.
+    """
+    for i, point in enumerate(points):
+        if (point.brand is None) == (point.ean is None or point.store_id is None):
+            raise HTTPException(status_code=400,
+                                detail=f"Point {i}: give either ean and store_id, or brand")
+    rechecked = await run_blocking(_save_reorder_points, [point.model_dump() for point in points])
+    return {"updated": len(points), "pairs_rechecked": rechecked}
+
+@app.get("/inventory/export")
+async def export_stock(format: str = "columnar", username: str = Depends(verify_token)):
+    """
+    Stream the full EAN x store quantity matrix for bulk consumers.
+    format=csv.gz for gzip'd CSV, format=columnar for the binary layout described in export.py.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    stream, media_type, filename = EXPORT_FORMATS[format]
+    return StreamingResponse(stream(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 @app.get("/inventory/analytics")
 async def get_analytics(
+    response: Response = None,
     store_id: int = None,
     start_date: str = None,
     end_date: str = None,
+    k: Annotated[int, Query(ge=1, le=MAX_TOP_K)] = 5,
+    if_none_match: Annotated[Optional[str], Header()] = None,
     username: str = Depends(verify_token)
 ):
-    """Get most/least moving items with optional filters."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        # Build query with filters
-        query = """
-            SELECT product_ean, SUM(ABS(quantity_change)) as total_movement
-            FROM [transaction]
-            WHERE transaction_type IN ('Sale', 'Transfer')
-        """
-        params = []
-        
-        if store_id:
-            query += " AND store_id = ?"
-            params.append(store_id)
-        
-        if start_date:
-            query += " AND DATE(timestamp) >= ?"
-            params.append(start_date)
-        
-        if end_date:
-            query += " AND DATE(timestamp) <= ?"
-            params.append(end_date)
-        
-        query += " GROUP BY product_ean ORDER BY total_movement DESC"
-        
-        cursor.execute(query, params)
-        movements = cursor.fetchall()
-        
-        most_moving = []
-        least_moving = []
-        
-        for i, (ean, movement) in enumerate(movements):
-            cursor.execute("SELECT style_name, brand FROM product WHERE ean = ?", (ean,))
-            product = cursor.fetchone()
-            if product:
-                item = {"ean": ean, "style_name": product[0], "brand": product[1], "movement": movement}
-                if i < 5:
-                    most_moving.append(item)
-                if i >= len(movements) - 5:
-                    least_moving.append(item)
-        
-        least_moving.reverse()
-        
-        return AnalyticsResponse(most_moving=most_moving, least_moving=least_moving)
+    """Get the k most/least moving items with optional filters."""
+    def compute(conn):
+        result = {"most_moving": [], "least_moving": []}
+        for key, ean, style_name, brand, movement in conn.execute(
+                *movers_query(k, store_id, start_date, end_date)):
+            result[key].append({"ean": ean, "style_name": style_name, "brand": brand, "movement": movement})
+        return result
+
+    params = dict(store_id=store_id, start_date=start_date, end_date=end_date, k=k)
+    result = await _cached_view(response, "analytics", params, if_none_match, compute)
+    if isinstance(result, Response):
+        return result
+    return AnalyticsResponse(**result)
+
+@app.get("/inventory/analytics/timeseries", response_model=TimeSeriesResponse)
+async def get_analytics_timeseries(
+    response: Response = None,
+    bucket: str = "day",
+    group_by: str = "",
+    store_id: int = None,
+    ean: str = None,
+    start_date: str = None,
+    end_date: str = None,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+    username: str = Depends(verify_token)
+):
+    """
+    Get movement bucketed by day, ISO week or month, optionally grouped by
+    a comma-separated list of ean, store_id, brand, style_design_code.
+    Returned columnar: one array per column, all the same length.
+    """
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(BUCKETS)}")
+    dims = [d.strip() for d in group_by.split(",") if d.strip()]
+    unknown = [d for d in dims if d not in DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by dimension(s): {', '.join(unknown)}")
+
+    def compute(conn):
+        rows = conn.execute(*timeseries_query(bucket, dims, store_id, ean, start_date, end_date)).fetchall()
+        names = ["bucket"] + dims + ["movement"]
+        values = list(zip(*rows)) if rows else [()] * len(names)
+        return {name: list(column) for name, column in zip(names, values)}
+
+    params = dict(bucket=bucket, group_by=",".join(dims), store_id=store_id, ean=ean,
+                  start_date=start_date, end_date=end_date)
+    columns = await _cached_view(response, "timeseries", params, if_none_match, compute)
+    if isinstance(columns, Response):
+        return columns
+    return TimeSeriesResponse(bucket=bucket, group_by=dims, columns=columns)
+
+@app.get("/inventory/forecast", response_model=list[ForecastRow])
+async def get_forecast(
+    response: Response = None,
+    store_id: int = None,
+    ean: str = None,
+    transfers_only: bool = False,
+    order: str = "days_of_cover",
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = 100,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+    username: str = Depends(verify_token)
+):
+    """
+    Sales velocity, days of cover and suggested transfer per (ean, store).
+    Returns the `limit` rows with the lowest days of cover, or with
+    order=suggested_transfer the largest suggested transfers.
+    """
+    if order not in FORECAST_ORDERS:
+        raise HTTPException(status_code=400, detail=f"order must be one of: {', '.join(FORECAST_ORDERS)}")
+    params = dict(store_id=store_id, ean=ean, transfers_only=transfers_only, order=order, limit=limit)
+    # Cover and velocities move with the date even when no data changes, so the day
+    # (UTC, as SQLite's DATE('now')) is part of the cache key and ETag
+    today = datetime.now(timezone.utc).date().isoformat()
+    return await _cached_view(response, "forecast", dict(params, today=today), if_none_match,
+                              lambda conn: forecast_rows(forecast(conn, today=today), **params))
+
+# ============ ADMIN ENDPOINTS ============
+
+@app.get("/admin/queries")
+async def get_query_profile(
+    limit: Annotated[int, Query(ge=1, le=500)] = 20,
+    order: str = "total_ms",
+    reset: bool = False,
+    username: str = Depends(verify_token)
+):
+    """
+    Top statements by total time (or max_ms, calls, rows) since startup, with the slow-query log.
+    Requires QUERY_PROFILE=1. reset=true starts a new window after this report.
+    """
+    if username not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if not profiling.QUERY_PROFILE:
+        raise HTTPException(status_code=404, detail="Query profiling is disabled (QUERY_PROFILE=1 enables it)")
+    if order not in QUERY_ORDERS:
+        raise HTTPException(status_code=400, detail=f"order must be one of {', '.join(QUERY_ORDERS)}")
+    report = profiling.stats.top(limit, order)
+    if reset:
+        profiling.stats.reset()
+    return report
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
-    return {"status": "ok"}
+    """Health check endpoint, with executor queue depths and cache counters."""
+    return {"status": "ok", "db_executor": executor_stats(),
+            "password_executor": password_executor_stats(), "auth_cache": auth_cache_stats(),
+            "response_cache": get_response_cache().stats()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    for name, stats in (("db", executor_stats()), ("password", password_executor_stats())):
+        metrics.EXECUTOR_QUEUED.set(stats["queued"], name)
+        metrics.EXECUTOR_RUNNING.set(stats["running"], name)
+        metrics.EXECUTOR_REJECTED.set(stats.get("rejected", 0), name)
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
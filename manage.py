@@ -0,0 +1,73 @@
+"""
+Maintenance commands for the inventory database.
+Run: python manage.py backfill-rollup
+"""
+import argparse
+
+import database
+from alerts import rebuild_alerts
+from queries import movement_query, ledger_movement_query
+from rollup import rebuild_daily_movement
+from snapshots import take_snapshot, prune_snapshots, SNAPSHOT_KEEP_DAYS
+
+
+def backfill_rollup(args):
+    """Rebuild daily_movement from the existing [transaction] rows."""
+    with database.get_db() as conn:
+        rows = rebuild_daily_movement(conn)
+    print(f"daily_movement rebuilt: {rows} rows")
+
+
+def check_rollup(args):
+    """Compare rollup analytics against the raw ledger for the given filters."""
+    filters = dict(store_id=args.store_id, start_date=args.start_date, end_date=args.end_date)
+    with database.get_db() as conn:
+        rollup = conn.execute(*movement_query(**filters)).fetchall()
+        ledger = conn.execute(*ledger_movement_query(**filters)).fetchall()
+    if sorted(map(tuple, rollup)) != sorted(map(tuple, ledger)):
+        raise SystemExit("daily_movement does not match the ledger; run backfill-rollup")
+    print(f"daily_movement matches the ledger ({len(ledger)} EANs)")
+
+
+def snapshot(args):
+    """Checkpoint the current inventory for as-of stock queries."""
+    with database.get_db() as conn:
+        snapshot_ts = take_snapshot(conn)
+    print(f"Inventory snapshot taken at {snapshot_ts}" if snapshot_ts else "A snapshot for this second exists")
+
+
+def prune(args):
+    """Delete snapshots older than --keep-days."""
+    with database.get_db() as conn:
+        removed = prune_snapshots(conn, args.keep_days)
+    print(f"Removed {removed} snapshots older than {args.keep_days} days")
+
+
+def rebuild_alerts_command(args):
+    """Recompute stock_alert from the whole inventory (after editing thresholds by hand)."""
+    with database.get_db() as conn:
+        alerts = rebuild_alerts(conn)
+    print(f"stock_alert rebuilt: {alerts} alerts")
+
+
+COMMANDS = {
+    "backfill-rollup": backfill_rollup,
+    "check-rollup": check_rollup,
+    "snapshot": snapshot,
+    "prune-snapshots": prune,
+    "rebuild-alerts": rebuild_alerts_command,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--db", default=database.DATABASE_PATH)
+    parser.add_argument("--store-id", type=int)
+    parser.add_argument("--start-date")
+    parser.add_argument("--end-date")
+    parser.add_argument("--keep-days", type=int, default=SNAPSHOT_KEEP_DAYS)
+    args = parser.parse_args()
+
+    database.DATABASE_PATH = args.db
+    database.init_db()
+    COMMANDS[args.command](args)
@@ -0,0 +1,321 @@
+"""
+Prometheus-style metrics, served as text on GET /metrics.
+
+Request latency per route, SQLite statement counts and durations per endpoint,
+connection pool wait, and per-upload stage timers with rows/sec. Everything is
+kept in this process; with several workers, scrape each one (or sum by instance).
+METRICS_ENABLED=0 skips the middleware and the instrumented connections, and
+turns stage timers into no-ops.
+"""
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+PARSE_BATCH_ROWS = 1000  # Rows pulled from the CSV reader per parse timing
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of series, one per label value tuple."""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            for labels, value in series:
+                lines.extend(self._render_series(labels, value))
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount, *labels):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def _render_series(self, labels, value):
+        yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._series[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """Record one observation. Per-bucket counts are stored, cumulated on render."""
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _render_series(self, labels, value):
+        counts, total, count = value
+        cumulative = 0
+        for bound, n in zip(self.buckets + ("+Inf",), counts):
+            cumulative += n
+            le = 'le="%s"' % bound
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+        yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+        yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to serve a request, until the last body byte is sent.",
+    ("method", "route", "status"))
+DB_QUERY_SECONDS = Histogram(
+    "sqlite_statement_duration_seconds", "Time in execute/executemany per statement, by endpoint.",
+    ("endpoint",), QUERY_BUCKETS)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "sqlite_pool_wait_seconds", "Time to obtain a pooled connection (waiting or opening one).",
+    (), QUERY_BUCKETS)
+UPLOAD_SECONDS = Histogram(
+    "upload_duration_seconds", "Wall time of one upload, from the first row read to commit.", ("upload",))
+UPLOAD_STAGE_SECONDS = Histogram(
+    "upload_stage_duration_seconds", "Time one upload spent in each stage.", ("upload", "stage"))
+UPLOAD_ROWS = Counter("upload_rows_total", "CSV rows read by uploads, accepted or not.", ("upload",))
+UPLOAD_ROWS_PER_SECOND = Gauge("upload_rows_per_second", "Throughput of the last upload.", ("upload",))
+EXECUTOR_QUEUED = Gauge("executor_queued_calls", "Calls waiting for an executor thread.", ("executor",))
+EXECUTOR_RUNNING = Gauge("executor_running_calls", "Calls running on an executor thread.", ("executor",))
+EXECUTOR_REJECTED = Gauge("executor_rejected_calls", "Calls rejected because the queue was full.", ("executor",))
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Drop every recorded series (tests and benchmarks)."""
+    for metric in _registry:
+        metric.clear()
+
+
+# ============ REQUESTS ============
+
+# The request scope (whose "route" the router fills in) or a fixed label for work
+# outside a request, such as background jobs
+_endpoint = ContextVar("metrics_endpoint", default="none")
+
+
+def set_endpoint(label):
+    """Label SQLite statements run in this context (and the threads it hands work to)."""
+    _endpoint.set(label)
+
+
+def current_endpoint():
+    value = _endpoint.get()
+    if isinstance(value, str):
+        return value
+    route = value.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request by method, route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = _endpoint.set(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _endpoint.reset(token)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"],
+                                         route.path if route is not None else "unmatched", str(status))
+
+
+# ============ SQLITE ============
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times execute/executemany (to the first result row) per endpoint."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, current_endpoint())
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, current_endpoint())
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors, including those behind conn.execute, are instrumented."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    """The sqlite3.connect factory to use: instrumented only while metrics are enabled."""
+    return InstrumentedConnection if METRICS_ENABLED else sqlite3.Connection
+
+
+# ============ UPLOAD STAGES ============
+
+class UploadTimer:
+    """
+    Exclusive stage clock for one upload: time is charged to the innermost open
+    stage, so nested stages (decoding inside parsing) are not double counted.
+    Time outside any stage is charged to the base stage ("validate", the engines'
+    own row checks).
+    """
+
+    def __init__(self, upload, base="validate"):
+        self.upload = upload
+        self.seconds = {}
+        self.rows = 0
+        self._stack = [base]
+        self._started = self._mark = time.perf_counter()
+
+    def _switch(self):
+        now = time.perf_counter()
+        stage = self._stack[-1]
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + now - self._mark
+        self._mark = now
+
+    @contextmanager
+    def stage(self, name):
+        self._switch()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._switch()
+            self._stack.pop()
+
+    def finish(self):
+        """Record the stage times, row count and throughput of this upload."""
+        self._switch()
+        elapsed = time.perf_counter() - self._started
+        UPLOAD_SECONDS.observe(elapsed, self.upload)
+        for stage, seconds in self.seconds.items():
+            UPLOAD_STAGE_SECONDS.observe(seconds, self.upload, stage)
+        UPLOAD_ROWS.inc(self.rows, self.upload)
+        if elapsed > 0:
+            UPLOAD_ROWS_PER_SECOND.set(round(self.rows / elapsed, 1), self.upload)
+
+
+_upload_timer = ContextVar("upload_timer", default=None)
+
+
+@contextmanager
+def upload_timer(upload):
+    """Time the stages of one upload run in this context; yields the timer (None if disabled)."""
+    if not METRICS_ENABLED:
+        yield None
+        return
+    timer = UploadTimer(upload)
+    token = _upload_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _upload_timer.reset(token)
+        timer.finish()
+
+
+def stage(name):
+    """Context manager charging the enclosed work to `name` on the current upload's timer."""
+    timer = _upload_timer.get()
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+def timed_rows(reader, timer):
+    """
+    Yield rows from reader, charging the reading to the "parse" stage.
+    Rows are pulled PARSE_BATCH_ROWS at a time, so the clock is read per batch, not per row.
+    """
+    if timer is None:
+        yield from reader
+        return
+    reader = iter(reader)
+    while True:
+        with timer.stage("parse"):
+            batch = [row for _, row in zip(range(PARSE_BATCH_ROWS), reader)]
+        timer.rows += len(batch)
+        yield from batch
+        if len(batch) < PARSE_BATCH_ROWS:
+            return
@@ -0,0 +1,176 @@
+"""
+Versioned schema migrations, applied in order on top of the base schema in init_db.
+The current version is stored in SQLite's `PRAGMA user_version`.
+Append new migrations to the end of MIGRATIONS; never edit or reorder shipped ones.
+"""
+
+MIGRATIONS = [
+    (1, "Indexes backing stock-status filters and keyset pages", [
+        "CREATE INDEX IF NOT EXISTS idx_product_brand ON product (brand, ean)",
+        "CREATE INDEX IF NOT EXISTS idx_product_style_name ON product (style_name, ean)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_inventory_product_stock
+        ON inventory (product_ean, store_id, quantity)
+        """,
+    ]),
+    (2, "Covering indexes on the transaction ledger for analytics", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_transaction_type_store_time
+        ON [transaction] (transaction_type, store_id, timestamp, product_ean, quantity_change)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_transaction_type_time
+        ON [transaction] (transaction_type, timestamp, product_ean, quantity_change)
+        """,
+    ]),
+    (3, "daily_movement rollup of Sale/Transfer ledger rows, backfilled from the ledger", [
+        """
+        CREATE TABLE IF NOT EXISTS daily_movement (
+            product_ean TEXT NOT NULL,
+            store_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            movement INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, store_id, product_ean)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_daily_movement_store_day
+        ON daily_movement (store_id, day, product_ean, movement)
+        """,
+        """
+        INSERT INTO daily_movement (product_ean, store_id, day, movement)
+        SELECT product_ean, store_id, DATE(timestamp), SUM(ABS(quantity_change))
+        FROM [transaction]
+        WHERE transaction_type IN ('Sale', 'Transfer')
+        GROUP BY product_ean, store_id, DATE(timestamp)
+        """,
+    ]),
+    (4, "upload table recording each processed file for idempotent replays", [
+        """
+        CREATE TABLE IF NOT EXISTS upload (
+            upload_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            idempotency_key TEXT,
+            summary TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Not unique: identical content outside the replay window is new data
+        "CREATE INDEX IF NOT EXISTS idx_upload_kind_hash_time ON upload (kind, content_hash, created_at)",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_upload_kind_key
+        ON upload (kind, idempotency_key) WHERE idempotency_key IS NOT NULL
+        """,
+    ]),
+    (5, "data_version counter bumped by every committed upload, for response caching", [
+        """
+        CREATE TABLE IF NOT EXISTS data_version (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """,
+        # Random start, so a cache that outlives a database swap cannot match old versions
+        """
+        INSERT OR IGNORE INTO data_version (name, version)
+        VALUES ('inventory', ABS(RANDOM() % 1000000000000))
+        """,
+    ]),
+    (6, "inventory_snapshot checkpoints and a ledger timestamp index for as-of stock", [
+        """
+        CREATE TABLE IF NOT EXISTS inventory_snapshot_meta (
+            snapshot_ts TEXT PRIMARY KEY,
+            last_transaction_id INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS inventory_snapshot (
+            snapshot_ts TEXT NOT NULL,
+            product_ean TEXT NOT NULL,
+            store_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_ts, product_ean, store_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_transaction_time
+        ON [transaction] (timestamp, product_ean, store_id, quantity_change)
+        """,
+    ]),
+    (7, "reorder points and the maintained stock_alert set", [
+        """
+        CREATE TABLE IF NOT EXISTS reorder_point (
+            product_ean TEXT NOT NULL,
+            store_id INTEGER NOT NULL,
+            threshold INTEGER NOT NULL,
+            PRIMARY KEY (product_ean, store_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS brand_reorder_point (
+            brand TEXT PRIMARY KEY,
+            threshold INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stock_alert (
+            product_ean TEXT NOT NULL,
+            store_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            threshold INTEGER NOT NULL,
+            raised_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (product_ean, store_id)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (8, "units sold per day in daily_movement and a sales data version, for forecasting", [
+        "ALTER TABLE daily_movement ADD COLUMN sold INTEGER NOT NULL DEFAULT 0",
+        """
+        UPDATE daily_movement SET sold = s.sold
+        FROM (
+            SELECT product_ean, store_id, DATE(timestamp) AS day, -SUM(quantity_change) AS sold
+            FROM [transaction]
+            WHERE transaction_type = 'Sale'
+            GROUP BY product_ean, store_id, DATE(timestamp)
+        ) s
+        WHERE daily_movement.product_ean = s.product_ean AND daily_movement.store_id = s.store_id
+          AND daily_movement.day = s.day
+        """,
+        """
+        INSERT OR IGNORE INTO data_version (name, version)
+        VALUES ('sales', ABS(RANDOM() % 1000000000000))
+        """,
+    ]),
+]
+
+
+def schema_version(conn):
+    """Return the migration version the database is at."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn):
+    """
+    Apply every pending migration, each in its own transaction. Returns the applied versions.
+    Safe for several processes starting together: each step takes the write lock first
+    and re-reads the version under it, so a step another process applied is skipped.
+    """
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if version <= schema_version(conn):
+                conn.execute("ROLLBACK")
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
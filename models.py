@@ -67,6 +67,40 @@ class UploadSummary(BaseModel):
     error_count: int
     errors: List[dict]
     status: str
+    replayed: bool = False  # True when an identical earlier upload's summary is returned
+
+class ReorderPoint(BaseModel):
+    ean: Optional[str] = None  # With store_id: a reorder point for one (ean, store) pair
+    store_id: Optional[int] = None
+    brand: Optional[str] = None  # Or: the default for every pair of a brand
+    threshold: Optional[int] = Field(default=None, ge=0)  # None removes the reorder point
+
+class StockAlert(BaseModel):
+    ean: str
+    style_name: str
+    brand: str
+    store_id: int
+    quantity: int
+    threshold: int
+    raised_at: str
+
+class ForecastRow(BaseModel):
+    ean: str
+    store_id: int
+    quantity: int
+    velocity_ma: float  # Units sold per day over the moving-average window
+    velocity_ewma: float  # Exponentially smoothed units sold per day
+    days_of_cover: Optional[float]  # quantity / velocity_ewma; None when nothing sells
+    suggested_transfer: int  # Positive: receive from other stores, negative: send
+
+class JobStatus(BaseModel):
+    job_id: str
+    kind: str  # import, transfer or sales
+    status: str  # queued, running, done or failed
+    rows_processed: int = 0
+    error_count: int = 0
+    result: Optional[UploadSummary] = None
+    detail: Optional[str] = None
 
 class StockStatusResponse(BaseModel):
     ean: str
@@ -78,3 +112,9 @@ class StockStatusResponse(BaseModel):
 class AnalyticsResponse(BaseModel):
     most_moving: List[dict]
     least_moving: List[dict]
+
+
+class TimeSeriesResponse(BaseModel):
+    bucket: str
+    group_by: List[str]
+    columns: dict  # {column: [values...]}, parallel arrays of equal length
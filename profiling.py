@@ -0,0 +1,234 @@
+"""
+Optional per-statement query profiling (QUERY_PROFILE=1).
+
+Pooled connections then hand out profiling cursors. Each statement is recorded by
+its normalized text (literals and IN lists folded to ?), with parameter shapes,
+calls, rows and time. Time covers execute plus fetching, not the caller's work
+between fetches. An execution slower than SLOW_QUERY_MS is printed and kept in
+a slow-query log together with its EXPLAIN QUERY PLAN. Stats are per process,
+kept since startup or the last reset().
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from itertools import chain
+
+import metrics
+
+QUERY_PROFILE = os.environ.get("QUERY_PROFILE", "0") == "1"
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_LOG_SIZE = int(os.environ.get("SLOW_LOG_SIZE", "100"))
+MAX_STATEMENTS = 2000  # Distinct normalized statements tracked; later ones share one bucket
+MAX_SHAPES = 5  # Parameter shapes kept per statement
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+@lru_cache(maxsize=4096)
+def normalize(sql):
+    """Fold literals to ?, IN (?, ?, ...) lists to (?...), and whitespace to single spaces."""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _SPACE.sub(" ", sql).strip()
+    return _IN_LIST.sub("IN (?...)", sql)
+
+
+def param_shape(params):
+    """Describe bound parameters by type, runs collapsed: (str, int x500)."""
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in sorted(params.items())) + "}"
+    parts = []
+    for value in params:
+        name = type(value).__name__
+        if parts and parts[-1][0] == name:
+            parts[-1][1] += 1
+        else:
+            parts.append([name, 1])
+    return "(" + ", ".join(name if n == 1 else f"{name} x{n}" for name, n in parts) + ")"
+
+
+class QueryStats:
+    """Aggregated statement stats plus the slow-query log."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._statements = {}
+            self._slow = deque(maxlen=SLOW_LOG_SIZE)
+
+    def record(self, sql, shape, seconds, rows, many=False):
+        with self._lock:
+            entry = self._statements.get(sql)
+            if entry is None:
+                if len(self._statements) >= MAX_STATEMENTS:
+                    sql = "(other statements)"
+                entry = self._statements.setdefault(sql, {
+                    "statement": sql, "calls": 0, "executemany": many, "rows": 0,
+                    "total_ms": 0.0, "max_ms": 0.0, "param_shapes": {}})
+            entry["calls"] += 1
+            entry["rows"] += max(rows, 0)
+            entry["total_ms"] += seconds * 1000
+            entry["max_ms"] = max(entry["max_ms"], seconds * 1000)
+            shapes = entry["param_shapes"]
+            if shape in shapes or len(shapes) < MAX_SHAPES:
+                shapes[shape] = shapes.get(shape, 0) + 1
+
+    def log_slow(self, entry):
+        with self._lock:
+            self._slow.append(entry)
+        print(f"Slow query ({entry['duration_ms']:.1f} ms, {entry['rows']} rows, {entry['endpoint']}): "
+              f"{entry['statement']} | plan: {' / '.join(entry['plan'] or []) or '-'}")
+
+    def top(self, limit=20, order="total_ms"):
+        """The `limit` statements with the highest `order` (total_ms, max_ms, calls or rows)."""
+        with self._lock:
+            entries = [dict(e, param_shapes=dict(e["param_shapes"])) for e in self._statements.values()]
+            slow = list(self._slow)
+        for entry in entries:
+            entry["avg_ms"] = round(entry["total_ms"] / entry["calls"], 3)
+            entry["total_ms"] = round(entry["total_ms"], 3)
+            entry["max_ms"] = round(entry["max_ms"], 3)
+        entries.sort(key=lambda e: e[order], reverse=True)
+        return {"since": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+                "statements": len(entries), "top": entries[:limit], "slow": slow[::-1][:limit]}
+
+
+stats = QueryStats()
+
+
+def _explain(conn, sql, parameter_count):
+    """EXPLAIN QUERY PLAN lines for sql, bound with NULLs; None if it cannot be planned."""
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    try:
+        # A plain cursor, so the EXPLAIN itself is not profiled
+        rows = conn.cursor(sqlite3.Cursor).execute(
+            "EXPLAIN QUERY PLAN " + sql, [None] * parameter_count).fetchall()
+        return [row[3] for row in rows]
+    except sqlite3.Error:
+        return None
+
+
+class ProfilingCursor(metrics.InstrumentedCursor):
+    """
+    Cursor that times each execution from execute through its last fetch and counts
+    the rows it returned. An execution is closed out when the cursor is exhausted,
+    re-executed, closed or collected.
+    """
+
+    _pending = None  # [sql, normalized, shape, parameter count, seconds, rows, many]
+
+    def _start(self, sql, params, many):
+        self._finish()
+        self._pending = [sql, normalize(sql), param_shape(params), len(params), 0.0, 0, many]
+
+    def _add(self, started, rows):
+        pending = self._pending
+        if pending is not None:
+            pending[4] += time.perf_counter() - started
+            pending[5] += rows
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        sql, normalized, shape, count, seconds, rows, many = pending
+        stats.record(normalized, shape, seconds, rows, many)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            stats.log_slow({
+                "statement": normalized, "param_shape": shape, "duration_ms": round(seconds * 1000, 3),
+                "rows": rows, "endpoint": metrics.current_endpoint(),
+                "at": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "plan": _explain(self.connection, sql, count)})
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters, False)
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._add(started, 0)
+        if self.description is None:
+            # No result rows to fetch: DML reports its row count, the rest finish here
+            self._add(time.perf_counter(), max(self.rowcount, 0))
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        # Peek at the first parameter set for the shape; generators are not materialized
+        params = iter(seq_of_parameters)
+        first = next(params, None)
+        seq_of_parameters = [] if first is None else chain([first], params)
+        self._start(sql, first or (), True)
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add(started, max(self.rowcount, 0))
+            self._finish()
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add(started, 0)
+            self._finish()
+            raise
+        self._add(started, 1)
+        return row
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._add(started, row is not None)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add(started, len(rows))
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._add(started, len(rows))
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class ProfilingConnection(metrics.InstrumentedConnection):
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+
+def connection_factory():
+    """The sqlite3.connect factory for new pooled connections."""
+    return ProfilingConnection if QUERY_PROFILE else metrics.connection_factory()
@@ -0,0 +1,255 @@
+"""Read-side queries behind the view endpoints."""
+from itertools import groupby
+from operator import itemgetter
+
+from snapshots import nearest_base, stock_as_of_query
+
+# Bucket label expressions over a day column; weeks are ISO weeks labelled by their Monday
+BUCKETS = {
+    "day": "day",
+    "week": "DATE(day, '-6 days', 'weekday 1')",
+    "month": "STRFTIME('%Y-%m-01', day)",
+}
+
+# Time-series group-by dimensions and the columns they read
+DIMENSIONS = {
+    "ean": "dm.product_ean",
+    "store_id": "dm.store_id",
+    "brand": "p.brand",
+    "style_design_code": "p.style_design_code",
+}
+
+
+def prefix_end(prefix):
+    """
+    Smallest string above every string starting with prefix, in SQLite's binary
+    (UTF-8) order: the prefix with its last character incremented. None when every
+    character is already the highest code point, i.e. there is no upper bound.
+    """
+    while prefix and prefix[-1] == "\U0010ffff":
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    following = ord(prefix[-1]) + 1
+    if 0xD800 <= following <= 0xDFFF:  # Surrogates cannot be stored; nothing sorts between
+        following = 0xE000
+    return prefix[:-1] + chr(following)
+
+
+def stock_status_query(after=None, limit=None, brand=None, store_id=None,
+                       style_name=None, in_stock=False, stock=None):
+    """
+    Build the stock-status query for one keyset page.
+    Products are filtered and limited first, then joined to their inventory rows,
+    so the cost follows the page size rather than the catalogue size.
+    stock is an optional (query, params) of (product_ean, store_id, quantity) rows
+    to read instead of the live inventory table, e.g. stock as of a past time.
+    """
+    conditions = []
+    params = []
+    source = "inventory"
+    prefix = ""
+    if stock is not None:
+        source = "stock"
+        prefix = f"stock AS MATERIALIZED ({stock[0]}),"
+        params.extend(stock[1])
+
+    if after:
+        conditions.append("p.ean > ?")
+        params.append(after)
+
+    if brand:
+        conditions.append("p.brand = ?")
+        params.append(brand)
+
+    if style_name:
+        # Range instead of LIKE so idx_product_style_name can serve the prefix
+        conditions.append("p.style_name >= ?")
+        params.append(style_name)
+        end = prefix_end(style_name)
+        if end is not None:
+            conditions.append("p.style_name < ?")
+            params.append(end)
+
+    if store_id is not None or in_stock:
+        stock_conditions = ["s.product_ean = p.ean"]
+        if store_id is not None:
+            stock_conditions.append("s.store_id = ?")
+            params.append(store_id)
+        if in_stock:
+            stock_conditions.append("s.quantity > 0")
+        conditions.append(f"EXISTS (SELECT 1 FROM {source} s WHERE {' AND '.join(stock_conditions)})")
+
+    page = "SELECT p.ean, p.style_name, p.brand FROM product p"
+    if conditions:
+        page += " WHERE " + " AND ".join(conditions)
+    page += " ORDER BY p.ean"
+    if limit is not None:
+        page += " LIMIT ?"
+        params.append(limit)
+
+    query = f"""
+        WITH {prefix} page AS ({page})
+        SELECT page.ean, page.style_name, page.brand, i.store_id, i.quantity
+        FROM page
+        LEFT JOIN {source} i ON i.product_ean = page.ean
+        ORDER BY page.ean, i.store_id
+    """
+    return query, params
+
+
+def iter_stock_status(cursor, as_of=None, **filters):
+    """
+    Yield one stock-status dict per product from a single joined query.
+    Rows arrive ordered by EAN, so each product is complete once its group ends.
+    as_of ('YYYY-MM-DD HH:MM:SS') reads stock at that time from the nearest snapshot.
+    """
+    if as_of:
+        filters["stock"] = stock_as_of_query(nearest_base(cursor, as_of), as_of)
+    cursor.execute(*stock_status_query(**filters))
+    for ean, rows in groupby(cursor, key=itemgetter(0)):
+        stores = {}
+        total = 0
+        for _, style_name, brand, store_id, qty in rows:
+            if store_id is not None:
+                stores[str(store_id)] = qty
+                total += qty
+        yield {
+            "ean": ean,
+            "style_name": style_name,
+            "brand": brand,
+            "stores": stores,
+            "total_quantity": total,
+        }
+
+
+def _rollup_filters(store_id=None, start_date=None, end_date=None, alias=""):
+    """Return the WHERE clause and params selecting daily_movement rows."""
+    conditions = ["1 = 1"]
+    params = []
+
+    if store_id:
+        conditions.append(f"{alias}store_id = ?")
+        params.append(store_id)
+
+    if start_date:
+        conditions.append(f"{alias}day >= ?")
+        params.append(start_date)
+
+    if end_date:
+        conditions.append(f"{alias}day <= ?")
+        params.append(end_date)
+
+    return " AND ".join(conditions), params
+
+
+def movement_query(store_id=None, start_date=None, end_date=None):
+    """
+    Build the per-EAN movement query for Sales and Transfers from the daily_movement rollup.
+    Returns exactly what ledger_movement_query returns, without scanning the ledger.
+    """
+    where, params = _rollup_filters(store_id, start_date, end_date)
+    query = f"""
+        SELECT product_ean, SUM(movement) as total_movement
+        FROM daily_movement
+        WHERE {where}
+        GROUP BY product_ean ORDER BY total_movement DESC
+    """
+    return query, params
+
+
+def movers_query(k, store_id=None, start_date=None, end_date=None):
+    """
+    Build the query for the k most and k least moving products with their names.
+    Movement is aggregated once; SQLite keeps only k rows per ORDER BY ... LIMIT sorter,
+    so nothing per-EAN reaches Python. Rows come back as (list, ean, style_name, brand, movement).
+    Ties break on EAN so the least-moving list is the exact reverse of the full ranking's tail.
+    """
+    where, params = _rollup_filters(store_id, start_date, end_date)
+    query = f"""
+        WITH movement AS MATERIALIZED (
+            SELECT product_ean, SUM(movement) AS total_movement
+            FROM daily_movement
+            WHERE {where}
+            GROUP BY product_ean
+        ),
+        named AS (
+            SELECT m.product_ean, p.style_name, p.brand, m.total_movement
+            FROM movement m
+            JOIN product p ON p.ean = m.product_ean
+        )
+        SELECT * FROM (
+            SELECT 'most_moving', * FROM named ORDER BY total_movement DESC, product_ean LIMIT ?
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'least_moving', * FROM named ORDER BY total_movement, product_ean DESC LIMIT ?
+        )
+    """
+    return query, params + [k, k]
+
+
+def timeseries_query(bucket="day", group_by=(), store_id=None, ean=None,
+                     start_date=None, end_date=None):
+    """
+    Build a bucketed movement series in one pass over the daily_movement rollup.
+    Rows are first summed per (day, group) in rollup index order, so only that much
+    smaller set is re-grouped into buckets.
+    Rows come back as (bucket, *group_by, movement), ordered by group then bucket.
+    """
+    where, params = _rollup_filters(store_id, start_date, end_date, alias="dm.")
+    if ean:
+        where += " AND dm.product_ean = ?"
+        params.append(ean)
+
+    dims = [DIMENSIONS[d] for d in group_by]
+    aliases = [f"d{i}" for i in range(len(dims))]
+    needs_product = any(d.startswith("p.") for d in dims)
+    inner_columns = ", ".join(["dm.day"] + [f"{d} AS {a}" for d, a in zip(dims, aliases)]
+                              + ["SUM(dm.movement) AS movement"])
+    group = ", ".join(aliases + ["bucket"])
+
+    query = f"""
+        SELECT {", ".join([BUCKETS[bucket] + " AS bucket"] + aliases + ["SUM(movement)"])}
+        FROM (
+            SELECT {inner_columns}
+            FROM daily_movement dm
+            {"JOIN product p ON p.ean = dm.product_ean" if needs_product else ""}
+            WHERE {where}
+            GROUP BY {", ".join(["dm.day"] + aliases)}
+        )
+        GROUP BY {group}
+        ORDER BY {group}
+    """
+    return query, params
+
+
+def ledger_movement_query(store_id=None, start_date=None, end_date=None):
+    """
+    Build the same movement query directly over the [transaction] ledger.
+    Dates are compared as ranges on the raw timestamp (never DATE(timestamp)),
+    so the ledger indexes from migration 2 can serve them.
+    Used to verify the rollup and as the benchmark baseline.
+    """
+    query = """
+        SELECT product_ean, SUM(ABS(quantity_change)) as total_movement
+        FROM [transaction]
+        WHERE transaction_type IN ('Sale', 'Transfer')
+    """
+    params = []
+
+    if store_id:
+        query += " AND store_id = ?"
+        params.append(store_id)
+
+    if start_date:
+        query += " AND timestamp >= ?"
+        params.append(start_date)
+
+    if end_date:
+        # DATE(timestamp) <= end_date  <=>  timestamp < the day after end_date
+        query += " AND timestamp < DATE(?, '+1 day')"
+        params.append(end_date)
+
+    query += " GROUP BY product_ean ORDER BY total_movement DESC"
+    return query, params
@@ -0,0 +1,188 @@
+"""
+Response cache for the read endpoints.
+Entries are tagged with the data version: a counter in the data_version table that
+every committed upload bumps in its own transaction. A version change makes every
+older entry stale at once, in every worker process, with no explicit invalidation.
+The same version drives ETags, so polling clients get 304s until the data changes.
+
+RESPONSE_CACHE selects the store: "memory" (per process, the default),
+"sqlite:<path>" (one cache file shared by all workers on the host) or "off".
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+from cache import TTLCache
+from database import get_db
+
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "memory")
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+# Per-process cap on cached bodies (JSON bytes): unpaged full-catalogue lists are large
+RESPONSE_CACHE_MAX_MB = float(os.environ.get("RESPONSE_CACHE_MAX_MB", "64"))
+
+NOT_MODIFIED = object()
+
+
+def current_version(conn, name="inventory"):
+    """Return a data version: "inventory" (any upload) or "sales" (sales uploads only)."""
+    return conn.execute("SELECT version FROM data_version WHERE name = ?", (name,)).fetchone()[0]
+
+
+def bump_version(cursor, name="inventory"):
+    """Mark data as changed; call inside the writing transaction."""
+    cursor.execute("UPDATE data_version SET version = version + 1 WHERE name = ?", (name,))
+
+
+def cache_key(endpoint, params):
+    """Build a key from the endpoint and its non-empty query parameters, in sorted order."""
+    return endpoint + "?" + urlencode(sorted((k, v) for k, v in params.items() if v is not None))
+
+
+def make_etag(key, version):
+    return '"' + hashlib.sha1(f"{version}:{key}".encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class MemoryStore:
+    """Per-process LRU of (version, value) entries, bounded by count and by total JSON size."""
+
+    def __init__(self, maxsize, ttl, maxbytes):
+        self._entries = TTLCache(maxsize, ttl, maxbytes)
+
+    def get(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def set(self, key, version, value):
+        self._entries.set(key, (version, value), size=len(json.dumps(value)))
+
+
+class SQLiteStore:
+    """Cache file shared by every worker process on the host; values are stored as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    body TEXT NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode = wal")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, version):
+        row = self._connect().execute(
+            "SELECT body FROM response_cache WHERE key = ? AND version = ?", (key, version)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, version, value):
+        with self._connect() as conn:
+            # One row per key: a newer version overwrites the stale entry
+            conn.execute("INSERT OR REPLACE INTO response_cache (key, version, body) VALUES (?, ?, ?)",
+                         (key, version, json.dumps(value)))
+
+
+class ResponseCache:
+    """Version-tagged read cache with hit/miss/304 counters and per-outcome latency."""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "not_modified": 0}
+        self._seconds = {"hits": 0.0, "misses": 0.0, "not_modified": 0.0}
+
+    def _count(self, outcome, started):
+        with self._lock:
+            self._counts[outcome] += 1
+            self._seconds[outcome] += time.perf_counter() - started
+
+    def resolve(self, key, compute, if_none_match=None):
+        """
+        Return (etag, value) for key, or (etag, NOT_MODIFIED) when if_none_match
+        already names the current version. compute(conn) runs only on a miss.
+        Version and data are read in one transaction, so an entry never pairs
+        one version's tag with another version's data.
+        """
+        started = time.perf_counter()
+        with get_db() as conn:
+            conn.execute("BEGIN")
+            try:
+                version = current_version(conn)
+                etag = make_etag(key, version)
+                if etag_matches(if_none_match, etag):
+                    self._count("not_modified", started)
+                    return etag, NOT_MODIFIED
+                value = self.store.get(key, version) if self.store else None
+                if value is not None:
+                    self._count("hits", started)
+                    return etag, value
+                value = compute(conn)
+            finally:
+                conn.rollback()
+        if self.store:
+            self.store.set(key, version, value)
+        self._count("misses", started)
+        return etag, value
+
+    def stats(self):
+        with self._lock:
+            served = sum(self._counts.values())
+            stats = dict(self._counts)
+            stats["hit_rate"] = round((served - self._counts["misses"]) / served, 4) if served else 0.0
+            for outcome, seconds in self._seconds.items():
+                count = self._counts[outcome]
+                stats[f"avg_{outcome}_ms"] = round(seconds / count * 1000, 3) if count else 0.0
+            return stats
+
+
+def _make_store(setting):
+    if setting == "off":
+        return None
+    if setting.startswith("sqlite:"):
+        return SQLiteStore(setting.split(":", 1)[1])
+    return MemoryStore(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, int(RESPONSE_CACHE_MAX_MB * 1024 * 1024))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return this process's response cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(_make_store(RESPONSE_CACHE))
+    return _cache
+
+
+def reset_response_cache():
+    """Drop the cache and its counters; the next use re-reads RESPONSE_CACHE."""
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -0,0 +1,50 @@
+"""
+Daily movement rollup: SUM(ABS(quantity_change)) of Sale and Transfer ledger rows
+per (product_ean, store_id, day), plus the units sold (Sale rows only) that the
+forecast reads. Upload engines update it in the same transaction as their ledger
+writes, so analytics never has to scan the ledger.
+"""
+from response_cache import bump_version
+
+
+def add_movement(movements, ean, store_id, day, quantity_change, sale=False):
+    """Accumulate one ledger row into a pending {(ean, store_id, day): [movement, sold]} batch."""
+    entry = movements.setdefault((ean, store_id, day), [0, 0])
+    entry[0] += abs(quantity_change)
+    if sale:
+        entry[1] -= quantity_change
+
+
+def flush_daily_movement(cursor, movements):
+    """Add a pending batch to daily_movement."""
+    if not movements:
+        return
+    cursor.executemany("""
+        INSERT INTO daily_movement (product_ean, store_id, day, movement, sold)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(day, store_id, product_ean) DO UPDATE
+        SET movement = movement + excluded.movement, sold = sold + excluded.sold
+    """, [(ean, store_id, day, movement, sold) for (ean, store_id, day), (movement, sold) in movements.items()])
+    movements.clear()
+
+
+REBUILD_QUERY = """
+    INSERT INTO daily_movement (product_ean, store_id, day, movement, sold)
+    SELECT product_ean, store_id, DATE(timestamp), SUM(ABS(quantity_change)),
+           SUM(CASE WHEN transaction_type = 'Sale' THEN -quantity_change ELSE 0 END)
+    FROM [transaction]
+    WHERE transaction_type IN ('Sale', 'Transfer')
+    GROUP BY product_ean, store_id, DATE(timestamp)
+"""
+
+
+def rebuild_daily_movement(conn):
+    """Rebuild daily_movement from the full [transaction] ledger. Returns the rollup row count."""
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM daily_movement")
+    cursor.execute(REBUILD_QUERY)
+    bump_version(cursor)
+    bump_version(cursor, "sales")
+    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM daily_movement")
+    return cursor.fetchone()[0]
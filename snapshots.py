@@ -0,0 +1,176 @@
+"""
+Inventory snapshots and point-in-time stock.
+
+A snapshot copies `inventory` into inventory_snapshot and records the last ledger
+transaction_id it includes in inventory_snapshot_meta. Stock as of a time T is the
+sum of every ledger row with timestamp <= T. It is computed from whichever base is
+nearest in time (a snapshot, the live inventory, or the empty origin) plus or
+minus only the ledger rows between the base and T.
+
+This relies on ledger timestamps following commit order: uploads take the write
+lock (BEGIN IMMEDIATE) before reading their timestamp, so every row committed
+after a snapshot has timestamp >= snapshot_ts and transaction_id > its
+last_transaction_id, and every row before it the opposite.
+"""
+import os
+from datetime import datetime, timezone
+
+from database import get_db
+
+SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get("SNAPSHOT_INTERVAL_SECONDS", str(24 * 3600)))  # 0 disables
+SNAPSHOT_KEEP_DAYS = int(os.environ.get("SNAPSHOT_KEEP_DAYS", "90"))  # Periodic pruning; 0 keeps all
+
+ORIGIN = ("", 0, "origin")  # (snapshot_ts, last_transaction_id, base) before any ledger row
+LIVE = "live"
+SNAPSHOT = "snapshot"
+
+
+def parse_as_of(value):
+    """
+    Normalize an as_of date or datetime to the ledger's 'YYYY-MM-DD HH:MM:SS' form (UTC,
+    as written by CURRENT_TIMESTAMP). A bare date means the end of that day; a datetime
+    with an offset is converted to UTC. Raises ValueError on anything else.
+    """
+    if len(value) == 10:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d 23:59:59")
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def take_snapshot(conn, min_age_seconds=0, snapshot_ts=None):
+    """
+    Checkpoint inventory into inventory_snapshot under the write lock.
+    Skipped (returns None) if a snapshot newer than min_age_seconds exists, so
+    several workers on one schedule produce one snapshot. Returns the snapshot_ts.
+    snapshot_ts overrides the clock for loading history; inventory must then
+    reflect exactly the ledger up to that time.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = snapshot_ts or conn.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+        latest = conn.execute("SELECT MAX(snapshot_ts) FROM inventory_snapshot_meta").fetchone()[0]
+        if latest is not None and (latest >= now or min_age_seconds and conn.execute(
+                "SELECT (JULIANDAY(?) - JULIANDAY(?)) * 86400 < ?",
+                (now, latest, min_age_seconds)).fetchone()[0]):
+            conn.rollback()
+            return None
+
+        conn.execute("""
+            INSERT INTO inventory_snapshot_meta (snapshot_ts, last_transaction_id)
+            SELECT ?, COALESCE(MAX(transaction_id), 0) FROM [transaction]
+        """, (now,))
+        conn.execute("""
+            INSERT INTO inventory_snapshot (snapshot_ts, product_ean, store_id, quantity)
+            SELECT ?, product_ean, store_id, quantity FROM inventory WHERE quantity != 0
+        """, (now,))
+        # No version bump: as-of results are the same from any base, and live stock is unchanged
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return now
+
+
+def snapshot_if_due(min_age_seconds=SNAPSHOT_INTERVAL_SECONDS, keep_days=SNAPSHOT_KEEP_DAYS):
+    """
+    take_snapshot on a pooled connection, unless one was taken within min_age_seconds.
+    The worker that takes it then prunes snapshots older than keep_days (0 keeps all).
+    """
+    with get_db() as conn:
+        snapshot_ts = take_snapshot(conn, min_age_seconds)
+        if snapshot_ts and keep_days > 0:
+            prune_snapshots(conn, keep_days)
+        return snapshot_ts
+
+
+def prune_snapshots(conn, keep_days):
+    """Delete snapshots older than keep_days. Returns the number removed."""
+    cutoff = conn.execute("SELECT DATETIME('now', ?)", (f"-{keep_days} days",)).fetchone()[0]
+    old = [row[0] for row in conn.execute(
+        "SELECT snapshot_ts FROM inventory_snapshot_meta WHERE snapshot_ts < ?", (cutoff,))]
+    conn.executemany("DELETE FROM inventory_snapshot WHERE snapshot_ts = ?", [(ts,) for ts in old])
+    conn.executemany("DELETE FROM inventory_snapshot_meta WHERE snapshot_ts = ?", [(ts,) for ts in old])
+    conn.commit()
+    return len(old)
+
+
+def _seconds(ts):
+    return datetime.fromisoformat(ts).timestamp()
+
+
+def nearest_base(cursor, as_of):
+    """
+    Pick the base closest in time to as_of: the latest snapshot at or before it
+    (or the origin) and the first one after it (or the live inventory).
+    Returns (snapshot_ts, last_transaction_id, kind).
+    """
+    before = cursor.execute("""
+        SELECT snapshot_ts, last_transaction_id FROM inventory_snapshot_meta
+        WHERE snapshot_ts <= ? ORDER BY snapshot_ts DESC LIMIT 1
+    """, (as_of,)).fetchone()
+    after = cursor.execute("""
+        SELECT snapshot_ts, last_transaction_id FROM inventory_snapshot_meta
+        WHERE snapshot_ts > ? ORDER BY snapshot_ts LIMIT 1
+    """, (as_of,)).fetchone()
+
+    if after:
+        after = (after[0], after[1], SNAPSHOT)
+    else:
+        now = cursor.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+        after = (max(now, as_of), None, LIVE)
+
+    if before:
+        before, since = (before[0], before[1], SNAPSHOT), before[0]
+    else:
+        # Replaying from the origin covers everything since the first ledger row
+        before, since = ORIGIN, cursor.execute("SELECT MIN(timestamp) FROM [transaction]").fetchone()[0]
+        if since is None or since > as_of:
+            return ORIGIN
+
+    return before if _seconds(as_of) - _seconds(since) <= _seconds(after[0]) - _seconds(as_of) else after
+
+
+def stock_as_of_query(base, as_of):
+    """
+    Build a SELECT of (product_ean, store_id, quantity) as of `as_of`, from `base`.
+    Only the ledger rows between the base and as_of are read. Zero balances are omitted.
+    """
+    snapshot_ts, last_id, kind = base
+    if kind == LIVE:
+        # Live inventory already holds every committed row; take back those after as_of
+        parts = ["SELECT product_ean, store_id, quantity FROM inventory",
+                 "SELECT product_ean, store_id, -quantity_change FROM [transaction] WHERE timestamp > ?"]
+        params = [as_of]
+    elif snapshot_ts <= as_of:
+        parts = ["""SELECT product_ean, store_id, quantity_change AS quantity FROM [transaction]
+                    WHERE timestamp >= ? AND timestamp <= ? AND transaction_id > ?"""]
+        params = [snapshot_ts, as_of, last_id]
+    else:
+        parts = ["""SELECT product_ean, store_id, -quantity_change AS quantity FROM [transaction]
+                    WHERE timestamp > ? AND timestamp <= ? AND transaction_id <= ?"""]
+        params = [as_of, snapshot_ts, last_id]
+    if kind == SNAPSHOT:
+        parts.insert(0, "SELECT product_ean, store_id, quantity FROM inventory_snapshot WHERE snapshot_ts = ?")
+        params.insert(0, snapshot_ts)
+
+    query = f"""
+        SELECT product_ean, store_id, SUM(quantity) AS quantity
+        FROM ({" UNION ALL ".join(parts)})
+        GROUP BY product_ean, store_id
+        HAVING SUM(quantity) != 0
+    """
+    return query, params
+
+
+def replay_query(as_of):
+    """Build the same stock as of `as_of` by replaying the whole ledger; the reference path."""
+    query = """
+        SELECT product_ean, store_id, SUM(quantity_change) AS quantity
+        FROM [transaction]
+        WHERE timestamp <= ?
+        GROUP BY product_ean, store_id
+        HAVING SUM(quantity_change) != 0
+    """
+    return query, [as_of]
@@ -0,0 +1,1202 @@
+"""
+In-process tests for the upload and query engines (no running server needed).
+Run: python -m pytest -q test_inventory.py
+The peak-memory test uploads a 20 MB file; MEMORY_TEST_MB=500 runs it at full size.
+"""
+import asyncio
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+from fastapi import HTTPException, Response
+from starlette.datastructures import UploadFile
+
+import auth
+import database
+import ingest
+import jobs
+import main
+import metrics
+import response_cache
+from queries import movement_query, ledger_movement_query
+from rollup import rebuild_daily_movement
+
+MEMORY_TEST_MB = int(os.environ.get("MEMORY_TEST_MB", "20"))  # Growth is flat in file size
+MEMORY_BUDGET_MB = 100
+READERS = 4
+READ_P99_BUDGET_S = 1.0
+HEALTH_MAX_LATENCY_S = 0.1
+REPLAY_MAX_LATENCY_S = 0.2
+
+
+def make_db(path):
+    """Create an empty schema with the default stores at `path`."""
+    database.DATABASE_PATH = path
+    database.init_db()
+    with database.get_db() as conn:
+        conn.executemany("INSERT INTO store (store_name) VALUES (?)",
+                         [(f"Store {i}",) for i in range(1, 5)] + [("ECommerce",)])
+        conn.commit()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Create a database with make_db in the test's tmp_path and close the pool afterwards."""
+    path = os.path.join(tmp_path, "inventory.db")
+    make_db(path)
+    yield path
+    database.close_pool()
+
+
+def upload(handler, path):
+    """Call an upload endpoint in-process with the CSV file at `path`."""
+    with open(path, "rb") as f:
+        return asyncio.run(handler(file=UploadFile(file=f, filename=os.path.basename(path)),
+                                   username="test"))
+
+
+def write_sales_csv(path, size_mb, products=100):
+    """Stream a synthetic sales CSV of roughly `size_mb` megabytes to disk."""
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", newline="") as f:
+        f.write("ean,store_id,quantity_sold\n")
+        i = 0
+        while written < target:
+            line = f"EAN{i % products:08d},{i % 5 + 1},1\n"
+            f.write(line)
+            written += len(line)
+            i += 1
+    return i
+
+
+def memory_probe(db_path, csv_path):
+    """Run a sales upload and print this process's peak RSS growth in MB."""
+    database.DATABASE_PATH = db_path
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    summary = upload(main.record_sales, csv_path)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(summary.success_count, summary.error_count, (after - before) / 1024)
+
+
+def test_sales_upload_peak_memory_is_flat(db_path, tmp_path):
+    csv_path = os.path.join(tmp_path, "sales.csv")
+    with database.get_db() as conn:
+        conn.executemany(
+            "INSERT INTO product (ean, style_name, size, brand) VALUES (?, 'Style', 'M', 'Rapheal')",
+            [(f"EAN{i:08d}",) for i in range(100)])
+        conn.executemany(
+            "INSERT INTO inventory (product_ean, store_id, quantity) VALUES (?, ?, ?)",
+            [(f"EAN{i:08d}", s, 10 ** 12) for i in range(100) for s in range(1, 6)])
+        conn.commit()
+    rows = write_sales_csv(csv_path, MEMORY_TEST_MB)
+
+    out = subprocess.run([sys.executable, __file__, "memory-probe", db_path, csv_path],
+                         check=True, capture_output=True, text=True).stdout.split()
+    success_count, error_count, peak_mb = int(out[-3]), int(out[-2]), float(out[-1])
+
+    assert success_count == rows
+    assert error_count == 0
+    assert peak_mb < MEMORY_BUDGET_MB, f"peak RSS grew by {peak_mb:.0f} MB"
+
+
+def write_import_csv(path, rows, products=2000):
+    """Write a synthetic import CSV spreading `rows` lines over `products` EANs."""
+    with open(path, "w", newline="") as f:
+        f.write("ean,style_name,size,brand,style_design_code,model_no,store_id,quantity\n")
+        for i in range(rows):
+            p = i % products
+            f.write(f"EAN{p:08d},Style {p},M,Rapheal,SD{p},M{p},{i % 5 + 1},1\n")
+
+
+def test_reads_are_not_blocked_by_bulk_upload(db_path, tmp_path):
+    seed_path = os.path.join(tmp_path, "seed.csv")
+    csv_path = os.path.join(tmp_path, "import.csv")
+    database.verify_storage_settings()
+    write_import_csv(seed_path, 2000)
+    upload(main.import_inventory, seed_path)
+    write_import_csv(csv_path, 200_000)
+
+    done = threading.Event()
+    latencies, failures = [], []
+
+    def reader():
+        loop = asyncio.new_event_loop()
+        try:
+            while not done.is_set():
+                start = time.perf_counter()
+                try:
+                    loop.run_until_complete(main.get_stock_status(Response(), username="test"))
+                except Exception as e:
+                    failures.append(e)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            loop.close()
+
+    # Every read must reach the database, not the response cache
+    cache_setting, response_cache.RESPONSE_CACHE = response_cache.RESPONSE_CACHE, "off"
+    response_cache.reset_response_cache()
+    threads = [threading.Thread(target=reader) for _ in range(READERS)]
+    for t in threads:
+        t.start()
+    try:
+        summary = upload(main.import_inventory, csv_path)
+    finally:
+        done.set()
+        for t in threads:
+            t.join()
+        response_cache.RESPONSE_CACHE = cache_setting
+        response_cache.reset_response_cache()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"\n{len(latencies)} reads during upload, p99 {p99 * 1000:.1f} ms")
+    assert summary.error_count == 0
+    assert not failures, failures[0]
+    assert p99 < READ_P99_BUDGET_S
+
+
+ANALYTICS_FILTERS = [
+    {},
+    {"store_id": 1},
+    {"start_date": "2025-01-01"},
+    {"end_date": "2025-01-31"},
+    {"store_id": 2, "start_date": "2025-01-01", "end_date": "2025-01-31"},
+]
+
+
+def test_connection_pool_reuses_replaces_and_times_out(db_path, monkeypatch):
+    pool = database.ConnectionPool(db_path, size=2, timeout=0.2)
+    first = pool.acquire()
+    first.execute("INSERT INTO store (store_name) VALUES ('Uncommitted')")
+    pool.release(first)
+    assert pool.acquire() is first  # Reused, with the open transaction rolled back
+    assert first.execute("SELECT COUNT(*) FROM store WHERE store_name = 'Uncommitted'").fetchone()[0] == 0
+
+    # A connection failing the health check is closed and replaced, keeping its slot
+    monkeypatch.setattr(database, "HEALTH_CHECK_INTERVAL", 0)
+    pool.release(first)
+    first.close()
+    replacement = pool.acquire()
+    assert replacement is not first and replacement.execute("SELECT 1").fetchone()[0] == 1
+    second = pool.acquire()
+
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError, match="Timed out"):
+        pool.acquire()
+    assert 0.2 <= time.perf_counter() - start < 1
+
+    # A waiter gets the next released connection
+    threading.Timer(0.05, pool.release, [second]).start()
+    assert pool.acquire() is second
+    pool.release(second)
+    pool.release(replacement)
+    pool.close()
+
+
+def test_analytics_queries_use_indexes(db_path):
+    with database.get_db() as conn:
+        for f in ANALYTICS_FILTERS:
+            query, params = ledger_movement_query(**f)
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+            assert not any(step.startswith("SCAN") for step in plan), (f, plan)
+            assert any("COVERING INDEX idx_transaction" in step for step in plan), (f, plan)
+
+            if f:
+                query, params = movement_query(**f)
+                plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+                assert not any(step.startswith("SCAN") for step in plan), (f, plan)
+
+
+def test_concurrent_workers_apply_each_migration_once(tmp_path, monkeypatch):
+    import sqlite3
+    import migrations
+
+    # A database left at version 2, with ledger rows for migration 3 to backfill
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:2])
+    database.DATABASE_PATH = os.path.join(tmp_path, "inventory.db")
+    database.init_db()
+    monkeypatch.undo()
+    with sqlite3.connect(database.DATABASE_PATH) as conn:
+        conn.execute("INSERT INTO store (store_name) VALUES ('Store 1')")
+        conn.execute("INSERT INTO product (ean, style_name, size, brand) VALUES ('EAN1', 'Style', 'M', 'B')")
+        conn.executemany("""
+            INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type, timestamp)
+            VALUES ('EAN1', 1, ?, 'Sale', '2025-01-01 10:00:00')
+        """, [(-2,), (-3,)])
+
+    start, failures = threading.Barrier(4), []
+
+    def worker():
+        conn = sqlite3.connect(database.DATABASE_PATH, timeout=30, isolation_level=None)
+        try:
+            start.wait()
+            migrations.apply_migrations(conn)
+        except Exception as e:
+            failures.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not failures, failures[0]
+    with sqlite3.connect(database.DATABASE_PATH) as conn:
+        assert migrations.schema_version(conn) == migrations.MIGRATIONS[-1][0]
+        assert conn.execute("SELECT movement, sold FROM daily_movement").fetchall() == [(5, 5)]
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="") as f:
+        f.write(header + "\n")
+        f.writelines(",".join(map(str, row)) + "\n" for row in rows)
+
+
+def movements(conn, query_builder, **filters):
+    return sorted(map(tuple, conn.execute(*query_builder(**filters)).fetchall()))
+
+
+def test_daily_movement_rollup_matches_ledger(db_path, tmp_path):
+    import_path, sales_path, transfer_path = (os.path.join(tmp_path, n) for n in ("i.csv", "s.csv", "t.csv"))
+    write_import_csv(import_path, 500, products=50)
+    write_csv(sales_path, "ean,store_id,quantity_sold",
+              [(f"EAN{i % 50:08d}", i % 5 + 1, i % 3 + 1) for i in range(300)] + [("EAN99999999", 1, 1)])
+    write_csv(transfer_path, "ean,source_store_id,destination_store_id,quantity",
+              [(f"EAN{i % 50:08d}", i % 5 + 1, (i + 1) % 5 + 1, 1) for i in range(200)])
+    upload(main.import_inventory, import_path)
+    assert upload(main.record_sales, sales_path).success_count > 0
+    assert upload(main.transfer_inventory, transfer_path).success_count > 0
+
+    with database.get_db() as conn:
+        # Backdated history, as if it predated the rollup
+        conn.executemany("""
+            INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(f"EAN{i % 50:08d}", i % 5 + 1, -(i % 4 + 1), ("Sale", "Transfer", "Import")[i % 3],
+               f"2025-01-{i % 31 + 1:02d} {i % 24:02d}:00:00") for i in range(2000)])
+        conn.commit()
+        today = conn.execute("SELECT DATE('now')").fetchone()[0]
+        live = [{}, {"store_id": 3}, {"start_date": today}, {"end_date": today}]
+        for f in live:
+            assert movements(conn, movement_query, **f) == \
+                movements(conn, ledger_movement_query, **dict(f, start_date=f.get("start_date", today)))
+
+        rebuild_daily_movement(conn)
+        for f in ANALYTICS_FILTERS + live:
+            assert movements(conn, movement_query, **f) == movements(conn, ledger_movement_query, **f), f
+
+def test_import_engine_matches_row_by_row_loop(db_path, monkeypatch):
+    def row(ean, store_id, quantity, style_name="Style", model_no=""):
+        return {"ean": ean, "style_name": style_name, "size": "M", "brand": "Rapheal",
+                "style_design_code": "", "model_no": model_no, "store_id": store_id, "quantity": quantity}
+
+    rows = [row(f"EAN{i % 12:08d}", str(i % 6 + 1), str(i % 4 + 1), style_name=f"Style {i}") for i in range(40)]
+    rows[3:3] = [row("", "1", "1"), row("EAN00000001", "", "1"), row("EAN00000001", "1", " "),
+                 row("EAN00000001", "one", "1"), row("EAN00000001", "1", "1.5"), row("EAN00000001", "1", "0"),
+                 row("EAN00000001", "1", "-3"), row("EAN00000099", "9", "1"), row("EAN00000098", "0", "2"),
+                 row(" EAN00000097 ", " 2 ", " 4 ", model_no=" M1 "), row("EAN00000001", "1", None),
+                 row("EAN00000000", "1", "5", style_name="Other name")]
+    with database.get_db() as conn:
+        conn.execute("INSERT INTO product (ean, style_name, size, brand) VALUES ('EAN00000005', 'Existing', 'S', 'X')")
+        conn.commit()
+
+    def reference(cursor):
+        """The original per-row loop of the import endpoint."""
+        errors, success_count = [], 0
+        for row_num, row in enumerate(rows, start=2):
+            try:
+                ean = row.get('ean', '').strip()
+                store_id = row.get('store_id', '').strip()
+                quantity = row.get('quantity', '').strip()
+                if not ean or not store_id or not quantity:
+                    errors.append({"row": row_num, "error": "Missing required fields"})
+                    continue
+                try:
+                    store_id = int(store_id)
+                    quantity = int(quantity)
+                except ValueError:
+                    errors.append({"row": row_num, "error": "Invalid store_id or quantity format"})
+                    continue
+                if quantity <= 0:
+                    errors.append({"row": row_num, "error": "Quantity must be greater than 0"})
+                    continue
+                cursor.execute("SELECT store_id FROM store WHERE store_id = ?", (store_id,))
+                if not cursor.fetchone():
+                    errors.append({"row": row_num, "error": f"Store {store_id} does not exist"})
+                    continue
+                cursor.execute("SELECT ean FROM product WHERE ean = ?", (ean,))
+                if not cursor.fetchone():
+                    cursor.execute("""
+                        INSERT INTO product (ean, style_name, size, brand, style_design_code, model_no)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, (ean, row.get('style_name', '').strip(), row.get('size', '').strip(),
+                          row.get('brand', '').strip(), row.get('style_design_code', '').strip() or None,
+                          row.get('model_no', '').strip() or None))
+                cursor.execute("""
+                    INSERT INTO inventory (product_ean, store_id, quantity) VALUES (?, ?, ?)
+                    ON CONFLICT(product_ean, store_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                """, (ean, store_id, quantity))
+                cursor.execute("""
+                    INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type)
+                    VALUES (?, ?, ?, 'Import')
+                """, (ean, store_id, quantity))
+                success_count += 1
+            except Exception as e:
+                errors.append({"row": row_num, "error": str(e)})
+        return success_count, errors
+
+    def state(conn):
+        return [list(map(tuple, conn.execute(query))) for query in (
+            "SELECT * FROM product ORDER BY ean",
+            "SELECT product_ean, store_id, quantity FROM inventory ORDER BY 1, 2",
+            "SELECT product_ean, store_id, quantity_change, transaction_type FROM [transaction] ORDER BY transaction_id",
+        )]
+
+    monkeypatch.setattr(ingest, "IMPORT_BATCH_SIZE", 7)  # Duplicates span several batches
+    with database.get_db() as conn:
+        engine = ingest.import_rows(conn.cursor(), iter(rows)), state(conn)
+        conn.rollback()
+        expected = reference(conn.cursor()), state(conn)
+        conn.rollback()
+    assert engine == expected
+    success_count, errors = engine[0]
+    assert success_count == 34 + 2 and len(errors) == 6 + 10  # Store 6 does not exist either
+    assert {e["error"] for e in errors} >= {"Missing required fields", "Store 9 does not exist",
+                                             "Invalid store_id or quantity format"}
+
+
+@pytest.mark.parametrize("workers", (1, 2))
+def test_partitioned_sales_match_row_by_row_semantics(db_path, tmp_path, workers):
+    sales = [(f"EAN{i % 30:08d}", i % 5 + 1, i % 9 + 1) for i in range(600)]
+    sales[10:10] = [("EAN99999999", 1, 1), ("EAN00000001", 9, 1), ("EAN00000001", "x", 1),
+                    ("EAN00000001", 2, 0), ("", 2, 1)]
+    import_path, sales_path = os.path.join(tmp_path, "i.csv"), os.path.join(tmp_path, "s.csv")
+    write_import_csv(import_path, 300, products=30)
+    write_csv(sales_path, "ean,store_id,quantity_sold", sales)
+    upload(main.import_inventory, import_path)
+    with database.get_db() as conn:
+        stock = {(e, s): q for e, s, q in conn.execute(
+            "SELECT product_ean, store_id, quantity FROM inventory")}
+
+    # Reference: the row-by-row semantics, replayed in CSV order
+    expected = []
+    for row_num, (ean, store_id, qty) in enumerate(sales, start=2):
+        if not ean:
+            expected.append({"row": row_num, "error": "Missing required fields"})
+        elif store_id == "x":
+            expected.append({"row": row_num, "error": "Invalid store_id or quantity format"})
+        elif qty <= 0:
+            expected.append({"row": row_num, "error": "Quantity sold must be greater than 0"})
+        elif store_id > 5:
+            expected.append({"row": row_num, "error": f"Store {store_id} does not exist"})
+        elif ean == "EAN99999999":
+            expected.append({"row": row_num, "error": f"Product {ean} does not exist"})
+        elif stock.get((ean, store_id), 0) < qty:
+            expected.append({"row": row_num, "error": "Insufficient stock. Available: "
+                             f"{stock.get((ean, store_id), 0)}, Sold: {qty}"})
+        else:
+            stock[ean, store_id] -= qty
+
+    ingest.SALES_WORKERS, ingest.SALES_CHUNK_ROWS = workers, 97
+    try:
+        summary = upload(main.record_sales, sales_path)
+    finally:
+        ingest.SALES_WORKERS, ingest.SALES_CHUNK_ROWS = 1, 50000
+        ingest.shutdown_sales_pool()
+
+    assert any("Insufficient stock" in e["error"] for e in expected)
+    assert summary.errors == expected
+    assert summary.success_count == len(sales) - len(expected)
+    with database.get_db() as conn:
+        assert {(e, s): q for e, s, q in conn.execute(
+            "SELECT product_ean, store_id, quantity FROM inventory")} == stock
+        rows = conn.execute("""
+            SELECT product_ean, store_id, -quantity_change FROM [transaction]
+            WHERE transaction_type = 'Sale' ORDER BY transaction_id
+        """).fetchall()
+    failed = {e["row"] for e in expected}
+    assert [tuple(r) for r in rows] == [s for n, s in enumerate(sales, start=2) if n not in failed]
+
+
+def test_transfers_replay_in_csv_order_and_atomic_mode_rolls_back(db_path, tmp_path):
+    import_path, transfer_path = os.path.join(tmp_path, "i.csv"), os.path.join(tmp_path, "t.csv")
+    write_csv(import_path, "ean,style_name,size,brand,style_design_code,model_no,store_id,quantity",
+              [("EAN00000001", "Dress", "M", "Rapheal", "", "", 1, 5)])
+    upload(main.import_inventory, import_path)
+    write_csv(transfer_path, "ean,source_store_id,destination_store_id,quantity", [
+        ("EAN00000001", 2, 3, 1),   # store 2 has nothing yet
+        ("EAN00000001", 1, 2, 4),
+        ("EAN00000001", 2, 3, 3),   # served by the row above
+        ("EAN00000001", 2, 2, 1),
+        ("EAN00000001", 1, 9, 1),
+        ("EAN99999999", 1, 2, 1),
+        ("EAN00000001", 1, 3, 2),
+    ])
+    expected_errors = [
+        {"row": 2, "error": "Insufficient stock. Available: 0, Requested: 1"},
+        {"row": 5, "error": "Invalid source or destination store"},
+        {"row": 6, "error": "Invalid source or destination store"},
+        {"row": 7, "error": "Product EAN99999999 does not exist"},
+        {"row": 8, "error": "Insufficient stock. Available: 1, Requested: 2"},
+    ]
+
+    def stock():
+        with database.get_db() as conn:
+            return dict(conn.execute("SELECT store_id, quantity FROM inventory ORDER BY store_id").fetchall())
+
+    with open(transfer_path, "rb") as f:
+        summary = asyncio.run(main.transfer_inventory(
+            file=UploadFile(file=f, filename="t.csv"), atomic=True, username="test"))
+    assert (summary.status, summary.success_count, summary.errors) == ("rejected", 0, expected_errors)
+    assert stock() == {1: 5}
+
+    summary = upload(main.transfer_inventory, transfer_path)
+    assert (summary.status, summary.success_count, summary.errors) == ("partial", 2, expected_errors)
+    assert stock() == {1: 1, 2: 1, 3: 3}
+
+
+def test_replayed_upload_returns_stored_summary_without_touching_stock(db_path, tmp_path):
+    import_path, sales_path, other_path = (os.path.join(tmp_path, n) for n in ("i.csv", "s.csv", "o.csv"))
+    write_import_csv(import_path, 70000, products=200)
+    upload(main.import_inventory, import_path)
+    rows = write_sales_csv(sales_path, 1, products=200)  # Every row in stock
+    write_csv(other_path, "ean,store_id,quantity_sold", [("EAN00000001", 2, 1)])
+
+    def state():
+        with database.get_db() as conn:
+            return (conn.execute("SELECT SUM(quantity) FROM inventory").fetchone()[0],
+                    conn.execute("SELECT COUNT(*) FROM [transaction]").fetchone()[0])
+
+    def send(path, key=None):
+        with open(path, "rb") as f:
+            start = time.perf_counter()
+            summary = asyncio.run(main.record_sales(
+                file=UploadFile(file=f, filename="s.csv"), idempotency_key=key, username="test"))
+            return summary, time.perf_counter() - start
+
+    first, first_s = send(sales_path, key="eod-1")
+    after_first = state()
+    assert first.success_count == rows and not first.replayed
+
+    # Same file without the key, and same key: both replay
+    for key in (None, "eod-1"):
+        replay, replay_s = send(sales_path, key)
+        assert replay.replayed
+        assert replay.model_dump(exclude={"replayed"}) == first.model_dump(exclude={"replayed"})
+        assert state() == after_first
+        assert replay_s < REPLAY_MAX_LATENCY_S, f"replay took {replay_s:.3f}s (first run {first_s:.3f}s)"
+
+    with pytest.raises(HTTPException) as conflict:
+        send(other_path, key="eod-1")
+    assert conflict.value.status_code == 409
+    assert state() == after_first
+
+    assert send(other_path, key="eod-2")[0].success_count == 1
+
+    # A key first sent with a file already uploaded without one is remembered for it
+    write_csv(other_path, "ean,store_id,quantity_sold", [("EAN00000002", 3, 1)])
+    assert send(other_path)[0].success_count == 1
+    assert send(other_path, key="eod-3")[0].replayed
+
+    # Outside the replay window the same bytes are a new day's file; a key still replays
+    with database.get_db() as conn:
+        conn.execute("UPDATE upload SET created_at = DATETIME('now', '-2 days')")
+        conn.commit()
+    before = state()
+    again = send(sales_path)[0]
+    assert not again.replayed and again.success_count > 0 and state() != before
+    assert send(sales_path, key="eod-1")[0].replayed
+    before = state()
+    assert send(other_path, key="eod-3")[0].replayed and state() == before
+
+
+def test_token_cache_honours_expiry_and_user_cache_invalidates(db_path):
+    from fastapi.security import HTTPAuthorizationCredentials
+
+    token = auth.jwt.encode({"sub": "tablet", "exp": int(time.time()) + 2}, auth.SECRET_KEY,
+                            algorithm=auth.ALGORITHM)
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    hits = auth.auth_cache_stats()["tokens"]["hits"]
+    assert auth.verify_token(credentials) == "tablet"
+    assert auth.verify_token(credentials) == "tablet"
+    assert auth.auth_cache_stats()["tokens"]["hits"] == hits + 1
+    time.sleep(max(0, auth.jwt.decode(token, options={"verify_signature": False})["exp"] - time.time()) + 0.1)
+    with pytest.raises(HTTPException) as expired:
+        auth.verify_token(credentials)
+    assert expired.value.detail == "Token expired"
+
+    database.seed_initial_data()
+    assert auth.authenticate_user("admin", "admin123")
+    with database.get_db() as conn:
+        conn.execute("UPDATE user SET password_hash = ? WHERE username = 'admin'",
+                     (auth.hash_password("changed"),))
+        conn.commit()
+    assert auth.authenticate_user("admin", "admin123")  # Still cached
+    auth.invalidate_user("admin")
+    assert not auth.authenticate_user("admin", "admin123")
+    assert auth.authenticate_user("admin", "changed")
+    auth.invalidate_user("admin")
+
+
+def test_login_upgrades_legacy_sha256_hash(db_path, monkeypatch):
+    import hashlib
+    from models import UserLogin
+
+    database.seed_initial_data()
+    auth.set_password_hash("admin", hashlib.sha256(b"admin123").hexdigest())
+
+    def stored():
+        with database.get_db() as conn:
+            return conn.execute("SELECT password_hash FROM user WHERE username = 'admin'").fetchone()[0]
+
+    with pytest.raises(HTTPException):
+        asyncio.run(main.login(UserLogin(username="admin", password="wrong")))
+    assert len(stored()) == 64
+
+    assert asyncio.run(main.login(UserLogin(username="admin", password="admin123"))).access_token
+    upgraded = stored()
+    assert upgraded.startswith(f"pbkdf2_sha256${auth.PBKDF2_ITERATIONS}$")
+    assert not auth.needs_rehash(upgraded)
+    assert asyncio.run(main.login(UserLogin(username="admin", password="admin123"))).access_token
+    assert stored() == upgraded
+
+    # The dummy hash for unknown users is computed off the event loop thread too
+    hashed_on = []
+    hash_password = auth.hash_password
+    monkeypatch.setattr(auth, "_dummy_hash", None)
+    monkeypatch.setattr(auth, "hash_password",
+                        lambda password: hashed_on.append(threading.get_ident()) or hash_password(password))
+    with pytest.raises(HTTPException):
+        asyncio.run(main.login(UserLogin(username="nobody", password="admin123")))
+    assert hashed_on and threading.get_ident() not in hashed_on
+    auth.shutdown_password_executor()
+
+
+def test_response_cache_serves_304_until_an_upload_commits(db_path, tmp_path):
+    import_path, sales_path = os.path.join(tmp_path, "i.csv"), os.path.join(tmp_path, "s.csv")
+    write_import_csv(import_path, 100, products=20)
+    upload(main.import_inventory, import_path)
+
+    # A different file per store, so the second upload is not an idempotent replay
+    for sold, setting in enumerate(("memory", f"sqlite:{os.path.join(tmp_path, 'cache.db')}"), start=1):
+        write_csv(sales_path, "ean,store_id,quantity_sold", [("EAN00000001", 2, 1)] * sold)
+        response_cache.RESPONSE_CACHE = setting
+        response_cache.reset_response_cache()
+        try:
+            def get(if_none_match=None):
+                response = Response()
+                result = asyncio.run(main.get_stock_status(
+                    response, if_none_match=if_none_match, username="test"))
+                return result, (result if isinstance(result, Response) else response).headers["etag"]
+
+            first, etag = get()
+            again, same_etag = get()
+            assert again == first and same_etag == etag
+            not_modified, _ = get(if_none_match=etag)
+            assert isinstance(not_modified, Response) and not_modified.status_code == 304
+            assert response_cache.get_response_cache().stats()["hits"] == 1
+
+            upload(main.record_sales, sales_path)
+            changed, new_etag = get(if_none_match=etag)
+            assert new_etag != etag
+            assert next(p for p in changed if p["ean"] == "EAN00000001")["stores"]["2"] == \
+                next(p for p in first if p["ean"] == "EAN00000001")["stores"]["2"] - sold
+        finally:
+            response_cache.RESPONSE_CACHE = "memory"
+            response_cache.reset_response_cache()
+
+
+def test_memory_response_cache_is_bounded_by_body_size():
+    import json
+
+    page = [{"ean": f"EAN{i:08d}"} for i in range(10)]
+    store = response_cache.MemoryStore(maxsize=100, ttl=60, maxbytes=4 * len(json.dumps(page)))
+    for key in "abcd":
+        store.set(key, 1, page)
+    assert all(store.get(key, 1) == page for key in "abcd")
+    store.set("e", 1, page)  # Over budget: the least recently used goes
+    assert store.get("a", 1) is None and store.get("e", 1) == page
+
+    # A body larger than the whole budget is served but never cached
+    store.set("full", 1, page * 10)
+    assert store.get("full", 1) is None and store.get("e", 1) == page
+
+
+def test_stock_status_pages_and_filters_match_the_full_list(db_path):
+    from queries import prefix_end
+
+    # Style names around the prefix bounds, including the highest code point
+    names = ["Aa", "Ab", "Abc", "Ab\U0001f600", "Ab\U0010ffff", "Ab\U0010ffffz", "Ac", "ab", "\U0010ffff"]
+    with database.get_db() as conn:
+        for i in range(60):
+            ean = f"EAN{i:08d}"
+            conn.execute("INSERT INTO product (ean, style_name, size, brand) VALUES (?, ?, 'M', ?)",
+                         (ean, names[i % len(names)], "Rapheal" if i % 3 else "Vogue"))
+            conn.executemany("INSERT INTO inventory (product_ean, store_id, quantity) VALUES (?, ?, ?)",
+                             [(ean, store_id, i * store_id % 3) for store_id in range(1, 6) if (i + store_id) % 4])
+        conn.commit()
+
+    def pages(limit, **filters):
+        items, cursor = [], None
+        while True:
+            response = Response()
+            page = asyncio.run(main.get_stock_status(response, limit=limit, cursor=cursor, username="test",
+                                                     **filters))
+            assert len(page) <= limit
+            items += page
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return items
+
+    full = asyncio.run(main.get_stock_status(Response(), username="test"))
+    assert [item["ean"] for item in full] == sorted(f"EAN{i:08d}" for i in range(60))
+    expected = [
+        ({}, full),
+        ({"brand": "Vogue"}, [item for item in full if item["brand"] == "Vogue"]),
+        # Products with a row at the store, still listing every store's quantity
+        ({"store_id": 2}, [item for item in full if "2" in item["stores"]]),
+        ({"in_stock": True}, [item for item in full if item["total_quantity"] > 0]),
+        ({"store_id": 2, "in_stock": True}, [item for item in full if item["stores"].get("2", 0) > 0]),
+    ] + [({"style_name": prefix}, [item for item in full if item["style_name"].startswith(prefix)])
+         for prefix in ("Ab", "A", "Ab\U0010ffff", "\U0010ffff")]
+    for filters, items in expected:
+        assert items, filters
+        assert asyncio.run(main.get_stock_status(Response(), username="test", **filters)) == items, filters
+        for limit in (1, 7, len(items)):
+            assert pages(limit, **filters) == items, (filters, limit)
+
+    assert prefix_end("Ab") == "Ac" and prefix_end("A\U0010ffff") == "B" and prefix_end("\U0010ffff") is None
+    assert prefix_end("\ud7ff") == "\ue000"
+
+
+def test_stock_status_ndjson_stream_matches_json_body(db_path, tmp_path):
+    import_path = os.path.join(tmp_path, "i.csv")
+    write_import_csv(import_path, 3000, products=1200)  # More products than one streamed chunk
+    upload(main.import_inventory, import_path)
+
+    async def read(**params):
+        response = await main.get_stock_status(Response(), format="ndjson", username="test", **params)
+        assert response.media_type == "application/x-ndjson"
+        return "".join([chunk async for chunk in response.body_iterator])
+
+    for params in ({}, {"limit": 7, "cursor": "EAN00000100"}, {"store_id": 3, "in_stock": True}):
+        body = asyncio.run(read(**params))
+        assert body.endswith("\n")
+        assert [json.loads(line) for line in body.splitlines()] == \
+            asyncio.run(main.get_stock_status(Response(), username="test", **params)), params
+    assert asyncio.run(read(brand="No such brand")) == ""
+
+
+def test_stock_exports_match_stock_status(db_path, tmp_path):
+    import gzip
+    import export
+
+    import_path = os.path.join(tmp_path, "i.csv")
+    write_import_csv(import_path, 300, products=40)
+    upload(main.import_inventory, import_path)
+    with database.get_db() as conn:
+        conn.execute("INSERT INTO product (ean, style_name, size, brand) VALUES ('EAN-ÉTÉ', 'x', 'M', 'y')")
+        conn.commit()
+
+    status = asyncio.run(main.get_stock_status(Response(), username="test"))
+    expected = {item["ean"]: {int(s): q for s, q in item["stores"].items()} for item in status}
+
+    async def body(fmt):
+        response = await main.export_stock(format=fmt, username="test")
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    eans, columns = export.read_columnar(asyncio.run(body("columnar")))
+    assert eans == sorted(expected)
+    assert set(columns) == {1, 2, 3, 4, 5}
+    for i, ean in enumerate(eans):
+        assert {s: q[i] for s, q in columns.items() if q[i]} == expected[ean]
+
+    lines = gzip.decompress(asyncio.run(body("csv.gz"))).decode().splitlines()
+    assert lines[0] == "ean,1,2,3,4,5"
+    assert [line.split(",")[0] for line in lines[1:]] == eans
+    assert all(list(map(int, line.split(",")[1:])) == [columns[s][i] for s in range(1, 6)]
+               for i, line in enumerate(lines[1:]))
+
+
+def test_as_of_stock_matches_full_ledger_replay(db_path, tmp_path):
+    from snapshots import nearest_base, replay_query, snapshot_if_due, take_snapshot
+
+    import_path = os.path.join(tmp_path, "i.csv")
+    write_import_csv(import_path, 40, products=8)
+    upload(main.import_inventory, import_path)  # Products only; history is backdated below
+    with database.get_db() as conn:
+        conn.execute("DELETE FROM [transaction]")
+        conn.execute("DELETE FROM inventory")
+        conn.commit()
+        for day in range(1, 21):
+            for i in range(30):
+                ean, store_id = f"EAN{(day + i) % 8:08d}", i % 5 + 1
+                change = 5 if (day + i) % 3 else -2
+                timestamp = f"2025-03-{day:02d} {i % 24:02d}:00:00"
+                conn.execute("""
+                    INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type, timestamp)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (ean, store_id, change, "Import" if change > 0 else "Sale", timestamp))
+                conn.execute("""
+                    INSERT INTO inventory (product_ean, store_id, quantity) VALUES (?, ?, ?)
+                    ON CONFLICT(product_ean, store_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                """, (ean, store_id, change))
+            conn.commit()
+            if day in (5, 12):
+                take_snapshot(conn, snapshot_ts=f"2025-03-{day:02d} 23:59:59")
+
+    kinds = set()
+    for as_of in ["2025-02-28", "2025-03-01 05:30:00", "2025-03-05", "2025-03-06T01:00:00",
+                  "2025-03-09 12:00:00", "2025-03-12", "2025-03-15", "2025-03-19 23:00:00",
+                  "2025-03-30", "2030-01-01"]:
+        result = asyncio.run(main.get_stock_status(Response(), as_of=as_of, username="test"))
+        actual = {(item["ean"], int(s)): q for item in result for s, q in item["stores"].items()}
+        with database.get_db() as conn:
+            normalized = main.parse_as_of(as_of)
+            kinds.add(nearest_base(conn.cursor(), normalized)[2])
+            expected = {(e, s): q for e, s, q in conn.execute(*replay_query(normalized))}
+        assert actual == expected, as_of
+
+    assert kinds == {"origin", "snapshot", "live"}
+    # Offsets are converted to ledger (UTC) time, not dropped
+    assert main.parse_as_of("2025-03-09T14:00:00+02:00") == "2025-03-09 12:00:00"
+    assert main.parse_as_of("2025-03-09T12:00:00Z") == "2025-03-09 12:00:00"
+    assert asyncio.run(main.get_stock_status(Response(), as_of="2025-03-09T14:00:00+02:00", username="test")) \
+        == asyncio.run(main.get_stock_status(Response(), as_of="2025-03-09 12:00:00", username="test"))
+    with pytest.raises(HTTPException):
+        asyncio.run(main.get_stock_status(Response(), as_of="last tuesday", username="test"))
+
+    # A periodic snapshot prunes the old ones and leaves cached views valid
+    with database.get_db() as conn:
+        version = response_cache.current_version(conn)
+    snapshot_ts = snapshot_if_due(0, keep_days=30)
+    with database.get_db() as conn:
+        assert response_cache.current_version(conn) == version
+        assert [row[0] for row in conn.execute("SELECT snapshot_ts FROM inventory_snapshot_meta")] == [snapshot_ts]
+        assert [row[0] for row in conn.execute("SELECT DISTINCT snapshot_ts FROM inventory_snapshot")] == [snapshot_ts]
+
+
+def test_stock_alerts_track_changed_pairs_like_a_full_scan(db_path, tmp_path):
+    import alerts
+    from models import ReorderPoint
+
+    paths = {name: os.path.join(tmp_path, f"{name}.csv") for name in ("import", "sales", "transfer", "restock")}
+    # 5 units of each EAN, EANn in store n % 5 + 1
+    write_import_csv(paths["import"], 100, products=20)
+    upload(main.import_inventory, paths["import"])
+
+    def current():
+        return {(a["ean"], a["store_id"]): a["quantity"]
+                for a in asyncio.run(main.get_stock_alerts(Response(), username="test"))}
+
+    def full_scan():
+        with database.get_db() as conn:
+            rows = conn.execute(alerts.THRESHOLD_QUERY.format(source="inventory c"),
+                                [alerts.DEFAULT_REORDER_POINT]).fetchall()
+        return {(ean, store_id): qty for ean, store_id, qty, threshold in rows
+                if threshold is not None and qty <= threshold}
+
+    assert current() == {}
+    result = asyncio.run(main.put_reorder_points([
+        ReorderPoint(brand="Rapheal", threshold=3),
+        ReorderPoint(ean="EAN00000001", store_id=2, threshold=10),
+    ], username="test"))
+    assert result["pairs_rechecked"] == 20
+    assert current() == full_scan() == {("EAN00000001", 2): 5}
+
+    write_csv(paths["sales"], "ean,store_id,quantity_sold", [("EAN00000000", 1, 2), ("EAN00000005", 1, 1)])
+    upload(main.record_sales, paths["sales"])
+    assert current() == full_scan() == {("EAN00000001", 2): 5, ("EAN00000000", 1): 3}
+
+    write_csv(paths["transfer"], "ean,source_store_id,destination_store_id,quantity", [("EAN00000001", 2, 3, 4)])
+    upload(main.transfer_inventory, paths["transfer"])
+    assert current() == full_scan() == {("EAN00000001", 2): 1, ("EAN00000000", 1): 3}
+
+    write_csv(paths["restock"], "ean,style_name,size,brand,style_design_code,model_no,store_id,quantity",
+              [("EAN00000000", "Style 0", "M", "Rapheal", "SD0", "M0", 1, 10)])
+    upload(main.import_inventory, paths["restock"])
+    assert current() == full_scan() == {("EAN00000001", 2): 1}
+
+    asyncio.run(main.put_reorder_points([ReorderPoint(ean="EAN00000001", store_id=2)], username="test"))
+    assert current() == full_scan() == {("EAN00000001", 2): 1}  # Brand threshold 3 still applies
+    with database.get_db() as conn:
+        assert alerts.rebuild_alerts(conn) == 1
+
+    with pytest.raises(HTTPException) as bad:
+        asyncio.run(main.put_reorder_points([ReorderPoint(ean="EAN00000001", threshold=1)], username="test"))
+    assert bad.value.status_code == 400
+
+
+def test_forecast_matches_day_by_day_smoothing_and_balances_transfers(db_path, tmp_path):
+    import forecast
+
+    eans = [f"EAN{i:08d}" for i in range(4)]
+    stock = {(ean, store_id): (0, 40, 3, 120)[i] + store_id for i, ean in enumerate(eans)
+             for store_id in range(1, 6)}
+    stock[eans[0], 5] = 200  # Overstocked: should send to the other stores
+    with database.get_db() as conn:
+        today = date.fromisoformat(conn.execute("SELECT DATE('now')").fetchone()[0])
+        conn.executemany("INSERT INTO product (ean, style_name, size, brand) VALUES (?, 'Style', 'M', 'Vogue')",
+                         [(ean,) for ean in eans])
+        conn.executemany("INSERT INTO inventory (product_ean, store_id, quantity) VALUES (?, ?, ?)",
+                         [key + (qty + 10,) for key, qty in stock.items()])
+        # Backdated sales, including days outside the history, and a transfer-only day
+        history = [(eans[i % 3], i % 5 + 1, str(today - timedelta(days=i * 7 % 800 + 1)), i % 6 + 1)
+                   for i in range(400)]
+        conn.executemany("""
+            INSERT INTO daily_movement (product_ean, store_id, day, movement, sold) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(day, store_id, product_ean) DO UPDATE
+            SET movement = movement + excluded.movement, sold = sold + excluded.sold
+        """, [row + (row[3],) for row in history] + [(eans[3], 1, str(today), 50, 0)])
+        conn.commit()
+    sales_path = os.path.join(tmp_path, "sales.csv")
+    write_csv(sales_path, "ean,store_id,quantity_sold", [(key[0], key[1], 10) for key in stock])
+    assert upload(main.record_sales, sales_path).success_count == 20
+
+    sold = {}
+    for ean, store_id, day, quantity in history + [key + (str(today), 10) for key in stock]:
+        age = (today - date.fromisoformat(day)).days
+        if age < forecast.FORECAST_HISTORY_DAYS:
+            sold.setdefault((ean, store_id), {})[age] = sold.get((ean, store_id), {}).get(age, 0) + quantity
+
+    def expected(key):
+        series = sold.get(key, {})
+        smoothed = 0.0
+        for age in range(forecast.FORECAST_HISTORY_DAYS - 1, -1, -1):
+            smoothed = forecast.FORECAST_ALPHA * series.get(age, 0) + (1 - forecast.FORECAST_ALPHA) * smoothed
+        recent = sum(q for age, q in series.items() if age < forecast.FORECAST_WINDOW_DAYS)
+        return recent / forecast.FORECAST_WINDOW_DAYS, smoothed
+
+    forecast.reset_forecast()
+    rows = asyncio.run(main.get_forecast(Response(), limit=1000, username="test"))
+    assert len(rows) == 20
+    assert [r["days_of_cover"] for r in rows] == sorted(r["days_of_cover"] for r in rows)
+    for row in rows:
+        key = (row["ean"], row["store_id"])
+        assert row["quantity"] == stock[key]
+        moving_average, smoothed = expected(key)
+        assert (row["velocity_ma"], row["velocity_ewma"]) == (round(moving_average, 3), round(smoothed, 3)), key
+        assert row["days_of_cover"] == round(stock[key] / smoothed, 1)
+
+    target = {key: math.ceil(expected(key)[1] * forecast.TARGET_COVER_DAYS) for key in stock}
+    for ean in eans:
+        moves = {r["store_id"]: r["suggested_transfer"] for r in rows if r["ean"] == ean}
+        assert sum(moves.values()) == 0
+        need = sum(max(target[ean, s] - stock[ean, s], 0) for s in moves)
+        spare = sum(max(stock[ean, s] - target[ean, s], 0) for s in moves)
+        assert sum(m for m in moves.values() if m > 0) == min(need, spare)
+        for store_id, move in moves.items():
+            # Receivers stay at or under target, senders at or over it
+            after = stock[ean, store_id] + move
+            assert after <= target[ean, store_id] if move > 0 else move == 0 or after >= target[ean, store_id]
+    assert any(r["suggested_transfer"] for r in rows)
+
+    top = asyncio.run(main.get_forecast(Response(), store_id=2, transfers_only=True,
+                                        order="suggested_transfer", limit=2, username="test"))
+    assert all(r["store_id"] == 2 and r["suggested_transfer"] for r in top)
+    assert [abs(r["suggested_transfer"]) for r in top] == sorted(
+        (abs(r["suggested_transfer"]) for r in rows if r["store_id"] == 2 and r["suggested_transfer"]),
+        reverse=True)[:2]
+    with pytest.raises(HTTPException) as bad:
+        asyncio.run(main.get_forecast(Response(), order="velocity", username="test"))
+    assert bad.value.status_code == 400
+
+    # Velocities survive other uploads and are recomputed after the next sales upload
+    with database.get_db() as conn:
+        cached = forecast.get_velocity(conn)
+    import_path = os.path.join(tmp_path, "import.csv")
+    write_import_csv(import_path, 5, products=5)
+    upload(main.import_inventory, import_path)
+    with database.get_db() as conn:
+        assert forecast.get_velocity(conn) is cached
+    write_csv(sales_path, "ean,store_id,quantity_sold", [(eans[3], 1, 1)])
+    upload(main.record_sales, sales_path)
+    with database.get_db() as conn:
+        assert forecast.get_velocity(conn) is not cached
+        before = conn.execute("SELECT day, store_id, product_ean, sold FROM daily_movement ORDER BY 1, 2, 3")
+        before = before.fetchall()
+        rebuild_daily_movement(conn)
+        assert [r for r in before if r[0] == str(today)] == conn.execute("""
+            SELECT day, store_id, product_ean, sold FROM daily_movement WHERE day = ? ORDER BY 1, 2, 3
+        """, (str(today),)).fetchall()
+
+
+def test_forecast_sees_products_imported_after_velocities_were_cached(db_path, tmp_path):
+    import forecast
+
+    forecast.reset_forecast()
+    assert asyncio.run(main.get_forecast(Response(), username="test")) == []
+
+    import_path = os.path.join(tmp_path, "import.csv")
+    write_import_csv(import_path, 2, products=2)
+    upload(main.import_inventory, import_path)
+    rows = asyncio.run(main.get_forecast(Response(), username="test"))
+    assert sorted(r["ean"] for r in rows) == ["EAN00000000", "EAN00000001"]
+
+
+def test_forecast_etag_changes_at_midnight(db_path, monkeypatch):
+    import datetime as dt
+    import forecast
+
+    class Clock(dt.datetime):
+        day = dt.datetime(2024, 3, 1, 23, 59, tzinfo=dt.timezone.utc)
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.day
+
+    monkeypatch.setattr(main, "datetime", Clock)
+    forecast.reset_forecast()
+    response = Response()
+    asyncio.run(main.get_forecast(response, username="test"))
+    etag = response.headers["ETag"]
+    assert asyncio.run(main.get_forecast(Response(), if_none_match=etag, username="test")).status_code == 304
+
+    Clock.day += dt.timedelta(minutes=1)
+    response = Response()
+    asyncio.run(main.get_forecast(response, if_none_match=etag, username="test"))
+    assert response.headers["ETag"] != etag
+
+
+def asgi_get(app, path, headers=()):
+    """Send one GET through the full ASGI stack; returns (status, body)."""
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(),
+             "query_string": b"", "headers": [(k.encode(), v.encode()) for k, v in headers],
+             "scheme": "http", "server": ("test", 80), "client": ("test", 1), "root_path": "",
+             "http_version": "1.1"}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return messages[0]["status"], b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def test_metrics_cover_upload_stages_routes_and_statements(db_path, tmp_path):
+    import_path, sales_path = os.path.join(tmp_path, "i.csv"), os.path.join(tmp_path, "s.csv")
+    write_import_csv(import_path, 500, products=50)
+    write_csv(sales_path, "ean,store_id,quantity_sold",
+              [(f"EAN{i % 50:08d}", i % 5 + 1, 1) for i in range(2500)])
+    metrics.reset()
+    upload(main.import_inventory, import_path)
+    upload(main.record_sales, sales_path)
+
+    token = auth.create_access_token("test")
+    status, _ = asgi_get(main.app, "/inventory/stock-status", [("authorization", f"Bearer {token}")])
+    assert status == 200
+    status, body = asgi_get(main.app, "/metrics")
+    assert status == 200
+    text = body.decode()
+
+    for stage in ("lock", "decode", "parse", "lookup", "validate", "write", "rollup", "commit"):
+        assert f'upload_stage_duration_seconds_count{{upload="sales",stage="{stage}"}} 1' in text, stage
+    assert 'upload_rows_total{upload="sales"} 2500' in text
+    assert 'upload_rows_total{upload="import"} 500' in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/inventory/stock-status",status="200"} 1' \
+        in text
+    statements = next(line for line in text.splitlines()
+                      if line.startswith('sqlite_statement_duration_seconds_count{endpoint="/inventory/stock-status"}'))
+    assert int(statements.split()[-1]) > 0
+    assert "sqlite_pool_wait_seconds_count " in text
+    assert 'executor_queued_calls{executor="db"} 0' in text
+
+
+def test_query_profile_reports_normalized_statements_and_slow_plans(db_path, tmp_path, monkeypatch):
+    import profiling
+
+    monkeypatch.setattr(profiling, "QUERY_PROFILE", True)
+    monkeypatch.setattr(profiling, "SLOW_QUERY_MS", 0)
+    profiling.stats.reset()
+    database.close_pool()  # Reconnect so the pooled connections are profiled
+    import_path, sales_path = os.path.join(tmp_path, "i.csv"), os.path.join(tmp_path, "s.csv")
+    write_import_csv(import_path, 100, products=20)
+    write_csv(sales_path, "ean,store_id,quantity_sold", [(f"EAN{i:08d}", 3, 1) for i in range(20)])
+    upload(main.import_inventory, import_path)
+    upload(main.record_sales, sales_path)
+
+    report = asyncio.run(main.get_query_profile(limit=500, username="admin"))
+    statements = {entry["statement"]: entry for entry in report["top"]}
+    totals = [entry["total_ms"] for entry in report["top"]]
+    assert totals == sorted(totals, reverse=True)
+
+    products = statements["SELECT ean FROM product"]
+    assert products["calls"] == 2 and products["rows"] == 20
+    stock = next(entry for sql, entry in statements.items() if "product_ean IN (?...)" in sql)
+    # Each product was imported into one store; store 3 holds 4 of them
+    assert list(stock["param_shapes"]) == ["(int, str x20)"] and stock["rows"] == 4
+    sales = statements["INSERT INTO [transaction] (product_ean, store_id, quantity_change, transaction_type, "
+                       "timestamp) VALUES (?, ?, ?, ?, ?)"]
+    assert sales["executemany"] and sales["rows"] == 4
+
+    plans = [entry["plan"] for entry in report["slow"] if "product_ean IN (?...)" in entry["statement"]]
+    assert plans and any("USING" in step for step in plans[0]), plans
+
+    with pytest.raises(HTTPException) as forbidden:
+        asyncio.run(main.get_query_profile(username="someone"))
+    assert forbidden.value.status_code == 403
+
+
+def test_datagen_is_seeded_and_suite_reports_regressions():
+    import benchmark
+    import datagen
+
+    eans = [item[0] for item in datagen.catalogue(50)]
+    assert len(set(eans)) == 50
+    for ean in eans:
+        digits = list(map(int, ean))
+        assert len(ean) == 13 and sum(d * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10 == 0
+
+    ledger = list(datagen.ledger(5000, eans, years=2))
+    assert ledger == list(datagen.ledger(5000, eans, years=2))
+    assert len(ledger) == 5000
+    assert [row[4] for row in ledger] == sorted(row[4] for row in ledger)
+    balances = {}
+    for ean, store_id, change, _, _ in ledger:
+        balances[ean, store_id] = balances.get((ean, store_id), 0) + change
+        assert balances[ean, store_id] >= 0
+
+    cache_setting, response_cache.RESPONSE_CACHE = response_cache.RESPONSE_CACHE, "off"
+    response_cache.reset_response_cache()
+    try:
+        report = benchmark.run_suite([500], repeat=1)
+    finally:
+        response_cache.RESPONSE_CACHE = cache_setting
+        response_cache.reset_response_cache()
+    json.dumps(report)
+    names = {r["benchmark"] for r in report["results"]}
+    assert {"import", "transfer", "sales", "stock-status page", "analytics", "timeseries weekly"} <= names
+    uploads = [r for r in report["results"] if r["benchmark"] in ("import", "transfer", "sales")]
+    assert all(r["accepted"] == 500 for r in uploads)
+
+    slower = {"meta": report["meta"], "results": [
+        {**r, "seconds": r["seconds"] * 3 + 1} if r["benchmark"] == "sales" else r for r in report["results"]]}
+    assert [r["benchmark"] for r in benchmark.compare(slower, report, 0.25)] == ["sales"]
+    assert benchmark.compare(report, report, 0.25) == []
+
+
+def test_analytics_top_k_matches_full_ranking(db_path, tmp_path):
+    import_path, sales_path = os.path.join(tmp_path, "i.csv"), os.path.join(tmp_path, "s.csv")
+    write_import_csv(import_path, 500, products=50)
+    write_csv(sales_path, "ean,store_id,quantity_sold",
+              [(f"EAN{i % 50:08d}", i % 5 + 1, i % 7 + 1) for i in range(400)])
+    upload(main.import_inventory, import_path)
+    upload(main.record_sales, sales_path)
+
+    with database.get_db() as conn:
+        ranking = conn.execute(*movement_query()).fetchall()
+    ranking = sorted(ranking, key=lambda r: (-r[1], r[0]))
+    for k in (1, 5, 20):
+        result = asyncio.run(main.get_analytics(k=k, username="test"))
+        assert [(i["ean"], i["movement"]) for i in result.most_moving] == [tuple(r) for r in ranking[:k]]
+        assert [(i["ean"], i["movement"]) for i in result.least_moving] == [tuple(r) for r in ranking[::-1][:k]]
+
+
+def test_timeseries_buckets_sum_to_rollup_totals(db_path):
+    with database.get_db() as conn:
+        conn.executemany("INSERT INTO product (ean, style_name, size, brand) VALUES (?, 'Style', 'M', ?)",
+                         [("EAN1", "Rapheal"), ("EAN2", "Vogue")])
+        conn.executemany("INSERT INTO daily_movement (product_ean, store_id, day, movement) VALUES (?, ?, ?, ?)",
+                         [("EAN1", 1, "2024-12-29", 3), ("EAN1", 1, "2024-12-30", 4),
+                          ("EAN2", 2, "2025-01-05", 5), ("EAN2", 1, "2025-01-06", 6)])
+        conn.commit()
+
+    weekly = asyncio.run(main.get_analytics_timeseries(bucket="week", group_by="store_id", username="test"))
+    assert weekly.columns == {
+        "bucket": ["2024-12-23", "2024-12-30", "2025-01-06", "2024-12-30"],
+        "store_id": [1, 1, 1, 2],
+        "movement": [3, 4, 6, 5],
+    }
+    monthly = asyncio.run(main.get_analytics_timeseries(bucket="month", group_by="brand", username="test"))
+    assert monthly.columns == {
+        "bucket": ["2024-12-01", "2025-01-01"],
+        "brand": ["Rapheal", "Vogue"],
+        "movement": [7, 11],
+    }
+
+
+def test_health_stays_responsive_during_background_upload(db_path, tmp_path):
+    jobs.JOB_DIR = os.path.join(tmp_path, "jobs")
+    seed_path, sales_path = os.path.join(tmp_path, "seed.csv"), os.path.join(tmp_path, "sales.csv")
+    write_import_csv(seed_path, 500, products=100)
+    upload(main.import_inventory, seed_path)
+    with database.get_db() as conn:
+        conn.execute("UPDATE inventory SET quantity = 1000000000")
+        conn.commit()
+    rows = write_sales_csv(sales_path, 10)
+
+    async def scenario():
+        with open(sales_path, "rb") as f:
+            response = await main.record_sales(
+                file=UploadFile(file=f, filename="sales.csv"), background=True, username="test")
+        job_id = json.loads(response.body)["job_id"]
+
+        latencies = []
+        while True:
+            job = await main.get_job_status(job_id, username="test")
+            if job.status in ("done", "failed"):
+                return job, latencies
+            start = time.perf_counter()
+            await main.health_check()
+            await asyncio.sleep(0.005)
+            latencies.append(time.perf_counter() - start - 0.005)
+
+    job, latencies = asyncio.run(scenario())
+    jobs.shutdown_jobs()
+
+    print(f"\n{len(latencies)} /health calls during the job, max {max(latencies) * 1000:.1f} ms")
+    assert job.status == "done", job.detail
+    assert job.rows_processed == rows
+    assert job.result.success_count == rows
+    assert len(latencies) > 10
+    assert max(latencies) < HEALTH_MAX_LATENCY_S
+
+
+def test_job_errors_count_as_rows_are_read_and_orphaned_jobs_fail(db_path, tmp_path, monkeypatch):
+    from models import JobStatus
+
+    # Field errors count before the chunk they belong to is applied
+    for engine, row in ((ingest.sales_rows, {"ean": "", "store_id": "1", "quantity_sold": "1"}),
+                        (ingest.transfer_rows, {"ean": "EAN1", "source_store_id": "1",
+                                                "destination_store_id": "2", "quantity": "0"})):
+        errors, seen = [], []
+
+        def reader():
+            for _ in range(10):
+                seen.append(len(errors))
+                yield row
+
+        with database.get_db() as conn:
+            engine(conn.cursor(), reader(), errors)
+            conn.rollback()
+        assert seen == list(range(10)) and len(errors) == 10, engine.__name__
+
+    monkeypatch.setattr(jobs, "JOB_DIR", str(tmp_path))
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    states = {"a" * 32: ("running", exited.pid), "b" * 32: ("queued", os.getpid()),
+              "c" * 32: ("running", os.getppid()), "d" * 32: ("done", exited.pid)}
+    for job_id, (status, pid) in states.items():
+        with open(os.path.join(tmp_path, f"{job_id}.json"), "w") as f:
+            json.dump(dict(JobStatus(job_id=job_id, kind="sales", status=status).model_dump(), pid=pid), f)
+
+    assert jobs.fail_orphaned_jobs() == 2
+    assert {job_id: jobs.get_job(job_id).status for job_id in states} == \
+        {"a" * 32: "failed", "b" * 32: "failed", "c" * 32: "running", "d" * 32: "done"}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["memory-probe"]:
+        memory_probe(*sys.argv[2:4])